@@ -16,6 +16,7 @@ from django.utils.timezone import timedelta, datetime
 
 from threepio import logger
 
+from allocation.intervals import HistoryIntervalIndex
 from allocation.models import AllocationResult, GlobalRule, InstanceResult,\
     InstanceRule, InstanceHistoryResult
 
@@ -73,6 +74,8 @@ def calculate_allocation(allocation, print_logs=False):
             instance_rules.append(rule)
         else:
             raise Exception("Unknown Type of Rule: %s" % rule)
+    calculate_instance_results = _get_instance_results_calculator(
+        allocation, instance_rules, print_logs=print_logs)
     time_forward = timedelta(0)
     for current_period in current_result.time_periods:
         if current_result.carry_forward and time_forward:
@@ -85,24 +88,9 @@ def calculate_allocation(allocation, print_logs=False):
                              % current_period.total_credit)
         # Second loop - Go through all the instances and apply
         #              the specific rules (This loop relates to time USED)
-        instance_results = []
-
-        for instance in allocation.instances:
-            # "Chatty" Warning - Uncomment at your own risk
-            # logger.debug("> > Calculating Instance history:%s"
-            #             % instance.identifier)
-            if not instance:
-                continue
-            history_list = _calculate_instance_history_list(
-                instance, instance_rules,
-                current_period.start_counting_date,
-                current_period.stop_counting_date,
-                print_logs=print_logs)
-            if not history_list:
-                continue
-            instance_result = InstanceResult(
-                identifier=instance.identifier, history_list=history_list)
-            instance_results.append(instance_result)
+        instance_results = calculate_instance_results(
+            current_period.start_counting_date,
+            current_period.stop_counting_date)
 
         if print_logs:
             logger.debug("> > Instance history Results:")
@@ -123,6 +111,47 @@ def calculate_allocation(allocation, print_logs=False):
     return current_result
 
 
+def _get_instance_results_calculator(allocation, instance_rules,
+                                     print_logs=False):
+    """
+    Returns a function(start_date, end_date) that calculates the
+    InstanceResults of a TimePeriodResult, using the engine selected
+    by `allocation.engine`.
+    """
+    engine = getattr(allocation, 'engine', None) or 'python'
+    if engine == 'numpy':
+        from allocation.vectorized import HistoryColumns
+        return HistoryColumns(
+            allocation.instances, instance_rules).instance_results
+    elif engine != 'python':
+        raise Exception("Unknown allocation engine: %s" % engine)
+
+    # Index each instance's history once, not once per time period.
+    history_indexes = [HistoryIntervalIndex(instance.history)
+                       if instance else None
+                       for instance in allocation.instances]
+
+    def calculate_instance_results(start_date, end_date):
+        instance_results = []
+        for instance, history_index in zip(allocation.instances,
+                                           history_indexes):
+            # "Chatty" Warning - Uncomment at your own risk
+            # logger.debug("> > Calculating Instance history:%s"
+            #             % instance.identifier)
+            if not instance:
+                continue
+            history_list = _calculate_instance_history_list(
+                instance, instance_rules, start_date, end_date,
+                print_logs=print_logs, history_index=history_index)
+            if not history_list:
+                continue
+            instance_result = InstanceResult(
+                identifier=instance.identifier, history_list=history_list)
+            instance_results.append(instance_result)
+        return instance_results
+    return calculate_instance_results
+
+
 def _multiply_time_delta(timedelta1, timedelta2):
     time_seconds = timedelta1.total_seconds() *\
         timedelta2.total_seconds()
@@ -130,28 +159,30 @@ def _multiply_time_delta(timedelta1, timedelta2):
 
 
 def _calculate_instance_history_list(instance, rules, start_date, end_date,
-                                     print_logs=False):
+                                     print_logs=False, history_index=None):
     """
     Given an instance and a set of 'InstanceRules'
     Calculate the time used for every history
+
+    `history_index` is a HistoryIntervalIndex of `instance.history`
+    (built when missing), so only the histories overlapping
+    [start_date, end_date] are evaluated; the rest used no time.
     """
+    if history_index is None:
+        history_index = HistoryIntervalIndex(instance.history)
     # Calculate time used by applying rules to each history and keeping a
     # running total for each status
-    history_list = []
-    for history in instance.history:
-        history_result = InstanceHistoryResult(status_name=history.status)
-        if history.end_date and history.end_date < start_date:
-            history_result.clock_time = timedelta(0)
-            history_list.append(history_result)
-            continue
+    history_list = [InstanceHistoryResult(status_name=history.status)
+                    for history in history_index.histories]
+    for position in history_index.overlapping(start_date, end_date):
+        history = history_index.histories[position]
+        history_result = history_list[position]
 
         clock_time = _get_clock_time(history, start_date, end_date,
                                      print_logs=print_logs)
 
         if clock_time == timedelta(0):
             # do we need this? seems like it could cause unforseen problems
-            history_result.clock_time = clock_time
-            history_list.append(history_result)
             continue
 
         # NOTE: There are some limitations to an implementation like this
@@ -164,7 +195,6 @@ def _calculate_instance_history_list(instance, rules, start_date, end_date,
 
         if _get_burn_rate_test(history, end_date):
             history_result.burn_rate += time_per_second
-        history_list.append(history_result)
 
     return history_list
 
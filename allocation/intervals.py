@@ -0,0 +1,65 @@
+"""
+Sorted interval index over (Instance) histories.
+
+Any object with a `start_date` and an (optional) `end_date` can be indexed.
+Lookups use `bisect` over the start dates and over the running maximum of
+the end dates, so finding the history that contains a timestamp, or the
+histories that overlap a window, is logarithmic for non-overlapping
+histories (the usual case for an instance's status history).
+"""
+from bisect import bisect_left, bisect_right
+
+from django.utils.timezone import datetime, utc
+
+# Histories without an end_date never end.
+_NO_END_DATE = datetime.max.replace(tzinfo=utc)
+
+
+class HistoryIntervalIndex(object):
+
+    def __init__(self, histories):
+        self.histories = list(histories)
+        # Positions in `histories`, sorted by start_date
+        # (stable, so equal start dates keep their list order)
+        self.order = sorted(xrange(len(self.histories)),
+                            key=lambda position:
+                                self.histories[position].start_date)
+        self.starts = [self.histories[position].start_date
+                       for position in self.order]
+        self.ends = [self.histories[position].end_date or _NO_END_DATE
+                     for position in self.order]
+        # Running maximum of the end dates -- sorted, so it can be bisected.
+        self.max_ends = []
+        max_end = None
+        for end in self.ends:
+            max_end = end if max_end is None or end > max_end else max_end
+            self.max_ends.append(max_end)
+
+    def __len__(self):
+        return len(self.histories)
+
+    def find(self, timestamp):
+        """
+        Return the last history with start_date <= timestamp <= end_date,
+        or None. For histories listed in start_date order this matches:
+        [h for h in histories if h.start_date <= ts and
+         (not h.end_date or h.end_date >= ts)][-1]
+        """
+        idx = bisect_right(self.starts, timestamp) - 1
+        # Every history at or before `idx` starts before `timestamp`;
+        # stop once none of them ends after it.
+        while idx >= 0 and self.max_ends[idx] >= timestamp:
+            if self.ends[idx] >= timestamp:
+                return self.histories[self.order[idx]]
+            idx -= 1
+        return None
+
+    def overlapping(self, start_date, end_date):
+        """
+        Return the positions (in the original list order) of every history
+        that overlaps [start_date, end_date].
+        """
+        low = bisect_left(self.max_ends, start_date)
+        high = bisect_right(self.starts, end_date)
+        return sorted(self.order[idx] for idx in xrange(low, high)
+                      if self.ends[idx] >= start_date)
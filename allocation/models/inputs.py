@@ -263,7 +263,7 @@ class AllocationRecharge(AllocationIncrease):
 class Allocation(object):
 
     def __init__(self, credits, rules, instances,
-                 start_date, end_date, interval_delta=None):
+                 start_date, end_date, interval_delta=None, engine='python'):
         validate_interval(start_date, end_date)
         # TODO: Sort so that Recharges happen PRIOR to Increases on EQUAL dates
         self.credits = credits
@@ -272,6 +272,8 @@ class Allocation(object):
         self.start_date = start_date
         self.end_date = end_date
         self.interval_delta = interval_delta
+        # 'python' or 'numpy' -- See allocation.engine.calculate_allocation
+        self.engine = engine
 
     def __repr__(self):
         return self.__unicode__()
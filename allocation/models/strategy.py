@@ -26,10 +26,11 @@ class PythonAllocationStrategy(object):
     """
 
     def __init__(self, counting_behavior,
-                 recharge_behaviors=[], rule_behaviors=[]):
+                 recharge_behaviors=[], rule_behaviors=[], engine='python'):
         self.counting_behavior = counting_behavior
         self.recharge_behaviors = recharge_behaviors
         self.rule_behaviors = rule_behaviors
+        self.engine = engine
 
     def get_instance_list(self, identity, limit_instances=[], limit_history=[]):
         from service.monitoring import _core_instances_for
@@ -85,7 +86,8 @@ class PythonAllocationStrategy(object):
             instances=instances,
             start_date=self.counting_behavior.start_date,
             end_date=self.counting_behavior.end_date,
-            interval_delta=self.counting_behavior.interval_delta)
+            interval_delta=self.counting_behavior.interval_delta,
+            engine=self.engine)
 
     def __repr__(self):
         return self.__unicode__()
@@ -23,6 +23,7 @@ from django.utils.timezone import datetime, timedelta
 import unittest
 
 from allocation import engine, validate_interval
+from allocation.intervals import HistoryIntervalIndex
 from allocation.models import Provider, Machine, Size, Instance,\
     InstanceHistory
 from allocation.models import Allocation, MultiplySizeCPU, MultiplySizeRAM,\
@@ -522,6 +523,119 @@ class TestAllocationEngine(AllocationTestCase):
         self.assertTotalRuntimeEquals(allocation, timedelta(days=45))
 
 
+
+class TestVectorizedAllocationEngine(TestAllocationEngine):
+    """
+    Run the TestAllocationEngine scenarios with the 'numpy' engine
+    """
+
+    def _calculate_allocation(self, allocation):
+        allocation.engine = 'numpy'
+        return engine.calculate_allocation(allocation)
+
+    def test_results_match_python_engine(self):
+        start_time = datetime(2014, 7, 4, hour=12, tzinfo=pytz.utc)
+        sizes = ["test.tiny", "test.small", "test.medium", "test.large"]
+        for idx, size in enumerate(sizes):
+            helper = InstanceHelper()
+            history_start = start_time + timedelta(hours=idx * 7, seconds=idx)
+            for status in ["build", "active", "suspended", "active"]:
+                history_end = history_start + timedelta(days=idx + 1, minutes=13)
+                helper.add_history_entry(history_start, history_end,
+                                         size=size, status=status)
+                history_start = history_end
+            # Still running at the end of the window
+            helper.add_history_entry(history_start, None, size=size)
+            self.allocation_helper.add_instance(
+                helper.to_instance("Instance %s" % size))
+        self.allocation_helper.set_interval(relativedelta(days=3))
+        allocation = self.allocation_helper.to_allocation()
+
+        python_result = engine.calculate_allocation(allocation)
+        numpy_result = self._calculate_allocation(allocation)
+
+        self.assertEqual(len(python_result.time_periods),
+                         len(numpy_result.time_periods))
+        for python_period, numpy_period in zip(python_result.time_periods,
+                                               numpy_result.time_periods):
+            self.assertEqual(python_period.total_credit,
+                             numpy_period.total_credit)
+            self.assertEqual(
+                [(result.identifier,
+                  [(history.status_name, history.clock_time,
+                    history.total_time, history.burn_rate)
+                   for history in result.history_list])
+                 for result in python_period.instance_results],
+                [(result.identifier,
+                  [(history.status_name, history.clock_time,
+                    history.total_time, history.burn_rate)
+                   for history in result.history_list])
+                 for result in numpy_period.instance_results])
+        self.assertEqual(python_result.total_difference(),
+                         numpy_result.total_difference())
+
+
+def _linear_find(histories, timestamp):
+    matches = [history for history in histories
+               if history.start_date <= timestamp and
+               (not history.end_date or history.end_date >= timestamp)]
+    return matches[-1] if matches else None
+
+
+def _create_history_list(history_count, start_time):
+    """
+    Returns `history_count` back-to-back InstanceHistory entries,
+    the last one still running.
+    """
+    histories = []
+    history_start = start_time
+    for number in xrange(history_count):
+        history_end = history_start + timedelta(hours=1 + number % 5) \
+            if number < history_count - 1 else None
+        histories.append(InstanceHistory(
+            status='active' if number % 2 else 'suspended', size=tiny_size,
+            start_date=history_start, end_date=history_end))
+        history_start = history_end
+    return histories
+
+
+class TestHistoryIntervalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.start_time = datetime(2014, 7, 1, tzinfo=pytz.utc)
+        self.histories = _create_history_list(50, self.start_time)
+        # An overlapping (long) history, listed in start_date order
+        self.histories.insert(10, InstanceHistory(
+            status='active', size=tiny_size,
+            start_date=self.histories[10].start_date,
+            end_date=self.histories[30].end_date))
+        self.history_index = HistoryIntervalIndex(self.histories)
+        self.timestamps = [self.start_time + timedelta(minutes=37 * number)
+                           for number in xrange(-5, 400)]
+
+    def test_find_matches_linear_scan(self):
+        for timestamp in self.timestamps:
+            self.assertIs(self.history_index.find(timestamp),
+                          _linear_find(self.histories, timestamp))
+
+    def test_find_on_boundary_returns_last_history(self):
+        boundary = self.histories[1].start_date
+        self.assertIs(self.history_index.find(boundary), self.histories[1])
+
+    def test_find_empty(self):
+        self.assertIsNone(HistoryIntervalIndex([]).find(self.start_time))
+
+    def test_overlapping_matches_linear_scan(self):
+        for window_start in self.timestamps[::10]:
+            window_end = window_start + timedelta(hours=9)
+            expected = [
+                position for position, history in enumerate(self.histories)
+                if history.start_date <= window_end and
+                (not history.end_date or history.end_date >= window_start)]
+            self.assertEqual(
+                self.history_index.overlapping(window_start, window_end),
+                expected)
+
 # From the REPL
 def repl_profile_test_1():
     """
@@ -685,3 +799,38 @@ def repl_apply_strategy(identity):
     alloc_input = strategy.apply(identity, allocation)
     result = engine.calculate_allocation(alloc_input)
     return result
+
+
+
+def repl_benchmark_history_index(instance_count=10, history_count=5000,
+                                 event_count=1000):
+    """
+    Micro-benchmark: map `event_count` timestamps per instance onto
+    instances carrying `history_count` histories, with the linear scan
+    and with the HistoryIntervalIndex (including building the index).
+    """
+    import timeit
+    start_time = datetime(2015, 1, 1, tzinfo=pytz.utc)
+    instances = [_create_history_list(history_count, start_time)
+                 for _ in xrange(instance_count)]
+    timestamps = [start_time + timedelta(minutes=(number * 7919) % (
+                  history_count * 180)) for number in xrange(event_count)]
+
+    def linear():
+        return [[_linear_find(histories, timestamp)
+                 for timestamp in timestamps] for histories in instances]
+
+    def indexed():
+        results = []
+        for histories in instances:
+            history_index = HistoryIntervalIndex(histories)
+            results.append([history_index.find(timestamp)
+                            for timestamp in timestamps])
+        return results
+
+    assert linear() == indexed()
+    linear_time = timeit.timeit(linear, number=1)
+    indexed_time = timeit.timeit(indexed, number=1)
+    print("Linear scan: %.3fs Interval index: %.3fs (%.1fx)" % (
+        linear_time, indexed_time, linear_time / indexed_time))
+    return linear_time, indexed_time
@@ -0,0 +1,165 @@
+"""
+The Vectorized Allocation Engine --
+
+An alternate backend for `allocation.engine.calculate_allocation`.
+
+Every InstanceHistory of the Allocation is laid out ONCE as NumPy columns
+(start, end, status, size, machine, provider). The InstanceRules are then
+applied to the whole column as masks (Ignore*Rule) or column products
+(Multiply*Rule), and each TimePeriodResult is computed as a single clipped
+overlap over those columns.
+
+Results are identical to the 'python' engine:
+* Dates and clock times are kept as integer microseconds.
+* `total_time` uses the same float arithmetic as `_multiply_time_delta`.
+* Rules this engine does not know about are applied per-history with
+  `rule.apply_rule`, exactly as the 'python' engine would.
+"""
+import numpy as np
+
+from django.utils.timezone import timedelta, datetime, utc
+
+from allocation.models import InstanceResult, InstanceHistoryResult,\
+    IgnoreStatusRule, IgnoreMachineRule, IgnoreProviderRule,\
+    MultiplyBurnTime, MultiplySizeCPU, MultiplySizeDisk, MultiplySizeRAM
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=utc)
+# Histories without an end_date run 'forever'
+_NO_END_DATE = np.iinfo(np.int64).max
+_ONE_SECOND = 10 ** 6
+
+
+def _to_microseconds(date):
+    delta = date - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * _ONE_SECOND \
+        + delta.microseconds
+
+
+def _timedelta_microseconds(tdelta):
+    return (tdelta.days * 86400 + tdelta.seconds) * _ONE_SECOND \
+        + tdelta.microseconds
+
+
+class HistoryColumns(object):
+    """
+    The (instance, history) pairs of an Allocation, as NumPy columns.
+    """
+
+    def __init__(self, instances, rules):
+        self.instances = []
+        self.histories = []
+        # Index of the first history of each instance (plus the final 'stop')
+        self.offsets = [0]
+        for instance in instances:
+            if not instance or not instance.history:
+                continue
+            self.instances.append(instance)
+            self.histories.extend(
+                (instance, history) for history in instance.history)
+            self.offsets.append(len(self.histories))
+
+        self.status_names = [history.status for _, history in self.histories]
+        self.start = np.array(
+            [_to_microseconds(history.start_date)
+             for _, history in self.histories], dtype=np.int64)
+        self.end = np.array(
+            [_to_microseconds(history.end_date)
+             if history.end_date else _NO_END_DATE
+             for _, history in self.histories], dtype=np.int64)
+        self.time_per_second = self._time_per_second(rules)
+
+    def _column(self, value_for, dtype=np.float64):
+        return np.array(
+            [value_for(instance, history)
+             for instance, history in self.histories], dtype=dtype)
+
+    def _matches(self, rule, value_for):
+        values = rule.value if isinstance(rule.value, list) else [rule.value]
+        return self._column(
+            lambda instance, history: value_for(instance, history) in values,
+            dtype=bool)
+
+    def _time_per_second(self, rules):
+        """
+        Running time (in microseconds) per second of clock time, with every
+        InstanceRule applied -- see `engine._running_time_per_second`
+        """
+        running_time = np.full(len(self.histories), _ONE_SECOND,
+                               dtype=np.float64)
+        for rule in rules:
+            rule_type = type(rule)
+            if rule_type is IgnoreStatusRule:
+                running_time[self._matches(
+                    rule, lambda instance, history: history.status)] = 0
+            elif rule_type is IgnoreMachineRule:
+                running_time[self._matches(
+                    rule,
+                    lambda instance, history: instance.machine.identifier)] = 0
+            elif rule_type is IgnoreProviderRule:
+                running_time[self._matches(
+                    rule,
+                    lambda instance, history: instance.provider.identifier)] = 0
+            elif rule_type is MultiplyBurnTime:
+                running_time = np.round(running_time * rule.multiplier)
+            elif rule_type is MultiplySizeCPU:
+                running_time = np.round(running_time * self._column(
+                    lambda instance, history:
+                        rule.multiplier * history.size.cpu))
+            elif rule_type is MultiplySizeDisk:
+                running_time = np.round(running_time * self._column(
+                    lambda instance, history:
+                        rule.multiplier * history.size.disk))
+            elif rule_type is MultiplySizeRAM:
+                running_time = np.round(running_time * self._column(
+                    lambda instance, history:
+                        rule.multiplier * history.size.ram))
+            else:
+                # Unknown to this engine, let the rule apply itself.
+                running_time = np.array([
+                    _timedelta_microseconds(rule.apply_rule(
+                        instance, history, timedelta(microseconds=value)))
+                    for (instance, history), value
+                    in zip(self.histories, running_time.tolist())],
+                    dtype=np.float64)
+        return running_time.astype(np.int64)
+
+    def instance_results(self, start_date, end_date):
+        """
+        The InstanceResults for the period [start_date, end_date]
+        -- see `engine._calculate_instance_history_list`
+        """
+        start = _to_microseconds(start_date)
+        end = _to_microseconds(end_date)
+        # Clip every history to the period
+        in_period = (self.end >= start) & (self.start <= end)
+        clock_time = np.where(
+            in_period,
+            np.minimum(self.end, end) - np.maximum(self.start, start),
+            0)
+        counted = clock_time != 0
+        total_seconds = (clock_time / float(_ONE_SECOND)) *\
+            (self.time_per_second / float(_ONE_SECOND))
+        # Histories that carry forward PAST the period are 'burning' time
+        burning = counted & (self.end >= end)
+
+        history_results = [InstanceHistoryResult(status_name=status_name)
+                           for status_name in self.status_names]
+        # Only the histories that used time need more than the defaults
+        counted_rows = np.flatnonzero(counted)
+        for row, clock, total, burn_rate in zip(
+                counted_rows.tolist(),
+                clock_time[counted_rows].tolist(),
+                total_seconds[counted_rows].tolist(),
+                np.where(burning, self.time_per_second, 0)[
+                    counted_rows].tolist()):
+            history_result = history_results[row]
+            history_result.clock_time = timedelta(microseconds=clock)
+            history_result.total_time = timedelta(seconds=total)
+            if burn_rate:
+                history_result.burn_rate = timedelta(microseconds=burn_rate)
+        return [
+            InstanceResult(
+                identifier=instance.identifier,
+                history_list=history_results[
+                    self.offsets[idx]:self.offsets[idx + 1]])
+            for idx, instance in enumerate(self.instances)]
@@ -2,6 +2,8 @@ import uuid
 from unittest import skip, skipIf
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from rest_framework.test import APIClient
@@ -10,10 +12,10 @@ from rest_framework.test import APITestCase, APIRequestFactory, force_authentica
 from api.tests.factories import (
     GroupFactory, UserFactory, AnonymousUserFactory, InstanceFactory, InstanceHistoryFactory, InstanceStatusFactory, SizeFactory,
     ImageFactory, ApplicationVersionFactory, InstanceSourceFactory, ProviderMachineFactory, IdentityFactory, ProviderFactory,
-    IdentityMembershipFactory, QuotaFactory)
+    IdentityMembershipFactory, QuotaFactory, AllocationSourceFactory)
 from .base import APISanityTestCase
 from api.v2.views import InstanceViewSet
-from core.models import AtmosphereUser
+from core.models import AtmosphereUser, InstanceAllocationSourceSnapshot
 
 
 class InstanceTests(APITestCase, APISanityTestCase):
@@ -137,3 +139,25 @@ class InstanceTests(APITestCase, APISanityTestCase):
         self.assertEquals(data['status'], 'active')
         self.assertEquals(data['activity'], '')
 
+    def test_list_query_count_independent_of_page_size(self):
+        """Listing a full page should cost the same queries as a single row."""
+        allocation_source = AllocationSourceFactory.create(
+            name='TG-INSTANCE-LIST', compute_allowed=1000)
+        for instance in [self.active_instance, self.networking_instance,
+                         self.deploying_instance, self.deploy_error_instance]:
+            InstanceAllocationSourceSnapshot.objects.create(
+                instance=instance, allocation_source=allocation_source)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse(self.url_route + "-list")
+
+        def count_list_queries(page_size):
+            with CaptureQueriesContext(connection) as query_context:
+                response = client.get(url, {'page_size': page_size})
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(len(response.data['results']), page_size)
+            return len(query_context.captured_queries)
+
+        # Warm up any per-process caches before counting
+        count_list_queries(1)
+        self.assertEquals(count_list_queries(1), count_list_queries(4))
@@ -0,0 +1,55 @@
+import mock
+
+from django.core.urlresolvers import reverse
+from django.test import override_settings
+from rest_framework.test import APITestCase, APIClient
+
+from api.tests.factories import UserFactory
+from core.metrics.instance import request_instances_metrics
+
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create(username='test-username')
+
+    def test_list_requires_instances(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get(reverse('api:v2:metrics-list'))
+        self.assertEquals(response.status_code, 400)
+
+    @override_settings(METRIC_SERVER='http://graphite', METRICS_BATCH_SIZE=2)
+    def test_batched_request(self):
+        uuids = ['uuid-1', 'uuid-2', 'uuid-3']
+        response = mock.Mock(status_code=200)
+        response.json.return_value = [
+            {"target": "stats.host.uuid-1.cpu", "datapoints": []},
+            {"target": "stats.host.uuid-2.cpu", "datapoints": []},
+            {"target": "stats.host.uuid-3.cpu", "datapoints": []},
+        ]
+        with mock.patch('core.metrics.instance._graphite_session') as session:
+            session.return_value.get.return_value = response
+            metrics = request_instances_metrics(
+                uuids, {"field": "cpu", "res": 1})
+        # Two render calls (batches of two), each with one target per uuid
+        self.assertEquals(session.return_value.get.call_count, 2)
+        self.assertEquals(sorted(metrics.keys()), uuids)
+        self.assertEquals(metrics['uuid-1'][0]['target'],
+                          "stats.host.uuid-1.cpu")
+
+    @override_settings(METRIC_SERVER='http://graphite', METRICS_BATCH_SIZE=2)
+    def test_failed_batch(self):
+        uuids = ['uuid-1', 'uuid-2', 'uuid-3']
+        failure = mock.Mock(status_code=500)
+        response = mock.Mock(status_code=200)
+        response.json.return_value = [
+            {"target": "stats.host.uuid-3.cpu", "datapoints": []},
+        ]
+        with mock.patch('core.metrics.instance._graphite_session') as session:
+            session.return_value.get.side_effect = \
+                lambda uri, **kwargs: failure if 'uuid-1' in uri else response
+            metrics = request_instances_metrics(
+                uuids, {"field": "cpu", "res": 1})
+        # Only the instances of the failed render call are left out
+        self.assertEquals(metrics.keys(), ['uuid-3'])
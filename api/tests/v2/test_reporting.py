@@ -134,3 +134,32 @@ class ReportingTests(APITestCase):
     @skip('skip for now')
     def test_access_not_allowed_provider(self):
         raise NotImplementedError
+
+    def test_allocation_report_requires_start_date(self):
+        factory = APIRequestFactory()
+        view = ReportingViewSet.as_view({'get': 'allocation'})
+        request = factory.get('api/v2/reporting/allocation')
+        force_authenticate(request, user=self.user)
+        response = view(request)
+        self.assertEquals(response.status_code, 400)
+
+    def test_allocation_report_is_streamed(self):
+        factory = APIRequestFactory()
+        view = ReportingViewSet.as_view({'get': 'allocation'})
+        request = factory.get('api/v2/reporting/allocation?start_date=2017-01-01&end_date=2017-02-01')
+        force_authenticate(request, user=self.user)
+        response = view(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = ''.join(response.streaming_content)
+        self.assertTrue(content.startswith('Username,Instance_ID,'))
+
+    def test_allocation_report_unknown_user(self):
+        factory = APIRequestFactory()
+        view = ReportingViewSet.as_view({'get': 'allocation'})
+        request = factory.get('api/v2/reporting/allocation?start_date=2017-01-01&username=no-such-user')
+        staff_user = UserFactory.create(is_staff=True)
+        force_authenticate(request, user=staff_user)
+        response = view(request)
+        self.assertEquals(response.status_code, 404)
+        self.assertFalse(response.streaming)
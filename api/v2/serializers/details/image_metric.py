@@ -28,7 +28,9 @@ class ImageMetricSerializer(serializers.HyperlinkedModelSerializer):
     metrics = serializers.SerializerMethodField()
 
     def get_is_featured(self, application):
-        return application.featured()
+        # Uses the tags prefetched by ImageMetricViewSet
+        return any(tag.name.lower() == 'featured'
+                   for tag in application.tags.all())
 
     def get_metrics(self, application):
         request = self.context.get('request', None)
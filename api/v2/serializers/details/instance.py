@@ -1,7 +1,8 @@
 from core.models import (
-    Project, BootScript, Instance, Application as Image,
-    InstanceAllocationSourceSnapshot
+    Project, BootScript, Instance, InstanceAllocationSourceSnapshot
 )
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import models
 from rest_framework import serializers
 from api.v2.serializers.fields import ModelRelatedField
 from api.v2.serializers.details import AllocationSourceSerializer
@@ -19,6 +20,34 @@ from api.v2.serializers.summaries.image import ImageSuperSummarySerializer
 from api.v2.serializers.fields.base import UUIDHyperlinkedIdentityField
 
 
+class InstanceListSerializer(serializers.ListSerializer):
+    """
+    Bulk-loads the per-instance lookups of InstanceSerializer
+    (last history, allocation source snapshot) before serializing,
+    so a page of instances costs a fixed number of queries.
+    """
+
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, models.Manager)
+                         else data)
+        Instance.prefetch_last_history(instances)
+        snapshots = InstanceAllocationSourceSnapshot.objects.filter(
+            instance_id__in=[instance.id for instance in instances])\
+            .select_related('allocation_source__snapshot')
+        snapshot_map = {snapshot.instance_id: snapshot
+                        for snapshot in snapshots}
+        for instance in instances:
+            instance._prefetched_allocation_snapshot = \
+                snapshot_map.get(instance.id)
+        # Many instances share an allocation source, serialize it once.
+        self.child._allocation_source_data = {}
+        try:
+            return super(InstanceListSerializer, self).to_representation(
+                instances)
+        finally:
+            self.child._allocation_source_data = None
+
+
 class InstanceSerializer(serializers.HyperlinkedModelSerializer):
     identity = IdentitySummarySerializer(source='created_by_identity')
     user = UserSummarySerializer(source='created_by')
@@ -28,12 +57,14 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
     project = ModelRelatedField(
         queryset=Project.objects.all(),
         serializer_class=ProjectSummarySerializer,
+        refetch=False,
         style={'base_template': 'input.html'})
 
     scripts = ModelRelatedField(
         many=True, required=False,
         queryset=BootScript.objects.all(),
         serializer_class=BootScriptSummarySerializer,
+        refetch=False,
         style={'base_template': 'input.html'})
     size = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
@@ -48,20 +79,35 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
         uuid_field='provider_alias'
     )
 
-    def get_allocation_source(self, instance):
-        snapshot = InstanceAllocationSourceSnapshot.objects.filter(
+    _allocation_source_data = None
+
+    def _get_allocation_snapshot(self, instance):
+        if hasattr(instance, '_prefetched_allocation_snapshot'):
+            return instance._prefetched_allocation_snapshot
+        return InstanceAllocationSourceSnapshot.objects.filter(
             instance=instance).first()
+
+    def get_allocation_source(self, instance):
+        snapshot = self._get_allocation_snapshot(instance)
         if not snapshot:
             return None
-        serializer = AllocationSourceSerializer(snapshot.allocation_source, context=self.context)
-        return serializer.data
-
+        allocation_source = snapshot.allocation_source
+        if self._allocation_source_data is None:
+            serializer = AllocationSourceSerializer(allocation_source, context=self.context)
+            return serializer.data
+        if allocation_source.id not in self._allocation_source_data:
+            serializer = AllocationSourceSerializer(allocation_source, context=self.context)
+            self._allocation_source_data[allocation_source.id] = serializer.data
+        return self._allocation_source_data[allocation_source.id]
 
     def get_usage(self, instance):
-        if not instance.allocation_source\
-                or not instance.allocation_source.snapshot:
+        snapshot = self._get_allocation_snapshot(instance)
+        if not snapshot:
+            return -1
+        try:
+            return snapshot.allocation_source.snapshot.compute_used
+        except ObjectDoesNotExist:
             return -1
-        return instance.allocation_source.snapshot.compute_used
 
     def get_size(self, obj):
         size = obj.get_size()
@@ -71,8 +117,7 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
     def get_image(self, obj):
         if not obj.source.is_machine():
             return {}
-        image_uuid = obj.application_uuid()
-        image = Image.objects.get(uuid=image_uuid)
+        image = obj.source.providermachine.application_version.application
         serializer = ImageSuperSummarySerializer(image, context=self.context)
         return serializer.data
 
@@ -93,6 +138,7 @@ class InstanceSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Instance
+        list_serializer_class = InstanceListSerializer
         fields = (
             'id',
             'uuid',
@@ -66,9 +66,13 @@ class InstanceViewSet(MultipleFieldLookup, AuthModelViewSet):
             qs = qs.filter(only_current_instances())
         # logger.info("DEBUG- User %s querying for instances, available IDs are:%s" % (user, qs.values_list('id',flat=True)))
         qs = qs.select_related("created_by")\
-            .select_related('created_by_identity')\
-            .select_related('source')\
-            .select_related('project')
+            .select_related('created_by_identity__provider')\
+            .select_related(
+                'source__providermachine__application_version__application')\
+            .select_related('project__owner', 'project__created_by')\
+            .select_related('last_history__status', 'last_history__size')\
+            .prefetch_related('created_by_identity__credential_set')\
+            .prefetch_related('scripts__script_type')
         return qs
 
     @detail_route(methods=['post'])
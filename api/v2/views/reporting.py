@@ -5,9 +5,13 @@ import numpy as np
 import pandas as pd
 import pytz
 from dateutil.parser import parse
+from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from rest_framework import exceptions
 from rest_framework import status
+from rest_framework.decorators import list_route
 from rest_framework.settings import api_settings
 
 from api.renderers import PandasExcelRenderer, CSVRenderer
@@ -15,6 +19,7 @@ from api.v2.exceptions import failure_response
 from api.v2.serializers.details import InstanceReportingSerializer
 from api.v2.views.base import AuthModelViewSet
 from core.models import Instance
+from service.allocation_logic import REPORT_FORMATS, export_report, iter_report
 
 
 class ReportingViewSet(AuthModelViewSet):
@@ -282,3 +287,46 @@ class ReportingViewSet(AuthModelViewSet):
         except ValueError:
             return failure_response(status.HTTP_400_BAD_REQUEST, 'Invalid filter parameters')
         return results
+
+    @list_route(methods=['get'])
+    def allocation(self, request):
+        """
+        Stream the allocation report as it is generated.
+        Query parameters:
+        - start_date (required), end_date (Default: now)
+        - username (staff only, non-staff always receive their own report)
+        - allocation_source
+        - file_format: 'csv' (Default) or 'ndjson'
+        - gzip: 'true' to gzip the response
+        """
+        query_params = request.query_params
+        if 'start_date' not in query_params:
+            return failure_response(status.HTTP_400_BAD_REQUEST,
+                                    "The allocation report requires the query parameter 'start_date'")
+        file_format = query_params.get('file_format', 'csv').lower()
+        if file_format not in REPORT_FORMATS:
+            return failure_response(status.HTTP_400_BAD_REQUEST,
+                                    "Invalid file_format. Expected one of: %s" % REPORT_FORMATS.keys())
+        try:
+            start_date = parse(query_params['start_date']).replace(tzinfo=pytz.utc)
+            end_date = parse(query_params['end_date']).replace(tzinfo=pytz.utc) \
+                if 'end_date' in query_params else timezone.now()
+        except ValueError:
+            return failure_response(status.HTTP_400_BAD_REQUEST, 'Invalid filter parameters')
+        username = query_params.get('username')
+        if not (request.user.is_staff or request.user.is_superuser):
+            username = request.user.username
+        compress = query_params.get('gzip', '').lower() == 'true'
+
+        # Look the user up before the response starts streaming
+        try:
+            rows = iter_report(start_date, end_date, user_id=username,
+                               allocation_source_name=query_params.get('allocation_source'))
+        except ObjectDoesNotExist as exc:
+            return failure_response(status.HTTP_404_NOT_FOUND, str(exc))
+        response = StreamingHttpResponse(
+            export_report(rows, file_format=file_format, compress=compress),
+            content_type=REPORT_FORMATS[file_format])
+        filename = 'allocation_report.%s%s' % (file_format, '.gz' if compress else '')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+        return response
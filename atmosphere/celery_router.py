@@ -52,13 +52,17 @@ PERIODIC_TASKS = [
     "monitor_machines", "monitor_machines_for",
     "monitor_sizes", "monitor_sizes_for",
     "monitor_volumes", "monitor_volumes_for",
+    "monitor_resources", "monitor_resources_for",
+    "poll_waiting_instances",
     "prune_machines", "prune_machines_for",
     "check_image_membership", "update_membership_for",
     "clear_empty_ips", "clear_empty_ips_for",
+    "clean_network_resources_for",
     "remove_empty_network",
     "remove_empty_networks",
     "remove_empty_networks_for",
     "reset_provider_allocation",
+    "update_usage_rollups",
     "monthly_allocation_reset",
     #JETSTREAM_SPECIFIC PERIODIC TASKS
     "report_allocations_to_tas",
@@ -66,6 +70,8 @@ PERIODIC_TASKS = [
     "monitor_jetstream_allocation_sources",
     #ALLOCATION SOURCES - PERIODIC TASKS
     "update_snapshot_cyverse",
+    "update_snapshot_cyverse_shard",
+    "aggregate_snapshot_cyverse",
     "allocation_threshold_check",
 ]
 SHORT_TASKS = [
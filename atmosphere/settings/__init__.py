@@ -25,6 +25,80 @@ ENFORCING = False
 
 CHECK_THRESHOLD = False
 
+# Reconcile instances with set-based bulk queries in 'monitor_instances_for'
+MONITOR_INSTANCES_IN_BULK = False
+
+# Number of 'update_snapshot_cyverse' shards (subtasks) the allocation
+# sources are split into. How many run at once depends on the workers.
+ALLOCATION_SNAPSHOT_SHARDS = 4
+
+# service.cache -- Seconds a cloud resource list is 'fresh' (per resource
+# type), and how long a stale list is served while one worker refreshes it.
+CLOUD_CACHE_TTL = {
+    'default': 30,
+    'instances': 30,
+    'volumes': 60,
+    'machines': 300,
+    'tenants': 300,
+}
+CLOUD_CACHE_STALE_TTL = 60
+CLOUD_CACHE_LOCK_TIMEOUT = 30
+
+# service.driver.driver_registry -- Rebuild (and re-authenticate) drivers
+# older than this many seconds. Keep it below the keystone token lifetime.
+DRIVER_REGISTRY_MAX_AGE = 3000
+
+# service.accounts.openstack_manager -- Seconds an AccountDriver keeps its
+# list of projects (creating/deleting a project through it drops the copy).
+ACCOUNT_PROJECT_LIST_TTL = 300
+
+# core.models.maintenance -- Seconds the global maintenance records are kept
+# in-process / in redis (saving or deleting a record drops both copies).
+MAINTENANCE_LOCAL_TTL = 5
+MAINTENANCE_CACHE_TTL = 300
+
+# core.plugins -- Seconds a user's Validation/Expiration plugin result is
+# cached (positive/negative), the max. seconds a plugin call may take, and
+# the threads running plugin calls (calls fail fast when all are busy).
+USER_PLUGIN_CACHE_TTL = 300
+USER_PLUGIN_NEGATIVE_CACHE_TTL = 60
+USER_PLUGIN_TIMEOUT = 10
+USER_PLUGIN_POOL_SIZE = 4
+
+# core.metrics.rollup -- Days of hourly usage rollups to keep
+# (daily rollups are kept forever)
+USAGE_ROLLUP_HOURLY_RETENTION = 14
+
+# core.metrics.instance -- Graphite requests: instances per render call,
+# pooled connections (and threads), (connect, read) timeouts and
+# single-flight lock timeout in seconds, and max. instances per API request.
+METRICS_BATCH_SIZE = 25
+METRICS_POOL_SIZE = 10
+METRICS_REQUEST_TIMEOUT = (3.05, 10)
+METRICS_LOCK_TIMEOUT = 15
+METRICS_MAX_INSTANCES = 100
+
+# service.tasks.monitoring.monitor_resources_for -- Seconds a provider's
+# monitoring run may take (listings still running are abandoned, later steps
+# are skipped, overlapping runs are skipped until then).
+MONITOR_PROVIDER_DEADLINE = 600
+
+# service.tasks.monitoring.monitor_machines_for -- Images whose fingerprint
+# is unchanged are skipped, except during a full sweep (every N seconds).
+MONITOR_MACHINES_FULL_SWEEP = 24 * 60 * 60
+
+# service.instance_poller -- wait_for_instance hands launching instances to
+# the poll_waiting_instances task, checked with one listing per provider.
+# Backoff between checks (seconds), and when to give up on an instance.
+INSTANCE_POLLER_ENABLED = True
+INSTANCE_POLLER_MIN_DELAY = 5
+INSTANCE_POLLER_MAX_DELAY = 60
+INSTANCE_POLLER_TIMEOUT = 250 * 15
+
+# service.network_cleanup -- Max. projects whose idle floating IPs are
+# removed concurrently by clean_network_resources_for.
+NETWORK_CLEANUP_POOL_SIZE = 5
+
 BLACKLIST_TAGS = ["Featured",]
 
 SETTINGS_ROOT = os.path.abspath(os.path.dirname(__file__))
@@ -471,33 +545,29 @@ CELERYBEAT_SCHEDULE = {
         "schedule": crontab(hour="0", minute="0", day_of_week="*"),
         "options": {"expires": 10 * 60, "time_limit": 10 * 60}
     },
-    "monitor_machines": {
-        "task": "monitor_machines",
-        # Every day of the week @ 1am
-        #"schedule": crontab(hour="1", minute="0", day_of_week="*"),
-        "schedule": timedelta(minutes=30),
-        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
-    },
-    "monitor_volumes": {
-        "task": "monitor_volumes",
-        "schedule": timedelta(minutes=30),
-        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
-    },
-    "monitor_sizes": {
-        "task": "monitor_sizes",
-        "schedule": timedelta(minutes=30),
-        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
-    },
-    "monitor_instances": {
-        "task": "monitor_instances",
+    # Instances, machines, sizes and volumes of each provider
+    # (replaces monitor_instances/_machines/_sizes/_volumes)
+    "monitor_resources": {
+        "task": "monitor_resources",
         "schedule": timedelta(minutes=15),
-        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
+        "options": {"expires": 10 * 60, "time_limit": 2 * 60}
+    },
+    # Instances waiting to be ready (see service.instance_poller)
+    "poll_waiting_instances": {
+        "task": "poll_waiting_instances",
+        "schedule": timedelta(seconds=5),
+        "options": {"expires": 5, "time_limit": 2 * 60}
     },
     "clear_empty_ips": {
         "task": "clear_empty_ips",
         "schedule": timedelta(minutes=120),
         "options": {"expires": 60 * 60}
     },
+    "update_usage_rollups": {
+        "task": "update_usage_rollups",
+        "schedule": timedelta(minutes=15),
+        "options": {"expires": 10 * 60, "time_limit": 10 * 60}
+    },
     "remove_empty_networks": {
         "task": "remove_empty_networks",
         # Every two hours.. midnight/2am/4am/...
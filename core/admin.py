@@ -15,6 +15,7 @@ from core.events.serializers.quota_assigned import QuotaAssignedSerializer
 
 def private_object(modeladmin, request, queryset):
     queryset.update(private=True)
+    models.ApplicationVisibility.refresh_for(queryset)
 
 
 private_object.short_description = 'Make objects private True'
@@ -24,6 +25,7 @@ def end_date_machine(modeladmin, request, queryset):
     instance_source_ids = queryset.values_list('instance_source', flat=True)
     instance_source_qs = models.InstanceSource.objects.filter(id__in=instance_source_ids)
     instance_source_qs.update(end_date=timezone.now())
+    models.ApplicationVisibility.refresh_for(instance_source_qs)
 
 
 end_date_machine.short_description = 'Add end-date to machines'
@@ -31,6 +33,7 @@ end_date_machine.short_description = 'Add end-date to machines'
 
 def end_date_object(modeladmin, request, queryset):
     queryset.update(end_date=timezone.now())
+    models.ApplicationVisibility.refresh_for(queryset)
 
 
 end_date_object.short_description = 'Add end-date to objects'
@@ -7,7 +7,8 @@ from core.models import (
     AllocationSource, Instance, AtmosphereUser,
     UserAllocationSnapshot,
     InstanceAllocationSourceSnapshot,
-    AllocationSourceSnapshot)
+    AllocationSourceSnapshot,
+    UserAllocationUsageLedger)
 from core.models import UserAllocationSource
 from core.models.allocation_source import get_allocation_source_object
 
@@ -277,6 +278,24 @@ def listen_for_instance_allocation_changes(sender, instance, created, **kwargs):
     return snapshot
 
 
+def listen_for_usage_ledger_allocation_changes(sender, instance, created, **kwargs):
+    """
+       This listener expects:
+       EventType - 'instance_allocation_source_changed'
+       entity_id - "amitj" # Username
+
+       If the event is dated before the user's usage ledger checkpoint
+       (i.e. the change was back-dated), the ledger is marked dirty so it
+       will be rebuilt on the next snapshot.
+    """
+    event = instance
+    if event.name != 'instance_allocation_source_changed':
+        return None
+    username = event.payload.get('username') or event.entity_id
+    UserAllocationUsageLedger.invalidate(
+        event.timestamp, user__username=username)
+
+
 ## EVENT FIRED WHEN ALLOCATION SOURCE IS CREATED OR RENEWED
 
 def listen_for_allocation_source_created_or_renewed(sender, instance, created, **kwargs):
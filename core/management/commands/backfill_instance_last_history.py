@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Instance, InstanceStatusHistory
+
+
+class Command(BaseCommand):
+    help = 'Point every Instance at its newest InstanceStatusHistory ' \
+           '(Instance.last_history)'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Instances updated per transaction (Default: 1000)")
+        parser.add_argument("--all", action="store_true", default=False,
+                            help="Verify (and fix) every instance, not only "
+                                 "those without a pointer")
+
+    def handle(self, *args, **options):
+        instances = Instance.objects.order_by('id')
+        if not options['all']:
+            instances = instances.filter(last_history__isnull=True)
+        instance_ids = list(instances.values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        updated = 0
+        for idx in xrange(0, len(instance_ids), batch_size):
+            batch = instance_ids[idx:idx + batch_size]
+            newest = InstanceStatusHistory.objects.filter(
+                instance_id__in=batch)\
+                .order_by('instance_id', '-start_date')\
+                .distinct('instance_id')\
+                .values_list('instance_id', 'id')
+            current = dict(Instance.objects.filter(
+                id__in=batch).values_list('id', 'last_history_id'))
+            with transaction.atomic():
+                for instance_id, history_id in newest:
+                    if current.get(instance_id) == history_id:
+                        continue
+                    Instance.objects.filter(id=instance_id).update(
+                        last_history_id=history_id)
+                    updated += 1
+            self.stdout.write(
+                "Checked {0}/{1} instances, updated {2}".format(
+                    min(idx + batch_size, len(instance_ids)),
+                    len(instance_ids), updated))
+        self.stdout.write("Updated {0} instances".format(updated))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+
+from core.models.allocation_source import (
+    UserAllocationUsageLedger, total_usage, _report_compute_seconds)
+
+
+class Command(BaseCommand):
+    help = 'Verify (and optionally rebuild) the allocation usage ledger ' \
+           'against a full recomputation of `total_usage`'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--allocation-source", default=None,
+                            help="Only check ledgers for this allocation source name")
+        parser.add_argument("--username", default=None,
+                            help="Only check ledgers for this username")
+        parser.add_argument("--tolerance", type=float, default=0.01,
+                            help="Allowed difference in hours (Default: 0.01)")
+        parser.add_argument("--rebuild", action="store_true", default=False,
+                            help="Overwrite mismatched ledgers with the full computation")
+
+    def handle(self, *args, **options):
+        ledgers = UserAllocationUsageLedger.objects.select_related(
+            'user', 'allocation_source').order_by(
+            'allocation_source__name', 'user__username')
+        if options['allocation_source']:
+            ledgers = ledgers.filter(
+                allocation_source__name=options['allocation_source'])
+        if options['username']:
+            ledgers = ledgers.filter(user__username=options['username'])
+
+        mismatched = 0
+        for ledger in ledgers:
+            report_rows = total_usage(
+                ledger.user.username, ledger.window_start,
+                allocation_source_name=ledger.allocation_source.name,
+                end_date=ledger.checkpoint, email=True)
+            compute_used = _report_compute_seconds(report_rows)
+            difference = abs(compute_used - ledger.compute_used) / 3600.0
+            if difference <= options['tolerance'] and not ledger.dirty:
+                continue
+            mismatched += 1
+            self.stdout.write(
+                "{0} + {1}: ledger={2} full={3} dirty={4}".format(
+                    ledger.user.username, ledger.allocation_source.name,
+                    ledger.compute_used_hours,
+                    round(compute_used / 3600.0, 2), ledger.dirty))
+            if options['rebuild']:
+                ledger.compute_used = compute_used
+                ledger.dirty = False
+                ledger.save()
+
+        self.stdout.write(
+            "Checked {0} ledgers, {1} mismatched{2}".format(
+                ledgers.count(), mismatched,
+                " (rebuilt)" if options['rebuild'] and mismatched else ""))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.metrics.application import rebuild_application_metrics
+
+
+class Command(BaseCommand):
+    help = 'Recount the summarized metrics of every application'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--application-ids", default=None,
+                            help="Comma-separated list of application IDs "
+                                 "(Default: all applications)")
+
+    def handle(self, *args, **options):
+        application_ids = None
+        if options['application_ids']:
+            application_ids = [
+                int(app_id)
+                for app_id in options['application_ids'].split(',')]
+        counted = rebuild_application_metrics(application_ids)
+        self.stdout.write(
+            "Rebuilt the metrics of {0} applications".format(counted))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.models.application_visibility import build_visibility
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the application visibility index used by the image catalog'
+
+    def handle(self, *args, **options):
+        created = build_visibility()
+        self.stdout.write(
+            "Rebuilt the application visibility index: {0} rows".format(
+                created))
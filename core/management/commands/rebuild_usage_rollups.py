@@ -0,0 +1,26 @@
+from dateutil.parser import parse
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.metrics.rollup import update_usage_rollups
+
+
+class Command(BaseCommand):
+    help = 'Update (or rebuild) the hourly/daily usage rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", default=None,
+                            help="Rebuild the rollups from this date "
+                                 "(Default: only add usage since the last update)")
+
+    def handle(self, *args, **options):
+        rebuild_from = None
+        if options['since']:
+            rebuild_from = parse(options['since'])
+            if timezone.is_naive(rebuild_from):
+                rebuild_from = timezone.make_aware(rebuild_from, timezone.utc)
+        start_date, end_date, updated = update_usage_rollups(
+            rebuild_from=rebuild_from)
+        self.stdout.write(
+            "Usage rollups from {0} to {1}: {2} rows updated".format(
+                start_date, end_date, updated))
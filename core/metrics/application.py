@@ -1,35 +1,29 @@
-import pickle
-import collections
-import numpy
-import redis
+from collections import defaultdict
 
 from threepio import logger
-from django.db.models import (
-        Avg, ExpressionWrapper,
-        F, Q, fields)
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
-from dateutil import rrule
-from core.models import (
-    Instance, InstanceStatusHistory
-)
 
-
-METRICS_CACHE_DURATION = 4*24*60*60  # 4 days (persist over the weekend)
+from core.models import Application
+from core.models.application_metrics import ApplicationMetrics
 
 
 def _get_summarized_application_metrics(application, force=False, read_only=False):
-    metrics = collections.OrderedDict()
-    redis_cache = redis.StrictRedis()
-    key = "metrics-application-summary-%s" % (application.id)
+    """
+    Summarized metrics of the application, from the ApplicationMetrics
+    table (kept up to date by signals).
+    Applications without metrics yet are counted (unless `read_only`)
+    """
+    metrics = {}
     try:
-        if redis_cache.exists(key) and not force:
-            pickled_object = redis_cache.get(key)
-            metrics = pickle.loads(pickled_object)
-        elif not read_only:
+        if force:
+            metrics = calculate_summarized_application_metrics(application)
+        else:
+            metrics = application.summary_metrics.as_dict()
+    except ApplicationMetrics.DoesNotExist:
+        if not read_only:
             metrics = calculate_summarized_application_metrics(application)
-            pickled_object = pickle.dumps(metrics)
-            redis_cache.set(key, pickled_object)
-            redis_cache.expire(key, METRICS_CACHE_DURATION)
     except:
         logger.exception("Unexpected errror in application metrics")
     return metrics
@@ -43,27 +37,40 @@ def calculate_summarized_application_metrics(app):
         # project favorites ( How many have added to project?)
         # launches total
         # launches success
+    Counts from scratch and saves the result as the ApplicationMetrics.
     """
-    from core.models import MachineRequest
-    num_forks = MachineRequest.objects.filter(status__name='completed', new_version_forked=True)\
-        .filter(instance__source__providermachine__application_version__application__id=app.id).count()
-    num_bookmarked = app.bookmarks.count()
-    num_in_projects = app.projects.count()
-    app_instances = Instance.objects.filter(source__providermachine__application_version__application__id=app.id)
-    total_launched = app_instances.count()
-    total_successful = app_instances.filter(instancestatushistory__status__name='active').distinct().count()
-    success_pct = 0.0
-    if total_launched != 0:
-        success_pct = total_successful/float(total_launched) * 100
+    return ApplicationMetrics.recount(app.id).as_dict()
 
-    application_metrics = {
-        'forks': num_forks,
-        'bookmarks': num_bookmarked,
-        'projects': num_in_projects,
-        'instances': {
-            'total': total_launched,
-            'success': total_successful,
-            'percent': success_pct,
-        }
-    }
-    return application_metrics
+
+def rebuild_application_metrics(application_ids=None):
+    """
+    Recount the ApplicationMetrics of all (or `application_ids`)
+    applications, with one grouped query per metric.
+    Returns the number of applications counted.
+    """
+    applications = Application.objects.all()
+    subset = application_ids is not None
+    if subset:
+        applications = applications.filter(id__in=application_ids)
+    application_ids = list(applications.values_list('id', flat=True))
+    counts = defaultdict(dict)
+    for counter, (queryset, app_path, count_field) in \
+            ApplicationMetrics.count_queries().items():
+        if subset:
+            queryset = queryset.filter(**{app_path + '__in': application_ids})
+        rows = queryset.values(app_path).annotate(
+            total=Count(count_field, distinct=True)).order_by()
+        for row in rows:
+            if row[app_path]:
+                counts[row[app_path]][counter] = row['total']
+    now_time = timezone.now()
+    with transaction.atomic():
+        ApplicationMetrics.objects.filter(
+            application_id__in=application_ids).delete()
+        ApplicationMetrics.objects.bulk_create([
+            ApplicationMetrics(
+                application_id=application_id, last_updated=now_time,
+                **counts.get(application_id, {}))
+            for application_id in application_ids
+        ], batch_size=1000)
+    return len(application_ids)
@@ -2,6 +2,10 @@
  Instance metrics stored in graphite
 """
 import json
+import threading
+import time
+import urllib
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
 import redis
@@ -12,6 +16,9 @@ from rest_framework.exceptions import NotFound
 
 from threepio import logger
 
+from service.cache import (
+    redis_connection, _acquire_lock, _release_lock, LOCK_KEY)
+
 # The hyper-stats service fetches metrics every minute
 CACHE_DURATION = 60
 
@@ -23,17 +30,93 @@ DEFAULT_RESOLUTION = 1
 #: Maximum time period is only two weeks
 MAXIMUM_TIME_PERIOD = 1209600
 
+#: Seconds between two reads of the metrics other callers are fetching
+#: (doubled after every read, up to MAXIMUM_WAIT_INTERVAL)
+WAIT_INTERVAL = 0.25
+MAXIMUM_WAIT_INTERVAL = 2
+
+_session = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _graphite_session():
+    """
+    A pooled, process-wide HTTP session for the Graphite server.
+    """
+    global _session
+    if not _session:
+        pool_size = getattr(settings, 'METRICS_POOL_SIZE', 10)
+        _session = requests.Session()
+        _session.mount('http://', requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size))
+        _session.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size))
+    return _session
+
+
+def _batch_pool():
+    """
+    A process-wide pool of threads for the Graphite render calls.
+    """
+    global _pool
+    with _pool_lock:
+        if not _pool:
+            _pool = ThreadPool(getattr(settings, 'METRICS_POOL_SIZE', 10))
+    return _pool
+
 
 def request_instance_metrics(uuid, params):
-    uri = create_request_uri(uuid, params)
-    r = requests.get(uri)
+    return _request_batch([uuid], params)[uuid]
+
+
+def request_instances_metrics(uuids, params):
+    """
+    Fetch the metrics of every instance in `uuids` using one Graphite
+    render call per METRICS_BATCH_SIZE instances (called concurrently).
+    Returns a dict of uuid -> list of series. The instances of a failed
+    render call are left out (and the failure logged).
+    """
+    batch_size = getattr(settings, 'METRICS_BATCH_SIZE', 25)
+    batches = [uuids[idx:idx + batch_size]
+               for idx in xrange(0, len(uuids), batch_size)]
+    if len(batches) == 1:
+        results = [_try_request_batch(batches[0], params)]
+    else:
+        results = _batch_pool().map(
+            lambda batch: _try_request_batch(batch, params), batches)
+    metrics = {}
+    for result in results:
+        metrics.update(result)
+    return metrics
+
+
+def _try_request_batch(uuids, params):
+    try:
+        return _request_batch(uuids, params)
+    except Exception:
+        logger.exception("Failed to retrieve the metrics of %s" % uuids)
+        return {}
+
+
+def _request_batch(uuids, params):
+    uri = create_request_uri(uuids, params)
+    r = _graphite_session().get(
+        uri, timeout=getattr(settings, 'METRICS_REQUEST_TIMEOUT', (3.05, 10)))
     if r.status_code != 200:
         raise NotFound()
-    return r.json()
+    series_list = r.json()
+    # Each series is named after its target, which contains the uuid
+    metrics = dict((uuid, []) for uuid in uuids)
+    for series in series_list:
+        for uuid in uuids:
+            if uuid in series.get("target", ""):
+                metrics[uuid].append(series)
+                break
+    return metrics
 
 
-def create_request_uri(uuid, params):
-    endpoint = "{server}/render/?target={target}&format={format}"
+def _metric_target(uuid, params):
     query = "stats.*.{uuid}.{field}"
     summarize = "summarize({metric}, {resolution}, 'avg')"
     metric = query.format(uuid=uuid, field=params.get("field"))
@@ -47,25 +130,28 @@ def create_request_uri(uuid, params):
             params.get("field") != "*"):
         res = '"{}min"'.format(params["res"])
 
-        target = summarize.format(metric=metric, resolution=res)
-    else:
-        target = metric
+        return summarize.format(metric=metric, resolution=res)
+    return metric
 
-    fields = {
-        "server": settings.METRIC_SERVER,
-        "target": target,
-        "format": "json"
-    }
 
-    request_uri = endpoint.format(**fields)
+def create_request_uri(uuids, params):
+    """
+    Graphite render URI for one (uuid) or many (list of uuids) instances
+    """
+    if isinstance(uuids, basestring):
+        uuids = [uuids]
+    query = [("target", _metric_target(uuid, params)) for uuid in uuids]
+    query.append(("format", "json"))
 
     #: (Optional) specify the window
     if "from" in params:
-        request_uri = "{}&from={}".format(request_uri, params["from"])
+        query.append(("from", params["from"]))
 
     if "until" in params:
-        request_uri = "{}&until={}".format(request_uri, params["until"])
+        query.append(("until", params["until"]))
 
+    request_uri = "{server}/render/?{query}".format(
+        server=settings.METRIC_SERVER, query=urllib.urlencode(query))
     logger.info("metrics endpoint: " + request_uri)
     return request_uri
 
@@ -77,7 +163,7 @@ def params_to_fields(params):
     }
 
     #: Check for a valid field
-    if getattr(params, "field", None) is None:
+    if not params or params.get("field") is None:
         return fields
 
     fields["field"] = params["field"]
@@ -109,17 +195,104 @@ def _to_instance_key(instance, fields):
 
 
 def get_instance_metrics(instance, params=None):
+    return get_instances_metrics([instance], params).get(
+        instance.provider_alias, {})
+
+
+def get_instances_metrics(instances, params=None):
+    """
+    Metrics for many instances -- a dict of provider_alias -> metrics.
+
+    Cached targets are read in a single round trip. Of the rest, the targets
+    this caller could lock are fetched in one (batched) Graphite call, and
+    the targets another caller is already fetching are waited on
+    (single-flight).
+    """
     fields = params_to_fields(params)
-    key = _to_instance_key(instance, fields)
-    redis_cache = redis.StrictRedis()
-    instance_metrics = {}
+    keys = dict((instance.provider_alias, _to_instance_key(instance, fields))
+                for instance in instances)
+    aliases = sorted(keys)
+    if not aliases:
+        return {}
     try:
-        if redis_cache.exists(key):
-            instance_metrics = json.loads(redis_cache.get(key))
+        r = redis_connection()
+        values = r.mget([keys[alias] for alias in aliases])
+    except redis.exceptions.RedisError:
+        logger.exception("Failed to read cached metrics")
+        return _fetch_metrics(aliases, fields)
+
+    instance_metrics = {}
+    missing = []
+    for alias, value in zip(aliases, values):
+        if value is not None:
+            instance_metrics[alias] = json.loads(value)
         else:
-            instance_metrics = request_instance_metrics(instance.provider_alias, params=params)
-            redis_cache.set(key, json.dumps(instance_metrics))
-            redis_cache.expire(key, CACHE_DURATION)
+            missing.append(alias)
+    lock_timeout = getattr(settings, 'METRICS_LOCK_TIMEOUT', 15)
+    locks = {}
+    waiting = []
+    for alias in missing:
+        token = _acquire_lock(r, keys[alias], lock_timeout)
+        if token:
+            locks[alias] = token
+        else:
+            waiting.append(alias)
+    try:
+        fetched = _fetch_metrics(sorted(locks), fields)
+        _store_metrics(r, keys, fetched)
+        instance_metrics.update(fetched)
+    finally:
+        for alias, token in locks.items():
+            _release_lock(r, keys[alias], token)
+    if waiting:
+        instance_metrics.update(
+            _wait_for_metrics(r, keys, waiting, fields, lock_timeout))
+    return instance_metrics
+
+
+def _fetch_metrics(aliases, fields):
+    if not aliases:
+        return {}
+    try:
+        return request_instances_metrics(aliases, fields)
     except Exception:
         logger.exception("Failed to retrieve metrics")
+        return {}
+
+
+def _store_metrics(r, keys, instance_metrics):
+    pipe = r.pipeline()
+    for alias, metrics in instance_metrics.items():
+        pipe.set(keys[alias], json.dumps(metrics), ex=CACHE_DURATION)
+    pipe.execute()
+
+
+def _wait_for_metrics(r, keys, aliases, fields, lock_timeout):
+    """
+    Wait for the callers holding the locks of `aliases` to cache them,
+    fetch whatever is still missing after `lock_timeout`.
+    """
+    instance_metrics = {}
+    deadline = time.time() + lock_timeout
+    interval = WAIT_INTERVAL
+    while aliases and time.time() < deadline:
+        time.sleep(min(interval, max(deadline - time.time(), 0)))
+        interval = min(interval * 2, MAXIMUM_WAIT_INTERVAL)
+        # Locks first: a holder caches its metrics before unlocking
+        locked = r.mget([LOCK_KEY.format(keys[alias]) for alias in aliases])
+        values = r.mget([keys[alias] for alias in aliases])
+        still_waiting = []
+        for alias, value, lock in zip(aliases, values, locked):
+            if value is not None:
+                instance_metrics[alias] = json.loads(value)
+                continue
+            still_waiting.append(alias)
+            if lock is None:
+                # The lock holder gave up, stop waiting.
+                deadline = 0
+        aliases = still_waiting
+    if aliases:
+        fetched = _fetch_metrics(aliases, fields)
+        _store_metrics(r, keys, fetched)
+        instance_metrics.update(fetched)
     return instance_metrics
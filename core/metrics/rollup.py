@@ -0,0 +1,249 @@
+"""
+Usage rollups -- hourly/daily aggregates of instance usage.
+
+`update_usage_rollups` folds the InstanceStatusHistory between the last
+checkpoint and 'now' into UsageRollup rows (per provider, user and
+application). Histories that change *before* the checkpoint mark the
+rollups dirty (see core.models.usage_rollup) and the next update rebuilds
+them from the start of that day.
+Hourly rows are kept for USAGE_ROLLUP_HOURLY_RETENTION days, daily rows
+are kept forever.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum, Min
+from django.utils import timezone
+
+from threepio import logger
+
+from core.models import Instance, InstanceStatusHistory
+from core.models.usage_rollup import (
+    UsageRollup, UsageRollupCheckpoint, HOURLY, DAILY)
+
+# See InstanceStatusHistory.is_active
+ACTIVE_STATUSES = ('active', 'running')
+PERIOD_LENGTH = {
+    HOURLY: timedelta(hours=1),
+    DAILY: timedelta(days=1),
+}
+
+
+def floor_date(date, period=DAILY):
+    """
+    Start of the (UTC) hour/day that contains `date`
+    """
+    date = date.astimezone(timezone.utc).replace(
+        minute=0, second=0, microsecond=0)
+    if period == DAILY:
+        date = date.replace(hour=0)
+    return date
+
+
+def _buckets(start_date, end_date, period):
+    """
+    Yields (bucket_start, seconds) for every bucket [start_date, end_date)
+    overlaps.
+    """
+    step = PERIOD_LENGTH[period]
+    bucket = floor_date(start_date, period)
+    while bucket < end_date:
+        next_bucket = bucket + step
+        overlap = min(end_date, next_bucket) - max(start_date, bucket)
+        yield bucket, overlap.total_seconds()
+        bucket = next_bucket
+
+
+def _hourly_since(now_time):
+    retention = getattr(settings, 'USAGE_ROLLUP_HOURLY_RETENTION', 14)
+    return floor_date(now_time - timedelta(days=retention), DAILY)
+
+
+def _compute_rollups(start_date, end_date, hourly_since):
+    """
+    Usage between start_date and end_date, as a dict of
+    (period, bucket_start, provider_id, user_id, application_id)
+    -> [active_hours, cpu_hours, instances_launched]
+    """
+    totals = defaultdict(lambda: [0.0, 0.0, 0])
+    histories = InstanceStatusHistory.objects.filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=start_date),
+        start_date__lt=end_date,
+        status__name__in=ACTIVE_STATUSES,
+    ).values_list(
+        'start_date', 'end_date', 'size__cpu',
+        'instance__created_by_identity__provider_id',
+        'instance__source__provider_id',
+        'instance__created_by_id',
+        'instance__source__providermachine__application_version__application_id')
+    for (history_start, history_end, cpu, identity_provider_id, provider_id,
+         user_id, application_id) in histories.iterator():
+        history_start = max(history_start, start_date)
+        history_end = min(history_end or end_date, end_date)
+        if history_end <= history_start:
+            continue
+        cpus = cpu if cpu > 0 else 1
+        provider_id = identity_provider_id or provider_id
+        periods = [(DAILY, history_start),
+                   (HOURLY, max(history_start, hourly_since))]
+        for period, period_start in periods:
+            for bucket, seconds in _buckets(period_start, history_end, period):
+                row = totals[
+                    (period, bucket, provider_id, user_id, application_id)]
+                row[0] += seconds / 3600.0
+                row[1] += cpus * seconds / 3600.0
+
+    launches = Instance.objects.filter(
+        start_date__gte=start_date, start_date__lt=end_date
+    ).values_list(
+        'start_date', 'created_by_identity__provider_id',
+        'source__provider_id', 'created_by_id',
+        'source__providermachine__application_version__application_id')
+    for (launched, identity_provider_id, provider_id,
+         user_id, application_id) in launches.iterator():
+        provider_id = identity_provider_id or provider_id
+        for period in (DAILY, HOURLY):
+            if period == HOURLY and launched < hourly_since:
+                continue
+            totals[(period, floor_date(launched, period),
+                    provider_id, user_id, application_id)][2] += 1
+    return totals
+
+
+def _apply_rollups(totals):
+    """
+    Add `totals` to the UsageRollup rows (creating missing rows)
+    """
+    if not totals:
+        return 0
+    bucket_starts = [key[1] for key in totals]
+    existing = UsageRollup.objects.filter(
+        bucket_start__gte=min(bucket_starts),
+        bucket_start__lte=max(bucket_starts))
+    existing_map = {row.key: row for row in existing}
+    new_rows = []
+    for key, (active_hours, cpu_hours, launched) in totals.items():
+        row = existing_map.get(key)
+        if not row:
+            period, bucket_start, provider_id, user_id, application_id = key
+            new_rows.append(UsageRollup(
+                period=period, bucket_start=bucket_start,
+                provider_id=provider_id, user_id=user_id,
+                application_id=application_id,
+                active_hours=active_hours, cpu_hours=cpu_hours,
+                instances_launched=launched))
+            continue
+        row.active_hours += active_hours
+        row.cpu_hours += cpu_hours
+        row.instances_launched += launched
+        row.save(update_fields=[
+            'active_hours', 'cpu_hours', 'instances_launched'])
+    UsageRollup.objects.bulk_create(new_rows, batch_size=1000)
+    return len(totals)
+
+
+def update_usage_rollups(end_date=None, rebuild_from=None):
+    """
+    Bring the usage rollups up to `end_date` (Default: now).
+    `rebuild_from` forces a rebuild of the rollups from that date.
+    Returns (start_date, end_date, rows updated)
+    """
+    if not end_date:
+        end_date = timezone.now()
+    UsageRollupCheckpoint.current()
+    with transaction.atomic():
+        # Lock the checkpoint while computing: histories changed meanwhile
+        # wait for the checkpoint to move, then mark the rollups dirty.
+        state = UsageRollupCheckpoint.objects.select_for_update().get(
+            name='default')
+        if state.dirty_since and (
+                not rebuild_from or state.dirty_since < rebuild_from):
+            rebuild_from = state.dirty_since
+        if not state.checkpoint:
+            rebuild_from = Instance.objects.aggregate(
+                Min('start_date'))['start_date__min'] or end_date
+        if rebuild_from:
+            start_date = floor_date(min(rebuild_from, end_date), DAILY)
+        else:
+            start_date = state.checkpoint
+        if start_date >= end_date:
+            return (start_date, end_date, 0)
+        UsageRollupCheckpoint.objects.filter(
+            id=state.id, dirty_since=state.dirty_since
+        ).update(checkpoint=end_date, dirty_since=None)
+        hourly_since = _hourly_since(end_date)
+        if rebuild_from:
+            UsageRollup.objects.filter(bucket_start__gte=start_date).delete()
+        totals = _compute_rollups(start_date, end_date, hourly_since)
+        updated = _apply_rollups(totals)
+        UsageRollup.objects.filter(
+            period=HOURLY, bucket_start__lt=hourly_since).delete()
+    logger.info("Usage rollups %s from %s to %s: %s rows updated"
+                % ("rebuilt" if rebuild_from else "updated",
+                   start_date, end_date, updated))
+    return (start_date, end_date, updated)
+
+
+def usage_between(start_date, end_date, period=DAILY,
+                  group_by=('provider',), **filters):
+    """
+    Usage in the buckets that start in [start_date, end_date), grouped by
+    `group_by` (any of: bucket_start, provider, user, application).
+    Returns a list of dicts with the `group_by` keys and
+    'active_hours', 'cpu_hours' and 'instances_launched'.
+    """
+    rows = UsageRollup.objects.filter(
+        period=period,
+        bucket_start__gte=start_date, bucket_start__lt=end_date,
+        **filters
+    ).values(*group_by).annotate(
+        total_active_hours=Sum('active_hours'),
+        total_cpu_hours=Sum('cpu_hours'),
+        total_instances_launched=Sum('instances_launched'),
+    ).order_by(*group_by)
+    usage = []
+    for row in rows:
+        usage_row = dict((key, row[key]) for key in group_by)
+        usage_row['active_hours'] = row['total_active_hours'] or 0.0
+        usage_row['cpu_hours'] = row['total_cpu_hours'] or 0.0
+        usage_row['instances_launched'] = \
+            row['total_instances_launched'] or 0
+        usage.append(usage_row)
+    return usage
+
+
+def count_between_boundaries(dates, boundaries):
+    """
+    Given a sorted list of `dates` and N `boundaries`, returns the N-1
+    counts of dates strictly between each pair of boundaries.
+    """
+    return [bisect_left(dates, end) - bisect_right(dates, start)
+            for start, end in zip(boundaries, boundaries[1:])]
+
+
+def launches_between_boundaries(boundaries, **filters):
+    """
+    Instances launched between each pair of `boundaries`, from the daily
+    rollups (boundaries are rounded down to the day).
+    """
+    daily = UsageRollup.objects.filter(
+        period=DAILY, instances_launched__gt=0,
+        bucket_start__gte=floor_date(boundaries[0]),
+        bucket_start__lt=floor_date(boundaries[-1]),
+        **filters
+    ).values('bucket_start').annotate(
+        launched=Sum('instances_launched')).order_by('bucket_start')
+    bucket_starts = []
+    launched = []
+    for row in daily:
+        bucket_starts.append(row['bucket_start'])
+        launched.append(row['launched'])
+    counts = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        first = bisect_left(bucket_starts, floor_date(start))
+        last = bisect_left(bucket_starts, floor_date(end))
+        counts.append(sum(launched[first:last]))
+    return counts
@@ -1,3 +1,6 @@
+from collections import defaultdict
+from datetime import timedelta
+
 from django.utils import timezone
 from django.db.models import Q
 from dateutil import rrule
@@ -5,6 +8,10 @@ from core.models import (
     InstanceStatusHistory, Instance, AtmosphereUser, MachineRequest,
     Application, ProviderMachine, Provider
 )
+from core.models.usage_rollup import DAILY
+from core.metrics.rollup import (
+    ACTIVE_STATUSES, update_usage_rollups, usage_between,
+    count_between_boundaries, launches_between_boundaries)
 
 
 def instance_history_usage_report(filename, start_date=None, end_date=None, only_active=False):
@@ -15,10 +22,14 @@ def instance_history_usage_report(filename, start_date=None, end_date=None, only
         query = query.filter(start_date__gt=start_date)
     if end_date:
         query = query.filter(end_date__gt=end_date)
+    query = query.select_related(
+        'status', 'size', 'instance__created_by',
+        'instance__created_by_identity__provider',
+        'instance__source__providermachine__application_version__application')
     now_time = timezone.now()
     with open(filename, 'w') as the_file:
         the_file.write("ID,Provider Alias,Username,Provider,Application,Version,Machine UUID,Status,Start Date,End Date,Active Time(Hours),CPU,RAM,DISK\n")
-        for instance_history in query.order_by('instance__id', 'start_date', 'end_date'):
+        for instance_history in query.order_by('instance__id', 'start_date', 'end_date').iterator():
             instance = instance_history.instance
             size = instance_history.size
             cpu = size.cpu if size.cpu > 0 else 1
@@ -36,6 +47,25 @@ def instance_history_usage_report(filename, start_date=None, end_date=None, only
                 ) )
 
 
+def _instance_active_times(instance_query, now_time):
+    """
+    Bulk version of `instance.get_active_time()[0]` for every instance in
+    `instance_query` -- a dict of instance.id -> CPU-time (timedelta)
+    """
+    start_dates = dict(instance_query.values_list('id', 'start_date'))
+    active_times = defaultdict(timedelta)
+    histories = InstanceStatusHistory.objects.filter(
+        instance__in=instance_query,
+        status__name__in=ACTIVE_STATUSES,
+    ).values_list('instance_id', 'start_date', 'end_date', 'size__cpu')
+    for instance_id, history_start, history_end, cpu in histories.iterator():
+        start_count = max(history_start, start_dates[instance_id])
+        end_count = min(history_end or now_time, now_time)
+        if end_count > start_count:
+            active_times[instance_id] += (end_count - start_count) * cpu
+    return active_times
+
+
 def instance_usage_report(filename, start_date=None, end_date=None):
     query = Instance.objects.all()
     if start_date:
@@ -43,15 +73,20 @@ def instance_usage_report(filename, start_date=None, end_date=None):
     if end_date:
         query = query.filter(end_date__gt=end_date)
     now_time = timezone.now()
+    active_times = _instance_active_times(query, now_time)
+    query = query.select_related(
+        'last_history__size', 'created_by',
+        'created_by_identity__provider',
+        'source__providermachine__application_version__application')
     with open(filename, 'w') as the_file:
         the_file.write("ID,Provider Alias,Username,Provider,Application,Version,Machine UUID,Start Date,End Date,Active Time(Hours),CPU,RAM,DISK\n")
-        for instance in query.order_by('start_date', 'end_date'):
+        for instance in query.order_by('start_date', 'end_date').iterator():
             size = instance.get_size()
             cpu = size.cpu if size.cpu > 0 else 1
             mem = size.mem if size.mem > 1 else ""
             disk = size.disk if size.disk > 1 else ""
             machine = instance.source.providermachine
-            active_time = instance.get_active_time()[0]
+            active_time = active_times.get(instance.id, timedelta())
 
             the_file.write( "%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n" % (
                 instance.id, instance.provider_alias, instance.created_by.username,
@@ -62,6 +97,27 @@ def instance_usage_report(filename, start_date=None, end_date=None):
                 ) )
 
 
+def usage_rollup_report(filename, start_date, end_date=None, period=DAILY,
+                        group_by=('bucket_start', 'provider', 'user', 'application')):
+    """
+    Write the usage rollups between start_date and end_date as CSV.
+    """
+    if not end_date:
+        end_date = timezone.now()
+    update_usage_rollups()
+    usage = usage_between(start_date, end_date, period=period, group_by=group_by)
+    with open(filename, 'w') as the_file:
+        the_file.write(",".join(
+            [key.replace('_', ' ').title() for key in group_by] +
+            ["Active Time(Hours)", "CPU Time(Hours)", "Instances launched"]) + "\n")
+        for row in usage:
+            values = [row[key].strftime("%x %X") if key == 'bucket_start' else row[key]
+                      for key in group_by]
+            values += [round(row['active_hours'], 2), round(row['cpu_hours'], 2),
+                       row['instances_launched']]
+            the_file.write(",".join("%s" % value for value in values) + "\n")
+
+
 def machine_request_report(filename, start_date=None, end_date=None):
     query = MachineRequest.objects.filter(old_status='completed')
     if start_date:
@@ -75,35 +131,71 @@ def machine_request_report(filename, start_date=None, end_date=None):
 
 def monthly_metrics(filename, start_date, end_date):
     monthly_breakdown = list(rrule.rrule(dtstart=start_date, freq=rrule.MONTHLY, until=timezone.now()))
+    provider_ids = Provider.objects.filter(active=True, end_date__isnull=True).values_list("id", flat=True)
+    update_usage_rollups()
+    counts = _counts_between_boundaries(provider_ids, monthly_breakdown)
     with open(filename, 'w') as the_file:
         the_file.write("Start Date,End Date,Instances launched,Users Joined,Applications Created,Machines Added\n")
-        for idx, month in enumerate(monthly_breakdown):
-            if idx == len(monthly_breakdown) - 1:
-                continue
-            start_date = month
-            end_date = monthly_breakdown[idx+1]
-            provider_ids = Provider.objects.filter(active=True, end_date__isnull=True).values_list("id", flat=True)
-            the_file.write(_print_csv_row_between_dates(provider_ids, start_date, end_date))
+        for idx, month_counts in enumerate(counts):
+            the_file.write(_format_counts_row(
+                monthly_breakdown[idx], monthly_breakdown[idx+1], month_counts))
             the_file.write("\n")
     return the_file
 
 
-def _print_csv_row_between_dates(provider_ids, start_date, end_date, pretty_print=False):
-    instances = Instance.objects.filter(start_date__gt=start_date, start_date__lt=end_date)
-    users = AtmosphereUser.objects.filter(date_joined__gt=start_date, date_joined__lt=end_date)
-    apps = Application.objects\
-        .filter(start_date__gt=start_date, start_date__lt=end_date)\
-        .filter(created_by_identity__provider__id__in=provider_ids).distinct()
-    machines = ProviderMachine.objects\
-        .filter(instance_source__start_date__gt=start_date, instance_source__start_date__lt=end_date)\
-        .filter(instance_source__provider__id__in=provider_ids).distinct()
+def _counts_between_boundaries(provider_ids, boundaries, from_rollups=True):
+    """
+    (Instances launched, Users joined, Applications created, Machines added)
+    between each pair of `boundaries`, in a fixed number of queries.
+    With `from_rollups`, instance launches are read from the daily usage
+    rollups (call `update_usage_rollups` first): they are counted per day,
+    boundaries are rounded down to the day. Otherwise the launches are
+    counted from the instances themselves.
+    """
+    if len(boundaries) < 2:
+        return []
+    start_date, end_date = boundaries[0], boundaries[-1]
+    if from_rollups:
+        instances = launches_between_boundaries(boundaries)
+    else:
+        instances = count_between_boundaries(list(
+            Instance.objects
+            .filter(start_date__gt=start_date, start_date__lt=end_date)
+            .order_by('start_date').values_list('start_date', flat=True)),
+            boundaries)
+    users = count_between_boundaries(list(
+        AtmosphereUser.objects
+        .filter(date_joined__gt=start_date, date_joined__lt=end_date)
+        .order_by('date_joined').values_list('date_joined', flat=True)),
+        boundaries)
+    apps = count_between_boundaries(sorted(dict(
+        Application.objects
+        .filter(start_date__gt=start_date, start_date__lt=end_date)
+        .filter(created_by_identity__provider__id__in=provider_ids)
+        .values_list('id', 'start_date')).values()),
+        boundaries)
+    machines = count_between_boundaries(sorted(dict(
+        ProviderMachine.objects
+        .filter(instance_source__start_date__gt=start_date, instance_source__start_date__lt=end_date)
+        .filter(instance_source__provider__id__in=provider_ids)
+        .values_list('id', 'instance_source__start_date')).values()),
+        boundaries)
+    return zip(instances, users, apps, machines)
+
+
+def _format_counts_row(start_date, end_date, counts, pretty_print=False):
     if pretty_print:
         return """Between %s and %s:
             %s Instances launched
             %s Users joined
             %s Applications (%s Machines) created""" % (
-                start_date, end_date,
-                instances.count(), users.count(), apps.count(), machines.count())
+                (start_date, end_date) + tuple(counts))
     return "%s,%s,%s,%s,%s,%s" % (
-            start_date.strftime("%x %X"), end_date.strftime("%x %X"),
-            instances.count(), users.count(), apps.count(), machines.count())
+        (start_date.strftime("%x %X"), end_date.strftime("%x %X")) + tuple(counts))
+
+
+def _print_csv_row_between_dates(provider_ids, start_date, end_date, pretty_print=False):
+    # A single (possibly sub-day) window: count the instances themselves
+    counts = _counts_between_boundaries(
+        provider_ids, [start_date, end_date], from_rollups=False)[0]
+    return _format_counts_row(start_date, end_date, counts, pretty_print)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0097_userprofile_guacamole_color'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAllocationUsageLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField()),
+                ('checkpoint', models.DateTimeField()),
+                ('compute_used', models.FloatField(default=0)),
+                ('burn_rate', models.FloatField(default=0)),
+                ('dirty', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('allocation_source', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_ledgers', to='core.AllocationSource')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocation_usage_ledgers', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_allocation_usage_ledger',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='userallocationusageledger',
+            unique_together=set([('user', 'allocation_source')]),
+        ),
+    ]
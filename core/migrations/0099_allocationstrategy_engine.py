@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0098_userallocationusageledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='allocationstrategy',
+            name='engine',
+            field=models.CharField(choices=[('python', 'Python'), ('numpy', 'NumPy (Vectorized)')], default='python', max_length=32),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0100_instance_last_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=8)),
+                ('bucket_start', models.DateTimeField()),
+                ('active_hours', models.FloatField(default=0)),
+                ('cpu_hours', models.FloatField(default=0)),
+                ('instances_launched', models.IntegerField(default=0)),
+                ('application', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Application')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Provider')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'usage_rollup',
+            },
+        ),
+        migrations.CreateModel(
+            name='UsageRollupCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(default='default', max_length=64, unique=True)),
+                ('checkpoint', models.DateTimeField(blank=True, null=True)),
+                ('dirty_since', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'usage_rollup_checkpoint',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='usagerollup',
+            index_together=set([('period', 'bucket_start')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0101_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationMetrics',
+            fields=[
+                ('application', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary_metrics', serialize=False, to='core.Application')),
+                ('forks', models.IntegerField(default=0)),
+                ('bookmarks', models.IntegerField(default=0)),
+                ('projects', models.IntegerField(default=0)),
+                ('instances_total', models.IntegerField(default=0)),
+                ('instances_success', models.IntegerField(default=0)),
+                ('last_updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'application_metrics',
+            },
+        ),
+    ]
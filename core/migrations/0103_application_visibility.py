@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_application_visibility(apps, schema_editor):
+    from core.models.application_visibility import build_visibility
+    build_visibility(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0102_application_metrics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApplicationVisibility',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visible_from', models.DateTimeField()),
+                ('visible_until', models.DateTimeField(blank=True, null=True)),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Application')),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Group')),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.Provider')),
+            ],
+            options={
+                'db_table': 'application_visibility',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='applicationvisibility',
+            index_together=set([('provider', 'group')]),
+        ),
+        migrations.RunPython(
+            build_application_visibility, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0103_application_visibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='providermachine',
+            name='cloud_fingerprint',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -6,7 +6,8 @@ from django.db.models import ObjectDoesNotExist
 from core.models.allocation_strategy import Allocation, AllocationStrategy
 from core.models.allocation_source import (
         AllocationSource, UserAllocationSource, UserAllocationSnapshot,
-        InstanceAllocationSourceSnapshot, AllocationSourceSnapshot)
+        InstanceAllocationSourceSnapshot, AllocationSourceSnapshot,
+        UserAllocationUsageLedger)
 from core.models.application import Application, ApplicationMembership,\
     ApplicationScore, ApplicationBookmark, ApplicationThreshold
 from core.models.application_pattern_match import ApplicationPatternMatch
@@ -47,6 +48,9 @@ from core.models.size import Size
 from core.models.status_type import StatusType
 from core.models.t import T
 from core.models.tag import Tag
+from core.models.usage_rollup import UsageRollup, UsageRollupCheckpoint
+from core.models.application_metrics import ApplicationMetrics
+from core.models.application_visibility import ApplicationVisibility
 from core.models.template import (EmailTemplate, HelpLink)
 from core.models.user import AtmosphereUser
 from core.models.volume import Volume
@@ -1,4 +1,5 @@
 import decimal
+from datetime import datetime
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
@@ -163,6 +164,50 @@ class InstanceAllocationSourceSnapshot(models.Model):
         app_label = 'core'
 
 
+class UserAllocationUsageLedger(models.Model):
+    """
+    Running total of a User's usage of an AllocationSource.
+
+    `compute_used` (CPU-seconds) covers the window [window_start, checkpoint].
+    Snapshot tasks fold in only the usage between `checkpoint` and 'now'.
+    `dirty` is set by the InstanceStatusHistory and
+    'instance_allocation_source_changed' hooks when a change lands *before*
+    the checkpoint, so the next update rebuilds from `window_start`.
+    """
+    user = models.ForeignKey("AtmosphereUser", related_name="allocation_usage_ledgers")
+    allocation_source = models.ForeignKey(AllocationSource, related_name="usage_ledgers")
+    window_start = models.DateTimeField()
+    checkpoint = models.DateTimeField()
+    compute_used = models.FloatField(default=0)
+    burn_rate = models.FloatField(default=0)
+    dirty = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def invalidate(cls, changed_at, **user_query):
+        """
+        Mark every ledger that has already counted past `changed_at` as dirty.
+        """
+        return cls.objects.filter(
+            checkpoint__gt=changed_at, dirty=False, **user_query
+        ).update(dirty=True)
+
+    @property
+    def compute_used_hours(self):
+        return round(self.compute_used / 3600.0, 2)
+
+    def __unicode__(self):
+        return "User %s + AllocationSource %s: %s hours from %s to %s%s" %\
+            (self.user, self.allocation_source, self.compute_used_hours,
+             self.window_start, self.checkpoint,
+             " (dirty)" if self.dirty else "")
+
+    class Meta:
+        db_table = 'user_allocation_usage_ledger'
+        app_label = 'core'
+        unique_together = ('user', 'allocation_source')
+
+
 class AllocationSourceSnapshot(models.Model):
     allocation_source = models.OneToOneField(AllocationSource, related_name="snapshot")
     updated = models.DateTimeField(auto_now=True)
@@ -180,6 +225,18 @@ class AllocationSourceSnapshot(models.Model):
         db_table = 'allocation_source_snapshot'
         app_label = 'core'
 
+def _report_compute_seconds(report_rows):
+    total_allocation = 0.0
+    for data in report_rows:
+        if not data['allocation_source'] == 'N/A':
+            total_allocation += data['applicable_duration']
+    return total_allocation
+
+
+def _report_burn_rate(report_rows):
+    return 0 if len(report_rows) < 1 else report_rows[-1]['burn_rate']
+
+
 def total_usage(username, start_date, allocation_source_name=None,end_date=None, burn_rate=False, email=None):
     """ 
         This function outputs the total allocation usage in hours
@@ -190,17 +247,13 @@ def total_usage(username, start_date, allocation_source_name=None,end_date=None,
     user_allocation = create_report(start_date,end_date,user_id=username,allocation_source_name=allocation_source_name)
     if email:
         return user_allocation
-    total_allocation = 0.0
-    for data in user_allocation:
-        #print data['instance_id'], data['allocation_source'], data['instance_status_start_date'], data['instance_status_end_date'], data['applicable_duration']
-        if not data['allocation_source']=='N/A':
-            total_allocation += data['applicable_duration']
+    total_allocation = _report_compute_seconds(user_allocation)
     compute_used_total = round(total_allocation/3600.0,2)
     if compute_used_total > 0:
         logger.info("Total usage for User %s with AllocationSource %s from %s-%s = %s"
                     % (username, allocation_source_name, start_date, end_date, compute_used_total))
     if burn_rate:
-        burn_rate_total = 0 if len(user_allocation)<1 else user_allocation[-1]['burn_rate']
+        burn_rate_total = _report_burn_rate(user_allocation)
         if burn_rate_total != 0:
             logger.info("User %s with AllocationSource %s Burn Rate: %s"
                         % (username, allocation_source_name, burn_rate_total))
@@ -208,6 +261,49 @@ def total_usage(username, start_date, allocation_source_name=None,end_date=None,
     return compute_used_total
 
 
+def ledger_usage(user, allocation_source, start_date, end_date=None):
+    """
+    Incremental counterpart to `total_usage(..., burn_rate=True)`.
+
+    Only the usage between the ledger's checkpoint and `end_date` is
+    computed; it is folded into the persisted UserAllocationUsageLedger.
+    The ledger is rebuilt from `start_date` when the window moves (renewal),
+    when it was marked dirty, or when asked to go back in time.
+    Returns [compute_used (hours), burn_rate]
+    """
+    from dateutil.parser import parse
+    from service.allocation_logic import create_report
+    if not end_date:
+        end_date = timezone.now()
+    if not isinstance(start_date, datetime):
+        start_date = parse(start_date)
+    if not isinstance(end_date, datetime):
+        end_date = parse(end_date)
+    ledger, _ = UserAllocationUsageLedger.objects.get_or_create(
+        user=user, allocation_source=allocation_source,
+        defaults={'window_start': start_date, 'checkpoint': start_date})
+    if ledger.dirty or ledger.window_start != start_date \
+            or ledger.checkpoint > end_date:
+        # Clear the flag *before* computing, so changes made while the
+        # report runs will mark the ledger dirty again.
+        UserAllocationUsageLedger.objects.filter(
+            id=ledger.id).update(dirty=False)
+        ledger.window_start = start_date
+        ledger.checkpoint = start_date
+        ledger.compute_used = 0
+        ledger.burn_rate = 0
+    if end_date > ledger.checkpoint:
+        report_rows = create_report(
+            ledger.checkpoint, end_date, user_id=user.username,
+            allocation_source_name=allocation_source.name)
+        ledger.compute_used += _report_compute_seconds(report_rows)
+        ledger.burn_rate = _report_burn_rate(report_rows)
+        ledger.checkpoint = end_date
+    ledger.save(update_fields=[
+        'window_start', 'checkpoint', 'compute_used', 'burn_rate', 'updated'])
+    return [ledger.compute_used_hours, ledger.burn_rate]
+
+
 def get_allocation_source_object(source_id):
     if not source_id:
         raise Exception('No source_id provided in _get_allocation_source_object method')
@@ -130,6 +130,10 @@ class AllocationStrategy(models.Model):
         RefreshBehavior, blank=True)
     rules_behaviors = models.ManyToManyField(
         RulesBehavior, blank=True)
+    # Backend used by allocation.engine.calculate_allocation
+    engine = models.CharField(max_length=32, default='python', choices=(
+        ('python', 'Python'),
+        ('numpy', 'NumPy (Vectorized)')))
 
     def _parse_counting_behavior(self, identity, now=None,
                                  start_date=None, end_date=None):
@@ -249,7 +253,8 @@ class AllocationStrategy(models.Model):
         refresh_behaviors = self._parse_refresh_behaviors(identity, now, start_date)
         rules_behaviors = self._parse_rules_behaviors()
         new_strategy = PythonAllocationStrategy(
-            counting_behavior, refresh_behaviors, rules_behaviors)
+            counting_behavior, refresh_behaviors, rules_behaviors,
+            engine=self.engine)
         return new_strategy.apply(
             identity, core_allocation,
             limit_instances=limit_instances, limit_history=limit_history)
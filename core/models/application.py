@@ -155,29 +155,38 @@ class Application(models.Model):
 
     @classmethod
     def images_for_user(cls, user=None):
+        """
+        Images visible to the user, using the ApplicationVisibility index
+        (see core.models.application_visibility) for the shared and public
+        images, so no DISTINCT is required.
+        """
+        from core.models.application_visibility import ApplicationVisibility
+        from core.models.machine import ProviderMachine
         from core.models.user import AtmosphereUser
-        is_public = Q(private=False)
         if not user or isinstance(user, AnonymousUser):
             # Images that are not endated and are public
-            return Application.objects.filter(query.only_current_apps() & is_public,
-                versions__machines__instance_source__provider__public=True).distinct()
+            public_providers = Provider.objects.filter(
+                public=True).values('id')
+            return Application.objects.filter(
+                id__in=ApplicationVisibility.visible_application_ids(
+                    public_providers))
         if not isinstance(user, AtmosphereUser):
             raise Exception("Expected user to be of type AtmosphereUser"
                             " - Received %s" % type(user))
-        queryset = None
+        provider_ids = list(user.current_providers.values_list(
+            'id', flat=True))
         if user.is_staff:
             # Any image on a provider in the staff's provider list
-            queryset = Application.objects.filter(query.in_users_providers(user))
-        else:
-            # This query is not the most clear. Here's an explanation:
-            # Include all images created by the user or active images in the
-            # users providers that are either shared with the user or public
-            queryset = Application.objects.select_related('created_by').prefetch_related('versions__machines__instance_source__provider', 'versions__machines__members', 'versions__membership').filter(
-                    query.created_by_user(user) |
-                    (query.only_current_apps() &
-                     query.in_users_providers(user) &
-                     (query.images_shared_with_user_by_ids(user) | is_public)))
-        return queryset.distinct()
+            return Application.objects.filter(
+                id__in=ProviderMachine.objects.filter(
+                    instance_source__provider__in=provider_ids
+                ).values('application_version__application_id'))
+        # Include all images created by the user or active images in the
+        # users providers that are either shared with the user or public
+        return Application.objects.select_related('created_by').prefetch_related('versions__machines__instance_source__provider', 'versions__machines__members', 'versions__membership').filter(
+                Q(created_by=user) |
+                Q(id__in=ApplicationVisibility.visible_application_ids(
+                    provider_ids, list(user.group_ids()))))
 
     def _current_versions(self):
         """
@@ -0,0 +1,252 @@
+"""
+Summarized metrics of each Application, kept up to date by signals
+(see `core.metrics.application` to rebuild them in bulk).
+"""
+from django.db import models
+from django.db.models import F
+from django.db.models.signals import (
+    post_save, pre_delete, post_delete, m2m_changed)
+from django.utils import timezone
+
+from core.models.application import Application, ApplicationBookmark
+from core.models.instance import Instance
+from core.models.instance_history import InstanceStatusHistory
+from core.models.machine_request import MachineRequest
+from core.models.project import Project
+
+# Path from an Instance to its Application
+INSTANCE_APPLICATION = \
+    'source__providermachine__application_version__application'
+# An instance is 'successful' once it has gone active
+SUCCESS_STATUS = 'active'
+
+
+class ApplicationMetrics(models.Model):
+    """
+    forks -- completed MachineRequests that forked an instance of the app
+    bookmarks -- users that bookmarked the app
+    projects -- projects that include the app
+    instances_total -- instances launched from the app
+    instances_success -- instances launched from the app that went active
+    """
+    application = models.OneToOneField(
+        Application, primary_key=True, related_name="summary_metrics")
+    forks = models.IntegerField(default=0)
+    bookmarks = models.IntegerField(default=0)
+    projects = models.IntegerField(default=0)
+    instances_total = models.IntegerField(default=0)
+    instances_success = models.IntegerField(default=0)
+    last_updated = models.DateTimeField(default=timezone.now)
+
+    COUNTERS = ('forks', 'bookmarks', 'projects',
+                'instances_total', 'instances_success')
+
+    @property
+    def success_percent(self):
+        if not self.instances_total:
+            return 0.0
+        return self.instances_success / float(self.instances_total) * 100
+
+    def as_dict(self):
+        return {
+            'forks': self.forks,
+            'bookmarks': self.bookmarks,
+            'projects': self.projects,
+            'instances': {
+                'total': self.instances_total,
+                'success': self.instances_success,
+                'percent': self.success_percent,
+            }
+        }
+
+    @staticmethod
+    def count_queries():
+        """
+        Querysets that count each metric, as:
+        {counter: (queryset, path to the application id, field to count)}
+        """
+        app_path = INSTANCE_APPLICATION + '_id'
+        return {
+            'forks': (
+                MachineRequest.objects.filter(
+                    status__name='completed', new_version_forked=True),
+                'instance__' + app_path, 'id'),
+            'bookmarks': (
+                ApplicationBookmark.objects.all(), 'application_id', 'id'),
+            'projects': (
+                Project.applications.through.objects.all(),
+                'application_id', 'id'),
+            'instances_total': (
+                Instance.objects.all(), app_path, 'id'),
+            'instances_success': (
+                InstanceStatusHistory.objects.filter(
+                    status__name=SUCCESS_STATUS),
+                'instance__' + app_path, 'instance_id'),
+        }
+
+    @classmethod
+    def recount(cls, application_id, counters=None):
+        """
+        Count `counters` (Default: all of them) of the application
+        from scratch and save the result.
+        """
+        if not counters:
+            counters = cls.COUNTERS
+        queries = cls.count_queries()
+        values = {'last_updated': timezone.now()}
+        for counter in counters:
+            queryset, app_path, count_field = queries[counter]
+            values[counter] = queryset.filter(
+                **{app_path: application_id}
+            ).values(count_field).distinct().count()
+        metrics, created = cls.objects.get_or_create(
+            application_id=application_id, defaults=values)
+        if not created:
+            cls.objects.filter(application_id=application_id).update(**values)
+            for key, value in values.items():
+                setattr(metrics, key, value)
+        return metrics
+
+    @classmethod
+    def increment(cls, application_id, **deltas):
+        """
+        Add `deltas` to the counters of the application.
+        Applications without metrics yet are counted from scratch.
+        """
+        if not application_id:
+            return
+        values = dict((counter, F(counter) + delta)
+                      for counter, delta in deltas.items())
+        values['last_updated'] = timezone.now()
+        updated = cls.objects.filter(
+            application_id=application_id).update(**values)
+        if not updated:
+            cls.recount(application_id)
+
+    @classmethod
+    def histories_created(cls, histories):
+        """
+        Update `instances_success` for histories that were not saved with
+        `save()` (ex: bulk_create)
+        """
+        instance_ids = set(
+            history.instance_id for history in histories
+            if history.status.name == SUCCESS_STATUS)
+        if not instance_ids:
+            return
+        application_ids = Instance.objects.filter(
+            id__in=instance_ids
+        ).values_list(INSTANCE_APPLICATION + '_id', flat=True).distinct()
+        for application_id in application_ids:
+            if application_id:
+                cls.recount(application_id, ['instances_success'])
+
+    def __unicode__(self):
+        return "Metrics of Application:%s - %s" % (
+            self.application_id, self.as_dict())
+
+    class Meta:
+        db_table = 'application_metrics'
+        app_label = 'core'
+
+
+def _instance_application_id(instance_id):
+    return Instance.objects.filter(id=instance_id).values_list(
+        INSTANCE_APPLICATION + '_id', flat=True).first()
+
+
+def listen_for_bookmark_changes(sender, instance, created=False, **kwargs):
+    bookmark = instance
+    if kwargs.get('signal') == post_delete:
+        ApplicationMetrics.increment(bookmark.application_id, bookmarks=-1)
+    elif created:
+        ApplicationMetrics.increment(bookmark.application_id, bookmarks=1)
+
+
+def listen_for_project_application_changes(
+        sender, instance, action, reverse, pk_set=None, **kwargs):
+    """
+    Recount `projects` of the applications added to/removed from projects
+    """
+    if reverse:
+        # instance is an Application
+        application_ids = [instance.pk]
+    elif action == 'pre_clear':
+        instance._cleared_application_ids = list(
+            instance.applications.values_list('id', flat=True))
+        return
+    elif action == 'post_clear':
+        application_ids = getattr(instance, '_cleared_application_ids', [])
+    else:
+        application_ids = pk_set or []
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    for application_id in application_ids:
+        ApplicationMetrics.recount(application_id, ['projects'])
+
+
+def listen_for_project_delete(sender, instance, **kwargs):
+    project = instance
+    if kwargs.get('signal') == pre_delete:
+        project._deleted_application_ids = list(
+            project.applications.values_list('id', flat=True))
+        return
+    for application_id in getattr(project, '_deleted_application_ids', []):
+        ApplicationMetrics.recount(application_id, ['projects'])
+
+
+def listen_for_instance_changes(sender, instance, created=False, **kwargs):
+    signal = kwargs.get('signal')
+    if signal == pre_delete:
+        instance._deleted_application_id = \
+            _instance_application_id(instance.id)
+    elif signal == post_delete:
+        application_id = getattr(instance, '_deleted_application_id', None)
+        if application_id:
+            ApplicationMetrics.recount(
+                application_id,
+                ['forks', 'instances_total', 'instances_success'])
+    elif created:
+        ApplicationMetrics.increment(
+            _instance_application_id(instance.id), instances_total=1)
+
+
+def listen_for_first_active_history(sender, instance, created=False,
+                                    **kwargs):
+    """
+    An instance counts as 'successful' with its *first* active history
+    """
+    history = instance
+    if not created or history.status.name != SUCCESS_STATUS:
+        return
+    was_active = InstanceStatusHistory.objects.filter(
+        instance_id=history.instance_id, status__name=SUCCESS_STATUS
+    ).exclude(id=history.id).exists()
+    if not was_active:
+        ApplicationMetrics.increment(
+            _instance_application_id(history.instance_id),
+            instances_success=1)
+
+
+def listen_for_machine_request_changes(sender, instance, **kwargs):
+    machine_request = instance
+    if not machine_request.new_version_forked:
+        return
+    application_id = _instance_application_id(machine_request.instance_id)
+    if application_id:
+        ApplicationMetrics.recount(application_id, ['forks'])
+
+
+# Instantiate the hooks:
+post_save.connect(listen_for_bookmark_changes, sender=ApplicationBookmark)
+post_delete.connect(listen_for_bookmark_changes, sender=ApplicationBookmark)
+m2m_changed.connect(listen_for_project_application_changes,
+                    sender=Project.applications.through)
+pre_delete.connect(listen_for_project_delete, sender=Project)
+post_delete.connect(listen_for_project_delete, sender=Project)
+post_save.connect(listen_for_instance_changes, sender=Instance)
+pre_delete.connect(listen_for_instance_changes, sender=Instance)
+post_delete.connect(listen_for_instance_changes, sender=Instance)
+post_save.connect(listen_for_first_active_history,
+                  sender=InstanceStatusHistory)
+post_save.connect(listen_for_machine_request_changes, sender=MachineRequest)
@@ -0,0 +1,253 @@
+"""
+Index of the providers/groups each Application is visible to, used by
+`Application.images_for_user` instead of joining
+versions -> machines -> instance_source -> provider (+ memberships).
+"""
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from core.models.application import Application
+from core.models.application_version import (
+    ApplicationVersion, ApplicationVersionMembership)
+from core.models.instance_source import InstanceSource
+from core.models.machine import ProviderMachine, ProviderMachineMembership
+from core.models.provider import Provider
+
+BATCH_SIZE = 500
+
+
+class ApplicationVisibility(models.Model):
+    """
+    The application is visible, between `visible_from` and
+    `visible_until`, to users of `provider` that belong to `group`
+    (group NULL == public, visible to every user of the provider).
+
+    One row per (machine, group) that makes the application visible,
+    these are the 'current' machines of `only_current_apps`:
+    the application, version, machine and provider are in range, and
+    the provider is active.
+    """
+    application = models.ForeignKey(Application, related_name="+")
+    provider = models.ForeignKey(Provider, related_name="+")
+    group = models.ForeignKey(
+        "Group", null=True, blank=True, related_name="+")
+    visible_from = models.DateTimeField()
+    visible_until = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def visible_application_ids(cls, provider_ids, group_ids=None,
+                                now_time=None):
+        """
+        Values queryset (for use as a subquery) of the applications
+        visible on `provider_ids` to the (public or) `group_ids`
+        """
+        if not now_time:
+            now_time = timezone.now()
+        shared = Q(group__isnull=True)
+        if group_ids:
+            shared |= Q(group_id__in=group_ids)
+        return cls.objects.filter(
+            shared,
+            Q(visible_until__isnull=True) | Q(visible_until__gt=now_time),
+            provider_id__in=provider_ids,
+            visible_from__lt=now_time,
+        ).values('application_id')
+
+    @classmethod
+    def refresh(cls, application_ids):
+        """
+        Rebuild the rows of `application_ids`
+        """
+        application_ids = set(app_id for app_id in application_ids if app_id)
+        if not application_ids:
+            return 0
+        rows = visibility_rows(application_ids)
+        with transaction.atomic():
+            cls.objects.filter(application_id__in=application_ids).delete()
+            cls.objects.bulk_create(rows, batch_size=1000)
+        return len(rows)
+
+    @classmethod
+    def refresh_for(cls, queryset):
+        """
+        Refresh the applications affected by (bulk) changes to the objects
+        of `queryset` (Application, ApplicationVersion, ProviderMachine,
+        InstanceSource or Provider)
+        """
+        app_path = APPLICATION_PATHS.get(queryset.model)
+        if not app_path:
+            return 0
+        application_ids = queryset.exclude(**{app_path: None}).values_list(
+            app_path, flat=True).distinct()
+        return cls.refresh(list(application_ids))
+
+    def __unicode__(self):
+        return "Application:%s Provider:%s Group:%s (%s - %s)" % (
+            self.application_id, self.provider_id,
+            self.group_id or "public", self.visible_from,
+            self.visible_until or "")
+
+    class Meta:
+        db_table = 'application_visibility'
+        app_label = 'core'
+        index_together = [('provider', 'group')]
+
+
+# Path from each model to the Application(s) it affects
+APPLICATION_PATHS = {
+    Application: 'id',
+    ApplicationVersion: 'application_id',
+    ProviderMachine: 'application_version__application_id',
+    InstanceSource: 'providermachine__application_version__application_id',
+    Provider: 'instancesource__providermachine__'
+              'application_version__application_id',
+}
+
+
+def _earliest(*dates):
+    dates = [date for date in dates if date]
+    return min(dates) if dates else None
+
+
+def visibility_rows(application_ids, now_time=None, apps=None):
+    """
+    ApplicationVisibility rows (unsaved) of `application_ids`.
+    `apps` is the registry to load the models from (Default: the
+    current models, migrations pass their own)
+    """
+    get_model = (apps or django_apps).get_model
+    if not now_time:
+        now_time = timezone.now()
+    machines = list(get_model('core', 'ProviderMachine').objects.filter(
+        application_version__application_id__in=application_ids,
+        instance_source__provider__active=True,
+    ).values_list(
+        'id', 'application_version_id',
+        'application_version__application_id',
+        'application_version__application__private',
+        'application_version__application__start_date',
+        'application_version__application__end_date',
+        'application_version__start_date',
+        'application_version__end_date',
+        'instance_source__start_date',
+        'instance_source__end_date',
+        'instance_source__provider_id',
+        'instance_source__provider__end_date'))
+    version_groups = defaultdict(set)
+    for version_id, group_id in get_model(
+            'core', 'ApplicationVersionMembership').objects.filter(
+            image_version__application_id__in=application_ids
+    ).values_list('image_version_id', 'group_id'):
+        version_groups[version_id].add(group_id)
+    machine_groups = defaultdict(set)
+    for machine_id, group_id in get_model(
+            'core', 'ProviderMachineMembership').objects.filter(
+            provider_machine__application_version__application_id__in=(
+                application_ids)
+    ).values_list('provider_machine_id', 'group_id'):
+        machine_groups[machine_id].add(group_id)
+
+    ApplicationVisibility = get_model('core', 'ApplicationVisibility')
+    rows = set()
+    for (machine_id, version_id, application_id, private,
+         app_start, app_end, version_start, version_end,
+         source_start, source_end, provider_id, provider_end) in machines:
+        visible_from = max(app_start, version_start, source_start)
+        visible_until = _earliest(
+            app_end, version_end, source_end, provider_end)
+        if visible_until and visible_until <= max(visible_from, now_time):
+            continue
+        if private:
+            groups = version_groups[version_id] | machine_groups[machine_id]
+        else:
+            groups = [None]
+        for group_id in groups:
+            rows.add((application_id, provider_id, group_id,
+                      visible_from, visible_until))
+    return [
+        ApplicationVisibility(
+            application_id=row_application_id, provider_id=row_provider_id,
+            group_id=row_group_id, visible_from=row_visible_from,
+            visible_until=row_visible_until)
+        for (row_application_id, row_provider_id, row_group_id,
+             row_visible_from, row_visible_until) in rows]
+
+
+def build_visibility(apps=None):
+    """
+    Rebuild the whole index, BATCH_SIZE applications at a time.
+    Returns the number of rows created.
+    """
+    get_model = (apps or django_apps).get_model
+    ApplicationVisibility = get_model('core', 'ApplicationVisibility')
+    application_ids = list(get_model('core', 'Application').objects
+                           .order_by('id').values_list('id', flat=True))
+    created = 0
+    with transaction.atomic():
+        ApplicationVisibility.objects.all().delete()
+        for idx in range(0, len(application_ids), BATCH_SIZE):
+            rows = visibility_rows(
+                application_ids[idx:idx + BATCH_SIZE], apps=apps)
+            ApplicationVisibility.objects.bulk_create(rows, batch_size=1000)
+            created += len(rows)
+    return created
+
+
+def _refresh_after_delete(application_id):
+    """
+    Wait for the commit: the application itself may be going away
+    in the same transaction.
+    """
+    transaction.on_commit(
+        lambda: ApplicationVisibility.refresh([application_id]))
+
+
+def listen_for_visibility_changes(sender, instance, **kwargs):
+    """
+    Refresh the applications of the changed object
+    """
+    if kwargs.get('signal') != post_delete:
+        ApplicationVisibility.refresh_for(
+            sender.objects.filter(pk=instance.pk))
+    elif isinstance(instance, ApplicationVersion):
+        _refresh_after_delete(instance.application_id)
+    elif isinstance(instance, ProviderMachine):
+        _refresh_after_delete(ApplicationVersion.objects.filter(
+            id=instance.application_version_id
+        ).values_list('application_id', flat=True).first())
+
+
+def listen_for_membership_changes(sender, instance, **kwargs):
+    """
+    Refresh the application shared by an ApplicationVersionMembership
+    or ProviderMachineMembership
+    """
+    membership = instance
+    if isinstance(membership, ApplicationVersionMembership):
+        application_id = ApplicationVersion.objects.filter(
+            id=membership.image_version_id
+        ).values_list('application_id', flat=True).first()
+    else:
+        application_id = ProviderMachine.objects.filter(
+            id=membership.provider_machine_id
+        ).values_list(APPLICATION_PATHS[ProviderMachine], flat=True).first()
+    if kwargs.get('signal') == post_delete:
+        _refresh_after_delete(application_id)
+    else:
+        ApplicationVisibility.refresh([application_id])
+
+
+# Instantiate the hooks:
+for model in (Application, ApplicationVersion, InstanceSource,
+              ProviderMachine, Provider):
+    post_save.connect(listen_for_visibility_changes, sender=model)
+for model in (ApplicationVersion, ProviderMachine):
+    post_delete.connect(listen_for_visibility_changes, sender=model)
+for model in (ApplicationVersionMembership, ProviderMachineMembership):
+    post_save.connect(listen_for_membership_changes, sender=model)
+    post_delete.connect(listen_for_membership_changes, sender=model)
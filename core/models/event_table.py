@@ -20,7 +20,8 @@ from core.hooks.allocation_source import (
     listen_for_allocation_source_name_changed,
     listen_for_allocation_source_compute_allowed_changed,
     listen_for_allocation_source_removed,
-    listen_for_instance_allocation_removed
+    listen_for_instance_allocation_removed,
+    listen_for_usage_ledger_allocation_changes
 )
 from threepio import logger
 
@@ -82,3 +83,4 @@ post_save.connect(listen_for_allocation_source_renewal_strategy_changed, sender=
 post_save.connect(listen_for_allocation_source_name_changed, sender=EventTable)
 post_save.connect(listen_for_allocation_source_removed, sender=EventTable)
 post_save.connect(listen_for_quota_assigned, sender=EventTable)
+post_save.connect(listen_for_usage_ledger_allocation_changes, sender=EventTable)
@@ -58,6 +58,10 @@ class Instance(models.Model):
     created_by = models.ForeignKey('AtmosphereUser')
     #FIXME: Why is null=True okay here?
     created_by_identity = models.ForeignKey(Identity, null=True)
+    # The newest InstanceStatusHistory -- maintained by InstanceStatusHistory.save
+    last_history = models.ForeignKey(
+        'InstanceStatusHistory', null=True, blank=True,
+        related_name='+', on_delete=models.SET_NULL)
     shell = models.BooleanField(default=False)
     vnc = models.BooleanField(default=False)
     web_desktop = models.BooleanField(default=False)
@@ -101,6 +105,43 @@ class Instance(models.Model):
         membership_query = Q(created_by__memberships__group__user=user)
         return Instance.objects.filter(membership_query | project_query | ownership_query).distinct()
 
+    @staticmethod
+    def prefetch_last_history(instances):
+        """
+        Load the newest InstanceStatusHistory (with its status and size) of
+        every instance in (at most) two queries, so `get_last_history`
+        (and `api_status`, `api_activity`, `get_size`...) do not query
+        per-instance.
+        """
+        # FIXME: Move this call so that it happens inside InstanceStatusHistory to avoid circ.dep.
+        from core.models import InstanceStatusHistory
+        instances = [instance for instance in instances if instance.id]
+        unloaded = [instance for instance in instances
+                    if instance.last_history_id and
+                    not Instance.last_history.is_cached(instance)]
+        if unloaded:
+            history_map = InstanceStatusHistory.objects.select_related(
+                'status', 'size').in_bulk(
+                [instance.last_history_id for instance in unloaded])
+            for instance in unloaded:
+                instance.last_history = history_map.get(
+                    instance.last_history_id)
+        # Instances without a pointer (yet) -- see 'backfill_instance_last_history'
+        missing = [instance for instance in instances
+                   if not instance.last_history_id]
+        if missing:
+            last_histories = InstanceStatusHistory.objects.filter(
+                instance_id__in=[instance.id for instance in missing])\
+                .select_related('status', 'size')\
+                .order_by('instance_id', '-start_date')\
+                .distinct('instance_id')
+            history_map = {history.instance_id: history
+                           for history in last_histories}
+            for instance in missing:
+                if instance.id in history_map:
+                    instance.last_history = history_map[instance.id]
+        return instances
+
     def get_total_hours(self):
         from service.monitoring import _get_allocation_result
         identity = self.created_by_identity
@@ -165,6 +206,9 @@ class Instance(models.Model):
         # except InstanceStatusHistory.DoesNotExist:
         # TODO: Profile current choice
         # FIXME: Move this call so that it happens inside InstanceStatusHistory to avoid circ.dep.
+        if Instance.last_history.is_cached(self) and self.last_history:
+            # Loaded with the instance (see `prefetch_last_history`)
+            return self.last_history
         last_history = self.instancestatushistory_set.order_by(
             '-start_date').first()
         if last_history:
@@ -231,7 +275,8 @@ class Instance(models.Model):
             deploy_fault_trace=deploy_fault_trace)
 
         # 2. Get the last history (or Build a new one if no other exists)
-        has_history = self.instancestatushistory_set.all().count()
+        has_history = self.last_history_id or \
+            self.instancestatushistory_set.exists()
         if not has_history:
             last_history = InstanceStatusHistory.create_history(
                 status_name, self, size,
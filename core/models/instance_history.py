@@ -5,13 +5,16 @@ from uuid import uuid4
 from datetime import timedelta
 
 from django.db import models, transaction, DatabaseError
-from django.db.models import ObjectDoesNotExist
+from django.db.models import ObjectDoesNotExist, OuterRef, Q, Subquery
+from django.db.models.signals import post_save
 from django.contrib.postgres.fields import JSONField
 
 from django.utils import timezone
 
 from threepio import logger
 
+from core.models.allocation_source import UserAllocationUsageLedger
+
 
 class InstanceStatus(models.Model):
 
@@ -107,6 +110,42 @@ class InstanceStatusHistory(models.Model):
         except ObjectDoesNotExist:
             raise ValueError("There was no matching transaction for Instance:%s end-date:%s" % (self.instance, self.end_date))
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super(InstanceStatusHistory, self).save(*args, **kwargs)
+            self.update_instance_pointer()
+
+    def update_instance_pointer(self):
+        """
+        Point `instance.last_history` at this history, unless the instance
+        already points at a newer one.
+        """
+        instance_model = self._meta.get_field('instance').related_model
+        is_newest = Q(last_history__isnull=True) |\
+            Q(last_history__start_date__lte=self.start_date)
+        updated = instance_model.objects.filter(
+            is_newest, id=self.instance_id).update(last_history=self)
+        instance_cache = self._meta.get_field('instance').get_cache_name()
+        if updated and hasattr(self, instance_cache):
+            self.instance.last_history = self
+        return updated
+
+    @classmethod
+    def update_instance_pointers(cls, histories):
+        """
+        `update_instance_pointer` for histories that were not saved with
+        `save()` (ex: bulk_create): point every instance of `histories` at
+        its newest history, in a single UPDATE.
+        """
+        instance_ids = set(history.instance_id for history in histories)
+        if not instance_ids:
+            return 0
+        instance_model = cls._meta.get_field('instance').related_model
+        newest = cls.objects.filter(instance=OuterRef('pk'))\
+            .order_by('-start_date', '-id').values('id')[:1]
+        return instance_model.objects.filter(id__in=instance_ids)\
+            .update(last_history=Subquery(newest))
+
     @classmethod
     def transaction(cls, status_name, activity, instance, size,
                     extra=None, start_time=None, last_history=None):
@@ -114,8 +153,9 @@ class InstanceStatusHistory(models.Model):
             with transaction.atomic():
                 if not last_history:
                     # Required to prevent race conditions.
-                    last_history = instance.get_last_history()\
-                                           .select_for_update(nowait=True)
+                    locked_instance = instance.__class__.objects\
+                        .select_for_update(nowait=True).get(id=instance.id)
+                    last_history = locked_instance.get_last_history()
                     if not last_history:
                         raise ValueError(
                             "A previous history is required "
@@ -257,3 +297,24 @@ class InstanceStatusHistory(models.Model):
     class Meta:
         db_table = "instance_status_history"
         app_label = "core"
+
+
+def listen_for_usage_ledger_history_changes(sender, instance, created,
+                                            **kwargs):
+    """
+    New histories normally start 'now' and end-dating an open history
+    'now' does not change usage that was already counted, so only
+    changes that land before the ledger checkpoint mark it dirty.
+    """
+    history = instance
+    if created:
+        changed_at = history.start_date
+    else:
+        changed_at = history.end_date or history.start_date
+    UserAllocationUsageLedger.invalidate(
+        changed_at, user__instance__id=history.instance_id)
+
+
+# Instantiate the hooks:
+post_save.connect(listen_for_usage_ledger_history_changes,
+                  sender=InstanceStatusHistory)
@@ -36,6 +36,9 @@ class ProviderMachine(BaseSource):
         ApplicationVersion,
         related_name="machines",
         null=True)
+    # Fingerprint of the cloud image as of the last monitor_machines_for
+    # sync (see service.tasks.monitoring._image_fingerprint)
+    cloud_fingerprint = models.CharField(max_length=32, blank=True, default="")
 
     @property
     def application(self):
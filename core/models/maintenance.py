@@ -1,12 +1,22 @@
 import collections
+import cPickle as pickle
+import time
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 
+from threepio import logger
+
 from core.models.user import AtmosphereUser as User
 from core.models.provider import Provider
 
+MAINTENANCE_KEY_GLOBAL = "maintenance.global"
+# In-process copy of the global maintenance records -- (loaded_at, records)
+_global_records = None
+
 
 class MaintenanceRecord(models.Model):
 
@@ -37,6 +47,28 @@ class MaintenanceRecord(models.Model):
             records = records.filter(Q(provider__isnull=True))
         return records
 
+    @classmethod
+    def active_global(cls, now=None):
+        """
+        Cached equivalent of `MaintenanceRecord.active()` (provider=None).
+
+        Current *and upcoming* global records are kept in-process and in
+        Redis, and are filtered by start/end date on every call -- so
+        records start and end on time without a database query.
+        Both copies are dropped when a save or delete of a MaintenanceRecord
+        is committed (other processes notice within MAINTENANCE_LOCAL_TTL).
+        """
+        global _global_records
+        if not now:
+            now = timezone.now()
+        local_ttl = getattr(settings, 'MAINTENANCE_LOCAL_TTL', 5)
+        if not _global_records or \
+                time.time() - _global_records[0] > local_ttl:
+            _global_records = (time.time(), _load_global_records())
+        return [record for record in _global_records[1]
+                if record.start_date <= now and
+                (not record.end_date or record.end_date > now)]
+
     @classmethod
     def disable_login_access(cls, request):
         disable_login = False
@@ -77,3 +109,54 @@ class MaintenanceRecord(models.Model):
     class Meta:
         db_table = "maintenance_record"
         app_label = "core"
+
+
+def _global_records_query():
+    return list(MaintenanceRecord.objects.filter(
+        Q(end_date__gt=timezone.now()) | Q(end_date__isnull=True),
+        provider__isnull=True).order_by('start_date'))
+
+
+def _load_global_records():
+    """
+    Current and upcoming global MaintenanceRecords, from Redis when
+    possible, otherwise from the database (and stored in Redis).
+    """
+    import redis
+    from service.cache import redis_connection
+    try:
+        r = redis_connection()
+        cached = r.get(MAINTENANCE_KEY_GLOBAL)
+        if cached is not None:
+            return pickle.loads(cached)
+        records = _global_records_query()
+        r.set(MAINTENANCE_KEY_GLOBAL, pickle.dumps(records),
+              ex=getattr(settings, 'MAINTENANCE_CACHE_TTL', 300))
+        return records
+    except redis.RedisError:
+        logger.exception("Could not reach redis for the maintenance state")
+        return _global_records_query()
+
+
+def invalidate_maintenance_records(sender=None, instance=None, **kwargs):
+    global _global_records
+    import redis
+    from service.cache import redis_connection
+    _global_records = None
+    try:
+        redis_connection().delete(MAINTENANCE_KEY_GLOBAL)
+    except redis.RedisError:
+        logger.exception("Could not invalidate the cached maintenance state")
+
+
+def listen_for_maintenance_changes(sender, instance, **kwargs):
+    """
+    Invalidate once the change is committed (before that, another request
+    could cache the old records again).
+    """
+    transaction.on_commit(invalidate_maintenance_records)
+
+
+# Instantiate the hooks:
+post_save.connect(listen_for_maintenance_changes, sender=MaintenanceRecord)
+post_delete.connect(listen_for_maintenance_changes, sender=MaintenanceRecord)
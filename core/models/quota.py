@@ -352,10 +352,14 @@ def has_storage_count_quota(driver, quota, new_size=0, raise_exc=True):
     return False
 
 
+def _quota_error_message(resource_name, current_count, new_count, limit_count):
+    return "%s Quota Exceeded: Using %s + Requested %s but limited to %s"\
+        % (resource_name, current_count, new_count, limit_count)
+
+
 def _raise_quota_error(resource_name, current_count, new_count, limit_count):
-    raise ValidationError(
-        "%s Quota Exceeded: Using %s + Requested %s but limited to %s"
-        % (resource_name, current_count, new_count, limit_count))
+    raise ValidationError(_quota_error_message(
+        resource_name, current_count, new_count, limit_count))
 
 
 def _pre_cache_sizes(driver):
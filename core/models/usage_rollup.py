@@ -0,0 +1,104 @@
+"""
+Hourly/daily usage aggregates, maintained by `core.metrics.rollup`.
+"""
+from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+
+from core.models.instance_history import InstanceStatusHistory
+
+HOURLY = 'hour'
+DAILY = 'day'
+
+
+class UsageRollup(models.Model):
+    """
+    Usage of one (provider, user, application) during one hour/day.
+
+    active_hours -- hours spent in an 'active' status
+    cpu_hours -- active_hours * CPUs of the size (at least 1)
+    instances_launched -- instances with a start_date in the bucket
+    """
+    PERIOD_CHOICES = (
+        (HOURLY, 'Hourly'),
+        (DAILY, 'Daily'),
+    )
+    period = models.CharField(max_length=8, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    provider = models.ForeignKey("Provider", related_name="+")
+    user = models.ForeignKey("AtmosphereUser", related_name="+")
+    application = models.ForeignKey(
+        "Application", null=True, blank=True, related_name="+")
+    active_hours = models.FloatField(default=0)
+    cpu_hours = models.FloatField(default=0)
+    instances_launched = models.IntegerField(default=0)
+
+    @property
+    def key(self):
+        return (self.period, self.bucket_start, self.provider_id,
+                self.user_id, self.application_id)
+
+    def __unicode__(self):
+        return "%s %s Provider:%s User:%s Application:%s: " \
+            "%s CPU-hours, %s launched" % (
+                self.period, self.bucket_start, self.provider_id,
+                self.user_id, self.application_id, self.cpu_hours,
+                self.instances_launched)
+
+    class Meta:
+        db_table = 'usage_rollup'
+        app_label = 'core'
+        index_together = [('period', 'bucket_start')]
+
+
+class UsageRollupCheckpoint(models.Model):
+    """
+    Rollups are complete up to `checkpoint`.
+    `dirty_since` is set when a history changes *before* the checkpoint,
+    the next update rebuilds the rollups from that date.
+    """
+    name = models.CharField(max_length=64, unique=True, default='default')
+    checkpoint = models.DateTimeField(null=True, blank=True)
+    dirty_since = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def current(cls):
+        checkpoint, _ = cls.objects.get_or_create(name='default')
+        return checkpoint
+
+    @classmethod
+    def invalidate(cls, changed_at):
+        """
+        Mark the rollups after `changed_at` as dirty (if they were computed)
+        """
+        return cls.objects.filter(checkpoint__gt=changed_at).filter(
+            Q(dirty_since__isnull=True) | Q(dirty_since__gt=changed_at)
+        ).update(dirty_since=changed_at)
+
+    def __unicode__(self):
+        return "Usage rollups to %s%s" % (
+            self.checkpoint,
+            " (dirty since %s)" % self.dirty_since if self.dirty_since else "")
+
+    class Meta:
+        db_table = 'usage_rollup_checkpoint'
+        app_label = 'core'
+
+
+def listen_for_history_changes(sender, instance, created=False, **kwargs):
+    """
+    Updates move the rollups forward from the checkpoint. Only histories
+    that change time *before* the checkpoint require a rebuild:
+    * New (or deleted) histories that start before it
+    * Histories end-dated before it
+    """
+    history = instance
+    if kwargs.get('signal') == post_delete or created:
+        UsageRollupCheckpoint.invalidate(history.start_date)
+    elif history.end_date:
+        UsageRollupCheckpoint.invalidate(history.end_date)
+
+
+# Instantiate the hooks:
+post_save.connect(listen_for_history_changes, sender=InstanceStatusHistory)
+post_delete.connect(listen_for_history_changes, sender=InstanceStatusHistory)
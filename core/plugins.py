@@ -1,13 +1,212 @@
 import inspect
+import os
+import threading
+import time
+from multiprocessing import TimeoutError as PoolTimeoutError
+from multiprocessing.pool import ThreadPool
 
 from django.utils.module_loading import import_string
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
+from django.db import connection
 from threepio import logger
 
+# plugin_path -> plugin class, each path is imported once per process.
+_plugin_classes = {}
+# (plugin class, method name) pairs whose signature was already checked.
+_checked_plugin_methods = set()
+# (pid, ThreadPool, free threads semaphore) running the plugin calls.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class PluginTimeout(Exception):
+    """
+    A plugin call did not return within USER_PLUGIN_TIMEOUT seconds
+    """
+    pass
+
+
+class PluginPoolFull(PluginTimeout):
+    """
+    A plugin call was not made: every thread of the plugin pool is busy
+    (with calls that have not returned yet)
+    """
+    pass
+
 
 def load_plugin_class(plugin_path):
-    return import_string(plugin_path)
+    plugin_cls = _plugin_classes.get(plugin_path)
+    if plugin_cls is None:
+        plugin_cls = _plugin_classes[plugin_path] = import_string(plugin_path)
+    return plugin_cls
+
+
+def _check_plugin_method(plugin_cls, plugin, method_name, **kwargs):
+    """
+    Log (once per plugin class) when `plugin.<method_name>` is missing
+    or does not accept `kwargs`.
+    """
+    if (plugin_cls, method_name) in _checked_plugin_methods:
+        return
+    _checked_plugin_methods.add((plugin_cls, method_name))
+    try:
+        inspect.getcallargs(getattr(plugin, method_name), **kwargs)
+    except AttributeError:
+        logger.info(
+            "Plugin %s missing method '%s'" % (plugin_cls, method_name))
+    except TypeError:
+        logger.info(
+            "Plugin %s method '%s' does not accept kwargs %s"
+            % (plugin_cls, method_name, ", ".join(kwargs.keys())))
+
+
+def _plugin_pool():
+    """
+    The (process-wide) pool of USER_PLUGIN_POOL_SIZE threads running the
+    plugin calls, and the semaphore counting its free threads. Built on
+    first use, and again in a forked process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool[0] != os.getpid():
+            size = getattr(settings, 'USER_PLUGIN_POOL_SIZE', 4)
+            _pool = (os.getpid(), ThreadPool(size),
+                     threading.BoundedSemaphore(size))
+        return _pool[1:]
+
+
+def _call_with_timeout(method, timeout, **kwargs):
+    """
+    Call `method(**kwargs)` in the plugin thread pool, raise PluginTimeout
+    if it has not returned after `timeout` seconds (the call keeps its
+    thread until it returns), or PluginPoolFull right away when every
+    thread of the pool is busy. A falsy `timeout` calls `method` inline.
+    """
+    if not timeout:
+        return method(**kwargs)
+    pool, free_threads = _plugin_pool()
+    if not free_threads.acquire(False):
+        raise PluginPoolFull(
+            "%s not called: every plugin thread is busy" % (method,))
+
+    def _call():
+        try:
+            return method(**kwargs)
+        finally:
+            # Each thread gets its own database connection, do not leak it.
+            connection.close()
+            free_threads.release()
+    try:
+        result = pool.apply_async(_call)
+    except Exception:
+        free_threads.release()
+        raise
+    try:
+        return result.get(timeout)
+    except PoolTimeoutError:
+        raise PluginTimeout(
+            "%s did not return within %s seconds" % (method, timeout))
+
+
+class UserPluginResults(object):
+    """
+    Per-user results of the Validation/Expiration plugins.
+
+    'Positive' results (valid, not expired) are kept for
+    USER_PLUGIN_CACHE_TTL seconds, 'negative' results (invalid, expired)
+    for USER_PLUGIN_NEGATIVE_CACHE_TTL seconds. Results of plugin calls
+    that failed or timed out are not cached -- instead the last known
+    result is served when there is one.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'plugin_calls': 0,
+            'plugin_errors': 0,
+            'plugin_timeouts': 0,
+            'plugin_pool_full': 0,
+            'plugin_seconds': 0.0,
+        }
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def call_plugin(self, method, **kwargs):
+        """
+        Call a plugin method, bounded by USER_PLUGIN_TIMEOUT, and count it.
+        """
+        timeout = getattr(settings, 'USER_PLUGIN_TIMEOUT', 10)
+        start = time.time()
+        try:
+            return _call_with_timeout(method, timeout, **kwargs)
+        except PluginPoolFull:
+            self._count('plugin_pool_full')
+            raise
+        except PluginTimeout:
+            self._count('plugin_timeouts')
+            raise
+        except Exception:
+            self._count('plugin_errors')
+            raise
+        finally:
+            self._count('plugin_calls')
+            self._count('plugin_seconds', time.time() - start)
+
+    def get_or_call(self, key, compute, is_negative):
+        """
+        Return the cached result for `key`, or call `compute()`.
+        `compute` returns (result, cacheable).
+        """
+        with self._lock:
+            entry = self._results.get(key)
+        if entry and time.time() < entry[1]:
+            self._count('hits')
+            return entry[0]
+        self._count('misses')
+        result, cacheable = compute()
+        if not cacheable:
+            if entry:
+                self._count('stale')
+                return entry[0]
+            return result
+        if is_negative(result):
+            ttl = getattr(settings, 'USER_PLUGIN_NEGATIVE_CACHE_TTL', 60)
+        else:
+            ttl = getattr(settings, 'USER_PLUGIN_CACHE_TTL', 300)
+        if ttl:
+            with self._lock:
+                self._results[key] = (result, time.time() + ttl)
+        return result
+
+    def invalidate(self, username=None):
+        """
+        Forget the results for `username` (Default: every user).
+        """
+        with self._lock:
+            for key in list(self._results):
+                if username is None or key[-1] == username:
+                    del self._results[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['cached'] = len(self._results)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / float(lookups) if lookups else 0.0
+        stats['plugin_avg_seconds'] = \
+            stats['plugin_seconds'] / stats['plugin_calls'] \
+            if stats['plugin_calls'] else 0.0
+        return stats
+
+
+user_plugin_results = UserPluginResults()
 
 
 class PluginManager(object):
@@ -214,26 +413,35 @@ please set settings.VALIDATION_PLUGINS to:
     def is_valid(cls, user):
         """
         Load each ValidationPlugin and call `plugin.validate_user(user)`
+        (Results are cached per-user, see UserPluginResults)
+        """
+        return user_plugin_results.get_or_call(
+            ('is_valid', tuple(cls.list_of_classes), user.username),
+            lambda: cls._is_valid(user),
+            is_negative=lambda _is_valid: not _is_valid)
+
+    @classmethod
+    def _is_valid(cls, user):
+        """
+        Returns (is_valid, cacheable)
         """
         _is_valid = False
+        cacheable = True
         for ValidationPlugin in cls.load_plugins(cls.list_of_classes):
             plugin = ValidationPlugin()
+            _check_plugin_method(
+                ValidationPlugin, plugin, 'validate_user', user=user)
             try:
-                inspect.getcallargs(
-                    getattr(plugin, 'validate_user'),
-                    user=user)
-            except AttributeError:
-                logger.info(
-                    "Validation plugin %s missing method 'validate_user'"
-                    % ValidationPlugin)
-            except TypeError:
-                logger.info(
-                    "Validation plugin %s does not accept kwarg `user`"
-                    % ValidationPlugin)
-            _is_valid = plugin.validate_user(user=user)
+                _is_valid = user_plugin_results.call_plugin(
+                    plugin.validate_user, user=user)
+            except PluginTimeout as exc:
+                logger.warn("Validation plugin %s timed out: %s"
+                            % (ValidationPlugin, exc))
+                _is_valid = False
+                cacheable = False
             if _is_valid:
-                return True
-        return _is_valid
+                return (True, True)
+        return (_is_valid, cacheable)
 
 
 class ExpirationPluginManager(PluginListManager):
@@ -250,28 +458,30 @@ class ExpirationPluginManager(PluginListManager):
     def is_expired(cls, user):
         """
         Load each ExpirationPlugin and call `plugin.is_expired(user)`
+        (Results are cached per-user, see UserPluginResults)
+        """
+        return user_plugin_results.get_or_call(
+            ('is_expired', tuple(cls.list_of_classes), user.username),
+            lambda: cls._is_expired(user),
+            is_negative=lambda _is_expired: _is_expired)
+
+    @classmethod
+    def _is_expired(cls, user):
+        """
+        Returns (is_expired, cacheable)
         """
         _is_expired = False
         for ExpirationPlugin in cls.load_plugins(cls.list_of_classes):
             plugin = ExpirationPlugin()
+            _check_plugin_method(
+                ExpirationPlugin, plugin, 'is_expired', user=user)
             try:
-                inspect.getcallargs(
-                    getattr(plugin, 'is_expired'),
-                    user=user)
-            except AttributeError:
-                logger.info(
-                    "Expiration plugin %s does not have a 'is_expired' method"
-                    % ExpirationPlugin)
-            except TypeError:
-                logger.info("Expiration plugin %s does not accept kwarg `user`"
-                            % ExpirationPlugin)
-            try:
-                # TODO: Set a reasonable timeout but don't let it hold this indefinitely
-                _is_expired = plugin.is_expired(user=user)
+                _is_expired = user_plugin_results.call_plugin(
+                    plugin.is_expired, user=user)
             except Exception as exc:
                 logger.info("Expiration plugin %s encountered an error: %s" % (ExpirationPlugin, exc))
-                _is_expired = True
+                return (True, False)
 
             if _is_expired:
-                return True
-        return _is_expired
+                return (True, True)
+        return (_is_expired, True)
@@ -8,12 +8,17 @@ class ModelRelatedField(serializers.RelatedField):
     """
     Related field that renders the representation based on `serializer_class`
     and converts to an internal representation using `lookup_field`.
+
+    Pass `refetch=False` to render the related object as-is (ex: when it was
+    already loaded with select_related/prefetch_related) instead of
+    re-querying it through `queryset`.
     """
     lookup_field = "pk"
 
     def __init__(self, *args, **kwargs):
         self.serializer_class = kwargs.pop("serializer_class")
         self.lookup_field = kwargs.pop("lookup_field", self.lookup_field)
+        self.refetch = kwargs.pop("refetch", True)
         super(ModelRelatedField, self).__init__(*args, **kwargs)
 
     def get_queryset(self):
@@ -31,8 +36,10 @@ class ModelRelatedField(serializers.RelatedField):
             "%s should have a `serializer_class` attribute."
             % self.___class__.__name__
         )
-        queryset = self.get_queryset()
-        obj = queryset.get(pk=value.pk)
+        if self.refetch:
+            obj = self.get_queryset().get(pk=value.pk)
+        else:
+            obj = value
         serializer = self.serializer_class(obj, context=self.context)
         return serializer.data
 
@@ -0,0 +1,88 @@
+"""
+test that the incremental UserAllocationUsageLedger matches total_usage
+"""
+import uuid
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests.factories import (
+    UserFactory, ProviderFactory, IdentityFactory, ProviderMachineFactory,
+    InstanceFactory, InstanceHistoryFactory, InstanceStatusFactory,
+    AllocationSourceFactory)
+from core.models import EventTable, UserAllocationUsageLedger
+from core.models.allocation_source import ledger_usage, total_usage
+
+
+class UsageLedgerTest(TestCase):
+
+    def setUp(self):
+        self.start = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        self.user = UserFactory.create(username='test-username')
+        identity = IdentityFactory.create_identity(
+            created_by=self.user, provider=ProviderFactory.create())
+        machine = ProviderMachineFactory.create_provider_machine(
+            self.user, identity)
+        self.instance = InstanceFactory.create(
+            name="Instance", provider_alias=uuid.uuid4(),
+            source=machine.instance_source, created_by=self.user,
+            created_by_identity=identity, start_date=self.start)
+        self.active = InstanceStatusFactory.create(name='active')
+        self.suspended = InstanceStatusFactory.create(name='suspended')
+        self.source = AllocationSourceFactory.create(
+            name='TG-LEDGER', compute_allowed=1000)
+        self.other_source = AllocationSourceFactory.create(
+            name='TG-OTHER', compute_allowed=1000)
+        self.history = self._create_history(self.active, minutes=0)
+        self._assign_source(self.source, minutes=1)
+
+    def _create_history(self, status, minutes):
+        return InstanceHistoryFactory.create(
+            status=status, instance=self.instance,
+            start_date=self.start + timedelta(minutes=minutes))
+
+    def _end_history(self, minutes):
+        self.history.end_date = self.start + timedelta(minutes=minutes)
+        self.history.save()
+
+    def _assign_source(self, source, minutes):
+        EventTable.objects.create(
+            name='instance_allocation_source_changed',
+            entity_id=self.user.username,
+            payload={'instance_id': str(self.instance.provider_alias),
+                     'allocation_source_name': source.name},
+            timestamp=self.start + timedelta(minutes=minutes))
+
+    def _is_dirty(self, source):
+        return UserAllocationUsageLedger.objects.get(
+            user=self.user, allocation_source=source).dirty
+
+    def assertLedgerMatches(self, minutes):
+        end_date = self.start + timedelta(minutes=minutes)
+        for source in (self.source, self.other_source):
+            self.assertEqual(
+                ledger_usage(self.user, source, self.start,
+                             end_date=end_date),
+                total_usage(self.user.username, self.start,
+                            allocation_source_name=source.name,
+                            end_date=end_date, burn_rate=True))
+
+    def test_ledger_matches_total_usage(self):
+        self.assertLedgerMatches(minutes=120)
+        self.assertLedgerMatches(minutes=180)
+
+        # Back-dated history changes
+        self._end_history(minutes=60)
+        self.history = self._create_history(self.suspended, minutes=60)
+        self._end_history(minutes=90)
+        self.history = self._create_history(self.active, minutes=90)
+        self.assertTrue(self._is_dirty(self.source))
+        self.assertLedgerMatches(minutes=240)
+
+        # Back-dated allocation source change
+        self._assign_source(self.other_source, minutes=100)
+        self.assertTrue(self._is_dirty(self.source))
+        self.assertLedgerMatches(minutes=300)
+        self.assertLedgerMatches(minutes=360)
+        self.assertFalse(self._is_dirty(self.source))
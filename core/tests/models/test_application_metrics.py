@@ -0,0 +1,67 @@
+"""
+test the ApplicationMetrics kept up to date by signals
+"""
+import uuid
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from api.tests.factories import (
+    UserFactory, GroupFactory, ProjectFactory, ProviderFactory,
+    IdentityFactory, ProviderMachineFactory, InstanceFactory,
+    InstanceHistoryFactory, InstanceStatusFactory)
+from core.models import ApplicationBookmark, ApplicationMetrics
+
+
+class ApplicationMetricsTest(TestCase):
+
+    def setUp(self):
+        self.user = UserFactory.create(username='test-username')
+        identity = IdentityFactory.create_identity(
+            created_by=self.user, provider=ProviderFactory.create())
+        self.machine = ProviderMachineFactory.create_provider_machine(
+            self.user, identity)
+        self.application = self.machine.application_version.application
+        self.identity = identity
+        self.active = InstanceStatusFactory.create(name='active')
+
+    def _launch(self):
+        instance = InstanceFactory.create(
+            name="Instance", provider_alias=uuid.uuid4(),
+            source=self.machine.instance_source, created_by=self.user,
+            created_by_identity=self.identity, start_date=timezone.now())
+        return instance
+
+    def _metrics(self):
+        return ApplicationMetrics.objects.get(
+            application=self.application).as_dict()
+
+    def test_incremental_updates(self):
+        instance = self._launch()
+        self._launch()
+        # Only the first active history counts
+        InstanceHistoryFactory.create(status=self.active, instance=instance)
+        InstanceHistoryFactory.create(status=self.active, instance=instance)
+        ApplicationBookmark.objects.create(
+            user=self.user, application=self.application)
+        project = ProjectFactory.create(
+            owner=GroupFactory.create(name=self.user.username),
+            created_by=self.user)
+        project.applications.add(self.application)
+        metrics = self._metrics()
+        self.assertEqual(metrics['instances'],
+                         {'total': 2, 'success': 1, 'percent': 50.0})
+        self.assertEqual(metrics['bookmarks'], 1)
+        self.assertEqual(metrics['projects'], 1)
+        project.applications.clear()
+        self.assertEqual(self._metrics()['projects'], 0)
+
+    def test_rebuild(self):
+        instance = self._launch()
+        InstanceHistoryFactory.create(status=self.active, instance=instance)
+        expected = self._metrics()
+        ApplicationMetrics.objects.all().delete()
+        call_command('rebuild_application_metrics', stdout=StringIO())
+        self.assertEqual(self._metrics(), expected)
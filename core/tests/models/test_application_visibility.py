@@ -0,0 +1,45 @@
+"""
+test Application.images_for_user with the ApplicationVisibility index
+"""
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests.factories import (
+    UserFactory, ProviderFactory, IdentityFactory, ProviderMachineFactory)
+from core.models import Application, ApplicationVersionMembership
+
+
+class ApplicationVisibilityTest(TestCase):
+
+    def setUp(self):
+        provider = ProviderFactory.create()
+        self.owner = UserFactory.create(username='test-owner')
+        owner_identity = IdentityFactory.create_identity(
+            created_by=self.owner, provider=provider)
+        self.user = UserFactory.create(username='test-username')
+        self.user_identity = IdentityFactory.create_identity(
+            created_by=self.user, provider=provider)
+        self.machine = ProviderMachineFactory.create_provider_machine(
+            self.owner, owner_identity)
+        self.application = self.machine.application_version.application
+
+    def _visible(self, user):
+        return list(Application.images_for_user(user))
+
+    def test_public_and_shared_images(self):
+        self.assertEqual(self._visible(self.user), [self.application])
+        self.application.private = True
+        self.application.save()
+        self.assertEqual(self._visible(self.user), [])
+        # The owner always sees their images
+        self.assertEqual(self._visible(self.owner), [self.application])
+        ApplicationVersionMembership.objects.create(
+            image_version=self.machine.application_version,
+            group=self.user.memberships.first().group)
+        self.assertEqual(self._visible(self.user), [self.application])
+
+    def test_end_dated_machine(self):
+        source = self.machine.instance_source
+        source.end_date = timezone.now()
+        source.save()
+        self.assertEqual(self._visible(self.user), [])
@@ -0,0 +1,85 @@
+"""
+test the Instance.last_history pointer
+"""
+import uuid
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from api.tests.factories import (
+    UserFactory, ProviderFactory, IdentityFactory, ProviderMachineFactory,
+    InstanceFactory, InstanceHistoryFactory, InstanceStatusFactory,
+    SizeFactory)
+from core.models import Instance, InstanceStatusHistory
+
+
+class InstanceLastHistoryTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        user = UserFactory.create(username='test-username')
+        identity = IdentityFactory.create_identity(
+            created_by=user, provider=ProviderFactory.create())
+        machine = ProviderMachineFactory.create_provider_machine(
+            user, identity)
+        self.instance = InstanceFactory.create(
+            name="Instance", provider_alias=uuid.uuid4(),
+            source=machine.instance_source, created_by=user,
+            created_by_identity=identity,
+            start_date=self.now - timedelta(hours=2))
+        self.active = InstanceStatusFactory.create(name='active')
+        self.suspended = InstanceStatusFactory.create(name='suspended')
+
+    def _refresh(self):
+        return Instance.objects.get(id=self.instance.id)
+
+    def test_pointer_follows_newest_history(self):
+        first = InstanceHistoryFactory.create(
+            status=self.active, instance=self.instance,
+            start_date=self.now - timedelta(hours=2))
+        self.assertEqual(self._refresh().last_history_id, first.id)
+        second = InstanceHistoryFactory.create(
+            status=self.suspended, instance=self.instance,
+            start_date=self.now - timedelta(hours=1))
+        # Saving an older history does not move the pointer back
+        first.end_date = second.start_date
+        first.save()
+        instance = self._refresh()
+        self.assertEqual(instance.last_history_id, second.id)
+        self.assertEqual(instance.api_status(), 'suspended')
+
+    def test_bulk_created_pointers(self):
+        size = SizeFactory.create()
+        histories = InstanceStatusHistory.objects.bulk_create([
+            InstanceStatusHistory(
+                status=status, instance=self.instance, size=size,
+                start_date=self.now - timedelta(hours=hours))
+            for status, hours in ((self.suspended, 1), (self.active, 2))])
+        self.assertIsNone(self._refresh().last_history_id)
+        updated = InstanceStatusHistory.update_instance_pointers(histories)
+        self.assertEqual(updated, 1)
+        self.assertEqual(self._refresh().last_history_id, histories[0].id)
+
+    def test_get_last_history_is_read_only(self):
+        first = InstanceHistoryFactory.create(
+            status=self.active, instance=self.instance,
+            start_date=self.now - timedelta(hours=2))
+        second = InstanceHistoryFactory.create(
+            status=self.suspended, instance=self.instance,
+            start_date=self.now - timedelta(hours=1))
+        Instance.objects.filter(id=self.instance.id).update(
+            last_history=first)
+        # A stale pointer is neither trusted nor fixed on read
+        self.assertEqual(self._refresh().get_last_history(), second)
+        self.assertEqual(self._refresh().last_history_id, first.id)
+
+    def test_backfill(self):
+        history = InstanceHistoryFactory.create(
+            status=self.active, instance=self.instance)
+        Instance.objects.filter(id=self.instance.id).update(
+            last_history=None)
+        call_command('backfill_instance_last_history', stdout=StringIO())
+        self.assertEqual(self._refresh().last_history_id, history.id)
@@ -0,0 +1,77 @@
+"""
+test maintenance record models
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import MaintenanceRecord
+from core.models.maintenance import invalidate_maintenance_records
+
+
+class TestMaintenanceRecordCache(TestCase):
+
+    def setUp(self):
+        invalidate_maintenance_records()
+        self.now = timezone.now()
+
+    def tearDown(self):
+        invalidate_maintenance_records()
+
+    def _create_record(self, start_date, end_date=None):
+        return MaintenanceRecord.objects.create(
+            title="Maintenance", message="Down for maintenance",
+            start_date=start_date, end_date=end_date)
+
+    def test_no_maintenance_is_cached(self):
+        self.assertEquals(MaintenanceRecord.active_global(), [])
+        with CaptureQueriesContext(connection) as query_context:
+            self.assertEquals(MaintenanceRecord.active_global(), [])
+        self.assertEquals(len(query_context.captured_queries), 0)
+
+    def test_upcoming_record_starts_and_ends_on_time(self):
+        record = self._create_record(self.now + timedelta(hours=1),
+                                     self.now + timedelta(hours=2))
+        self.assertEquals(MaintenanceRecord.active_global(self.now), [])
+        with CaptureQueriesContext(connection) as query_context:
+            during = MaintenanceRecord.active_global(
+                self.now + timedelta(minutes=90))
+            after = MaintenanceRecord.active_global(
+                self.now + timedelta(hours=3))
+        self.assertEquals([r.id for r in during], [record.id])
+        self.assertEquals(after, [])
+        self.assertEquals(len(query_context.captured_queries), 0)
+
+
+class TestMaintenanceRecordInvalidation(TransactionTestCase):
+
+    def setUp(self):
+        invalidate_maintenance_records()
+        self.now = timezone.now()
+
+    def tearDown(self):
+        invalidate_maintenance_records()
+
+    def test_save_and_delete_invalidate(self):
+        self.assertEquals(MaintenanceRecord.active_global(), [])
+        record = MaintenanceRecord.objects.create(
+            title="Maintenance", message="Down for maintenance",
+            start_date=self.now - timedelta(hours=1))
+        self.assertEquals(
+            [r.id for r in MaintenanceRecord.active_global()], [record.id])
+        record.delete()
+        self.assertEquals(MaintenanceRecord.active_global(), [])
+
+    def test_invalidated_on_commit(self):
+        self.assertEquals(MaintenanceRecord.active_global(), [])
+        with transaction.atomic():
+            record = MaintenanceRecord.objects.create(
+                title="Maintenance", message="Down for maintenance",
+                start_date=self.now - timedelta(hours=1))
+            # Not committed yet: the cached records are kept
+            self.assertEquals(MaintenanceRecord.active_global(), [])
+        self.assertEquals(
+            [r.id for r in MaintenanceRecord.active_global()], [record.id])
@@ -0,0 +1,98 @@
+import time
+
+from django.test import TestCase, override_settings
+
+from core.plugins import (
+    ValidationPluginManager, ExpirationPluginManager, PluginPoolFull,
+    PluginTimeout, _call_with_timeout, _plugin_pool, user_plugin_results)
+
+
+class User(object):
+    def __init__(self, username):
+        self.username = username
+
+
+class CountingValidation(object):
+    calls = 0
+
+    def validate_user(self, user):
+        CountingValidation.calls += 1
+        return user.username != 'invalid'
+
+
+class SlowExpiration(object):
+    def is_expired(self, user):
+        time.sleep(1)
+        return False
+
+
+@override_settings(USER_PLUGIN_CACHE_TTL=300,
+                   USER_PLUGIN_NEGATIVE_CACHE_TTL=60,
+                   USER_PLUGIN_TIMEOUT=None)
+class UserPluginResultsTest(TestCase):
+
+    def setUp(self):
+        self.validation_classes = ValidationPluginManager.list_of_classes
+        self.expiration_classes = ExpirationPluginManager.list_of_classes
+        ValidationPluginManager.list_of_classes = [
+            'core.tests.test_plugins.CountingValidation']
+        ExpirationPluginManager.list_of_classes = [
+            'core.tests.test_plugins.SlowExpiration']
+        CountingValidation.calls = 0
+        user_plugin_results.invalidate()
+
+    def tearDown(self):
+        ValidationPluginManager.list_of_classes = self.validation_classes
+        ExpirationPluginManager.list_of_classes = self.expiration_classes
+        user_plugin_results.invalidate()
+
+    def test_results_are_cached_per_user(self):
+        for _ in range(3):
+            self.assertTrue(ValidationPluginManager.is_valid(User('valid')))
+            self.assertFalse(ValidationPluginManager.is_valid(User('invalid')))
+        self.assertEqual(CountingValidation.calls, 2)
+        user_plugin_results.invalidate('valid')
+        self.assertTrue(ValidationPluginManager.is_valid(User('valid')))
+        self.assertEqual(CountingValidation.calls, 3)
+
+    @override_settings(USER_PLUGIN_NEGATIVE_CACHE_TTL=0)
+    def test_negative_results_ttl(self):
+        for _ in range(3):
+            self.assertFalse(ValidationPluginManager.is_valid(User('invalid')))
+        self.assertEqual(CountingValidation.calls, 3)
+
+    @override_settings(USER_PLUGIN_TIMEOUT=0.1)
+    def test_timeout_is_not_cached(self):
+        timeouts = user_plugin_results.stats()['plugin_timeouts']
+        self.assertTrue(ExpirationPluginManager.is_expired(User('slow')))
+        self.assertEqual(
+            user_plugin_results.stats()['plugin_timeouts'], timeouts + 1)
+        self.assertEqual(user_plugin_results.stats()['cached'], 0)
+
+
+class CallWithTimeoutTest(TestCase):
+
+    def test_full_pool_fails_fast(self):
+        pool, free_threads = _plugin_pool()
+        busy = 0
+        while free_threads.acquire(False):
+            busy += 1
+        try:
+            start = time.time()
+            with self.assertRaises(PluginPoolFull):
+                _call_with_timeout(lambda: True, 5)
+            self.assertLess(time.time() - start, 1)
+        finally:
+            for _ in range(busy):
+                free_threads.release()
+        self.assertTrue(_call_with_timeout(lambda: True, 5))
+
+    def test_call_errors_are_raised(self):
+        def failing_call():
+            raise ValueError("Plugin failed")
+        with self.assertRaises(ValueError):
+            _call_with_timeout(failing_call, 1)
+        with self.assertRaises(PluginTimeout):
+            _call_with_timeout(lambda: time.sleep(0.5), 0.1)
+        self.assertEqual(
+            _call_with_timeout(lambda value: value, 1, value=42), 42)
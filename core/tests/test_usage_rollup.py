@@ -0,0 +1,84 @@
+import uuid
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests.factories import (
+    UserFactory, ProviderFactory, IdentityFactory, ProviderMachineFactory,
+    InstanceFactory, InstanceHistoryFactory, InstanceStatusFactory,
+    SizeFactory)
+from core.models import UsageRollupCheckpoint
+from core.metrics.rollup import update_usage_rollups, usage_between
+from core.metrics.system import (
+    _counts_between_boundaries, _print_csv_row_between_dates)
+
+
+class UsageRollupTest(TestCase):
+
+    def setUp(self):
+        self.start = datetime(2017, 3, 1, 10, tzinfo=timezone.utc)
+        self.provider = ProviderFactory.create()
+        self.user = UserFactory.create(username='test-username')
+        identity = IdentityFactory.create_identity(
+            created_by=self.user, provider=self.provider)
+        machine = ProviderMachineFactory.create_provider_machine(
+            self.user, identity)
+        self.instance = InstanceFactory.create(
+            name="Instance", provider_alias=uuid.uuid4(),
+            source=machine.instance_source, created_by=self.user,
+            created_by_identity=identity, start_date=self.start)
+        self.size = SizeFactory.create(
+            provider=self.provider, cpu=2, disk=0, root=0, mem=1024)
+        self.active = InstanceStatusFactory.create(name='active')
+        self.suspended = InstanceStatusFactory.create(name='suspended')
+
+    def _history(self, status, start, end=None):
+        return InstanceHistoryFactory.create(
+            status=status, size=self.size, instance=self.instance,
+            start_date=start, end_date=end)
+
+    def _daily_usage(self):
+        return usage_between(
+            self.start - timedelta(days=1), self.start + timedelta(days=1),
+            group_by=('provider', 'user'))
+
+    def test_incremental_updates(self):
+        self._history(self.active, self.start)
+        update_usage_rollups(end_date=self.start + timedelta(hours=1))
+        update_usage_rollups(end_date=self.start + timedelta(hours=3))
+        usage = self._daily_usage()
+        self.assertEqual(len(usage), 1)
+        self.assertEqual(usage[0]['user'], self.user.id)
+        self.assertAlmostEqual(usage[0]['active_hours'], 3)
+        self.assertAlmostEqual(usage[0]['cpu_hours'], 6)
+        self.assertEqual(usage[0]['instances_launched'], 1)
+
+    def test_changes_before_checkpoint_rebuild(self):
+        active = self._history(self.active, self.start)
+        update_usage_rollups(end_date=self.start + timedelta(hours=3))
+        # The instance was actually suspended after one hour
+        active.end_date = self.start + timedelta(hours=1)
+        active.save()
+        self._history(self.suspended, self.start + timedelta(hours=1))
+        self.assertIsNotNone(UsageRollupCheckpoint.current().dirty_since)
+        update_usage_rollups(end_date=self.start + timedelta(hours=3))
+        usage = self._daily_usage()
+        self.assertAlmostEqual(usage[0]['active_hours'], 1)
+        self.assertAlmostEqual(usage[0]['cpu_hours'], 2)
+        self.assertEqual(usage[0]['instances_launched'], 1)
+
+    def test_launch_counts(self):
+        self._history(self.active, self.start)
+        update_usage_rollups(end_date=self.start + timedelta(hours=3))
+        day_start = self.start.replace(hour=0)
+        counts = _counts_between_boundaries(
+            [self.provider.id],
+            [day_start - timedelta(days=1), day_start,
+             day_start + timedelta(days=1)])
+        self.assertEqual([count[0] for count in counts], [0, 1])
+        # Sub-day windows count the instances themselves
+        row = _print_csv_row_between_dates(
+            [self.provider.id], self.start - timedelta(hours=1),
+            self.start + timedelta(hours=1))
+        self.assertEqual(row.split(',')[2], '1')
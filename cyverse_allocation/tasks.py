@@ -1,61 +1,128 @@
 import pprint
 
 from business_rules import run_all
+from celery import chord
 from celery.decorators import task
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django.utils.timezone import datetime
 from threepio import celery_logger as logger
 
 from core.models import EventTable
 from core.models.allocation_source import AllocationSourceSnapshot, AllocationSource, UserAllocationSnapshot, \
-    total_usage
+    ledger_usage
 from cyverse_allocation.cyverse_rules_engine_setup import CyverseTestRenewalVariables, CyverseTestRenewalActions, \
     cyverse_rules, renewal_strategies
 
 
-@task(name="update_snapshot_cyverse")
-def update_snapshot_cyverse(start_date=None, end_date=None):
+@task(name="update_snapshot_cyverse", bind=True)
+def update_snapshot_cyverse(self, start_date=None, end_date=None):
+    """
+    Split the AllocationSources into (at most) ALLOCATION_SNAPSHOT_SHARDS
+    shards, compute each shard in its own subtask and aggregate the results
+    in a chord callback. (How many shards run at once is up to the workers.)
+    When called directly (not by a worker) the shards are computed in-process.
+    """
     logger.debug("update_snapshot_cyverse task started at %s." % datetime.now())
     end_date = timezone.now().replace(microsecond=0) if not end_date else end_date
 
-    for allocation_source in AllocationSource.objects.order_by('name'):
-        # calculate and save snapshots here
-        allocation_source_name = allocation_source.name
-        last_renewal_event = EventTable.objects.filter(
-            name='allocation_source_created_or_renewed',
-            payload__allocation_source_name__exact=str(allocation_source_name)).order_by('timestamp')
+    source_ids = list(AllocationSource.objects.order_by('name').values_list('id', flat=True))
+    shard_count = max(1, getattr(settings, 'ALLOCATION_SNAPSHOT_SHARDS', 4))
+    shards = [source_ids[i::shard_count] for i in range(min(shard_count, len(source_ids)))]
 
-        if not last_renewal_event:
-            logger.info('Allocation Source %s Create/Renewal event missing', allocation_source_name)
-            continue
-
-        start_date = last_renewal_event.last().timestamp.replace(microsecond=0) if not start_date else start_date
-
-        total_compute_used = 0
-        total_burn_rate = 0
-        for user in allocation_source.all_users:
-            compute_used, burn_rate = total_usage(user.username, start_date=start_date,
-                                                  end_date=end_date, allocation_source_name=allocation_source_name,
-                                                  burn_rate=True)
-
-            UserAllocationSnapshot.objects.update_or_create(allocation_source=allocation_source, user=user,
-                                                            defaults={'compute_used': compute_used,
-                                                                      'burn_rate': burn_rate})
-            total_compute_used += compute_used
-            total_burn_rate += burn_rate
+    if self.request.called_directly or not shards:
+        # A chord without shards would never call its callback
+        shard_results = [_snapshot_allocation_sources(shard, start_date, end_date) for shard in shards]
+        aggregate_snapshot_cyverse(shard_results, end_date)
+        return
+    chord(
+        (update_snapshot_cyverse_shard.si(shard, start_date, end_date) for shard in shards),
+        aggregate_snapshot_cyverse.s(end_date)
+    ).apply_async()
+    logger.debug("update_snapshot_cyverse task dispatched %s shards at %s." % (len(shards), datetime.now()))
+
+
+@task(name="update_snapshot_cyverse_shard")
+def update_snapshot_cyverse_shard(source_ids, start_date=None, end_date=None):
+    return _snapshot_allocation_sources(source_ids, start_date, end_date)
+
+
+@task(name="aggregate_snapshot_cyverse")
+def aggregate_snapshot_cyverse(shard_results, end_date):
+    """
+    Chord callback: write the AllocationSourceSnapshot for every source
+    computed by the shards, run the rules engine, then fire-off an
+    allocation threshold check.
+    """
+    totals = [total for shard in shard_results for total in shard]
+    sources = AllocationSource.objects.in_bulk([total['allocation_source_id'] for total in totals])
+    # Skip the sources removed since their shard ran
+    totals = [total for total in totals if total['allocation_source_id'] in sources]
+    for total in sorted(totals, key=lambda total: sources[total['allocation_source_id']].name):
+        allocation_source = sources[total['allocation_source_id']]
         AllocationSourceSnapshot.objects.update_or_create(allocation_source=allocation_source,
-                                                          defaults={'compute_used': total_compute_used,
-                                                                    'global_burn_rate': total_burn_rate})
+                                                          defaults={'compute_used': total['compute_used'],
+                                                                    'global_burn_rate': total['burn_rate']})
 
         run_all(rule_list=cyverse_rules,
-                defined_variables=CyverseTestRenewalVariables(allocation_source, end_date, start_date),
+                defined_variables=CyverseTestRenewalVariables(allocation_source, end_date, total['start_date']),
                 defined_actions=CyverseTestRenewalActions(allocation_source, end_date), )
     # At the end of the task, fire-off an allocation threshold check
     logger.debug("update_snapshot_cyverse task finished at %s." % datetime.now())
     allocation_threshold_check.apply_async()
 
 
+def _snapshot_allocation_sources(source_ids, start_date, end_date):
+    """
+    Calculate and save the UserAllocationSnapshots for each AllocationSource in `source_ids`.
+    Returns the per-source totals to be aggregated by `aggregate_snapshot_cyverse`.
+    A source that fails is logged and left out, so the rest of the shard is still aggregated.
+    """
+    totals = []
+    for allocation_source in AllocationSource.objects.filter(id__in=source_ids).order_by('name'):
+        try:
+            with transaction.atomic():
+                total = _snapshot_allocation_source(allocation_source, start_date, end_date)
+        except Exception:
+            logger.exception('Could not snapshot Allocation Source %s', allocation_source.name)
+            continue
+        if total:
+            totals.append(total)
+    return totals
+
+
+def _snapshot_allocation_source(allocation_source, start_date, end_date):
+    allocation_source_name = allocation_source.name
+    last_renewal_event = EventTable.objects.filter(
+        name='allocation_source_created_or_renewed',
+        payload__allocation_source_name__exact=str(allocation_source_name)).order_by('timestamp')
+
+    if not last_renewal_event:
+        logger.info('Allocation Source %s Create/Renewal event missing', allocation_source_name)
+        return None
+
+    source_start_date = last_renewal_event.last().timestamp.replace(microsecond=0) \
+        if not start_date else start_date
+
+    total_compute_used = 0
+    total_burn_rate = 0
+    for user in allocation_source.all_users:
+        compute_used, burn_rate = ledger_usage(user, allocation_source, source_start_date, end_date=end_date)
+
+        UserAllocationSnapshot.objects.update_or_create(allocation_source=allocation_source, user=user,
+                                                        defaults={'compute_used': compute_used,
+                                                                  'burn_rate': burn_rate})
+        total_compute_used += compute_used
+        total_burn_rate += burn_rate
+    return {
+        'allocation_source_id': allocation_source.id,
+        'start_date': source_start_date,
+        'compute_used': total_compute_used,
+        'burn_rate': total_burn_rate,
+    }
+
+
 @task(name="allocation_threshold_check")
 def allocation_threshold_check():
     logger.debug("allocation_threshold_check task started at %s." % datetime.now())
@@ -0,0 +1,62 @@
+import uuid
+
+import mock
+from django.test import TestCase, override_settings
+
+from api.tests.factories import UserFactory, UserAllocationSourceFactory
+from core.models import AllocationSource, EventTable, UserAllocationSnapshot
+from cyverse_allocation.tasks import update_snapshot_cyverse
+
+
+def create_allocation_source(name):
+    EventTable.objects.create(
+        name='allocation_source_created_or_renewed',
+        entity_id=name,
+        payload={'uuid': str(uuid.uuid4()),
+                 'allocation_source_name': name,
+                 'compute_allowed': 1000,
+                 'renewal_strategy': 'default'})
+    return AllocationSource.objects.get(name=name)
+
+
+def fake_ledger_usage(user, allocation_source, start_date, end_date=None):
+    if allocation_source.name == 'TG-FAILING':
+        raise Exception("Usage is unavailable")
+    return 1.5, 0.5
+
+
+@mock.patch('cyverse_allocation.tasks.allocation_threshold_check')
+class UpdateSnapshotCyverseTest(TestCase):
+
+    def test_no_allocation_sources(self, threshold_check):
+        with mock.patch('cyverse_allocation.tasks.chord') as chord:
+            update_snapshot_cyverse.apply()
+        self.assertFalse(chord.called)
+        threshold_check.apply_async.assert_called_once_with()
+
+    @override_settings(ALLOCATION_SNAPSHOT_SHARDS=2)
+    def test_shard_count(self, threshold_check):
+        for name in ('TG-ONE', 'TG-TWO', 'TG-THREE'):
+            create_allocation_source(name)
+        with mock.patch('cyverse_allocation.tasks.chord') as chord:
+            update_snapshot_cyverse.apply()
+        shards = list(chord.call_args[0][0])
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(sorted(len(shard.args[0]) for shard in shards), [1, 2])
+
+    @mock.patch('cyverse_allocation.tasks.ledger_usage', fake_ledger_usage)
+    def test_failed_source_is_skipped(self, threshold_check):
+        user = UserFactory.create()
+        for name in ('TG-FAILING', 'TG-WORKING'):
+            UserAllocationSourceFactory.create(
+                user=user, allocation_source=create_allocation_source(name))
+        update_snapshot_cyverse()
+        snapshots = UserAllocationSnapshot.objects.filter(user=user)
+        self.assertEqual(
+            [(snapshot.allocation_source.name, snapshot.compute_used)
+             for snapshot in snapshots],
+            [('TG-WORKING', 1.5)])
+        self.assertEqual(
+            AllocationSource.objects.get(name='TG-WORKING').snapshot.compute_used,
+            1.5)
+        threshold_check.apply_async.assert_called_once_with()
@@ -8,7 +8,7 @@ from core.models.allocation_source import (
     UserAllocationSource, AllocationSourceSnapshot,
     AllocationSource, UserAllocationSnapshot
 )
-from core.models.allocation_source import total_usage
+from core.models.allocation_source import total_usage, ledger_usage
 from .allocation import (TASAPIDriver, fill_user_allocation_sources, select_valid_allocation)
 from .exceptions import TASPluginException
 from .models import TASAllocationReport
@@ -193,10 +193,8 @@ def update_snapshot(start_date=None, end_date=None):
                 start_date = created_or_updated_event.payload['start_date']
 
             for user in allocation_source.all_users:
-                compute_used, burn_rate = total_usage(user.username, start_date,
-                                                      allocation_source_name=allocation_source.name,
-                                                      end_date=end_date,
-                                                      burn_rate=True)
+                compute_used, burn_rate = ledger_usage(user, allocation_source, start_date,
+                                                       end_date=end_date)
                 total_burn_rate += burn_rate
                 UserAllocationSnapshot.objects.update_or_create(
                     allocation_source_id=allocation_source.id,
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Benchmark the `ProviderSnapshot` indexes (images by id, instances by
+tenant), the `AccountDriver` project indexes (by id and by name) and the
+reconciliation helpers that use them (`_make_tenant_owner_map`,
+`_end_date_missing_database_machines`,
+`AccountDriver.tenant_instances_map` and
+`AccountDriver.add_owner_to_machine`) with synthetic listings, to check
+that they scale linearly with the number of images and instances.
+"""
+import argparse
+import timeit
+
+import django
+django.setup()
+
+from service.accounts.openstack_manager import AccountDriver
+from service.monitoring import ProviderSnapshot, _make_tenant_owner_map
+from service.tasks.monitoring import _end_date_missing_database_machines
+
+
+class FakeProject(object):
+    def __init__(self, number):
+        self.id = "%032x" % number
+        self.name = "user%s" % number
+
+
+class FakeImage(dict):
+    def __init__(self, number):
+        super(FakeImage, self).__init__(id="image-%s" % number)
+        self.id = self['id']
+
+
+class FakeMachine(object):
+    def __init__(self, number):
+        self.identifier = "image-%s" % number
+
+
+class FakeInstance(object):
+    def __init__(self, number, project):
+        self.id = "instance-%s" % number
+        self.extra = {'tenantId': project.id, 'status': 'active'}
+        self.owner = project.id
+        self._node = self
+
+
+class FakeProvider(object):
+    location = "benchmark"
+
+
+class BenchmarkAccountDriver(AccountDriver):
+    """
+    AccountDriver that 'lists' the synthetic projects and instances
+    """
+    def __init__(self, projects, instances):
+        self._projects = projects
+        self._instances = instances
+        self._indexed_projects = None
+
+    def list_projects(self, force=False, **kwargs):
+        return self._projects
+
+    def list_all_instances(self, **kwargs):
+        return self._instances
+
+
+def build_listings(project_count, image_count, instance_count):
+    projects = [FakeProject(number) for number in xrange(project_count)]
+    images = [FakeImage(number) for number in xrange(image_count)]
+    glance_v1_images = [{'id': image.id, 'owner': projects[
+        number % project_count].id} for number, image in enumerate(images)]
+    instances = [FakeInstance(number, projects[number % project_count])
+                 for number in xrange(instance_count)]
+    machines = [FakeMachine(number) for number in xrange(image_count)]
+    return projects, images, glance_v1_images, instances, machines
+
+
+def build_helpers(project_count, image_count, instance_count):
+    projects, images, glance_v1_images, instances, machines = \
+        build_listings(project_count, image_count, instance_count)
+
+    def add_owner_to_machine():
+        BenchmarkAccountDriver(projects, instances).add_owner_to_machine(
+            images, glance_v1_images)
+
+    def tenant_instances_map():
+        BenchmarkAccountDriver(projects, instances).tenant_instances_map()
+
+    def build_snapshot():
+        snapshot = ProviderSnapshot(FakeProvider())
+        snapshot.machines = images
+        snapshot.instances = instances
+        snapshot.tenant_map = dict(
+            (project.id, project.name) for project in projects)
+        return snapshot
+
+    def snapshot_indexes():
+        snapshot = build_snapshot()
+        snapshot.images_by_id
+        snapshot.instances_by_tenant
+
+    def tenant_owner_map():
+        snapshot = build_snapshot()
+        _make_tenant_owner_map(
+            snapshot.instances_by_tenant, snapshot.tenant_map)
+
+    def end_date_missing_machines():
+        # Every machine is found in the cloud: nothing is end-dated
+        _end_date_missing_database_machines(
+            machines, build_snapshot().images_by_id, dry_run=True)
+
+    def image_owner_projects():
+        # The owner lookups of monitor_machines_for
+        accounts = BenchmarkAccountDriver(projects, instances)
+        for glance_v1_image in glance_v1_images:
+            accounts.projects_by_id().get(glance_v1_image['owner'])
+        for project in projects:
+            accounts.projects_by_name().get(project.name)
+
+    return [
+        ("snapshot_indexes", snapshot_indexes),
+        ("tenant_owner_map", tenant_owner_map),
+        ("end_date_missing_machines", end_date_missing_machines),
+        ("image_owner_projects", image_owner_projects),
+        ("add_owner_to_machine", add_owner_to_machine),
+        ("tenant_instances_map", tenant_instances_map),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=5000,
+                        help="Number of projects at the largest scale")
+    parser.add_argument("--images", type=int, default=20000,
+                        help="Number of images at the largest scale")
+    parser.add_argument("--instances", type=int, default=20000,
+                        help="Number of instances at the largest scale")
+    parser.add_argument("--steps", type=int, default=4,
+                        help="Number of (doubling) scales to measure")
+    args = parser.parse_args()
+    for step in reversed(range(args.steps)):
+        project_count = max(1, args.projects / 2 ** step)
+        image_count = max(1, args.images / 2 ** step)
+        instance_count = max(1, args.instances / 2 ** step)
+        print "%6d projects %6d images %6d instances:" % (
+            project_count, image_count, instance_count)
+        for name, helper in build_helpers(
+                project_count, image_count, instance_count):
+            seconds = min(timeit.repeat(helper, number=1, repeat=3))
+            print "    %-26s %.4fs" % (name, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Benchmark `_convert_tenant_id_to_names` + `_make_instance_owner_map` with
+synthetic tenants and instances, to check that the owner map scales
+linearly with the number of projects and instances.
+"""
+import argparse
+import timeit
+
+import django
+django.setup()
+
+from service.monitoring import _convert_tenant_id_to_names, _make_instance_owner_map
+
+
+class FakeTenant(object):
+    def __init__(self, number):
+        self.id = "%032x" % number
+        self.name = "user%s" % number
+
+
+class FakeInstance(object):
+    def __init__(self, owner):
+        self.owner = owner
+
+
+def build_owner_map(tenant_count, instance_count):
+    tenants = [FakeTenant(number) for number in xrange(tenant_count)]
+    owners = [tenants[number % tenant_count].id
+              for number in xrange(instance_count)]
+
+    def owner_map():
+        # Conversion is in-place: start from tenant ids every time.
+        instances = [FakeInstance(owner) for owner in owners]
+        _make_instance_owner_map(
+            _convert_tenant_id_to_names(instances, tenants))
+    return owner_map
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", type=int, default=5000,
+                        help="Number of projects at the largest scale")
+    parser.add_argument("--instances", type=int, default=10000,
+                        help="Number of instances at the largest scale")
+    parser.add_argument("--steps", type=int, default=4,
+                        help="Number of (doubling) scales to measure")
+    args = parser.parse_args()
+    for step in reversed(range(args.steps)):
+        tenant_count = max(1, args.tenants / 2 ** step)
+        instance_count = max(1, args.instances / 2 ** step)
+        seconds = min(timeit.repeat(
+            build_owner_map(tenant_count, instance_count),
+            number=1, repeat=3))
+        print "%6d projects %6d instances: %.4fs (%.2f us/instance)" % (
+            tenant_count, instance_count, seconds,
+            seconds * 10 ** 6 / instance_count)
+
+
+if __name__ == "__main__":
+    main()
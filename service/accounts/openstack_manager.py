@@ -73,9 +73,6 @@ def timeout_after(seconds):
 
 
 class AccountDriver(BaseAccountDriver):
-    user_manager = None
-    image_manager = None
-    network_manager = None
     core_provider = None
     cloud_config = {}
 
@@ -127,19 +124,18 @@ class AccountDriver(BaseAccountDriver):
         return export_data
 
     def add_owner_to_machine(self, cloud_machines, cloud_machines_dict):
+        glance_imgs_by_id = {}
+        for glance_img in cloud_machines_dict:
+            glance_imgs_by_id.setdefault(glance_img['id'], glance_img)
         for warlock_image in cloud_machines:
-            glance_img_match = [
-                glance_img for glance_img
-                in cloud_machines_dict
-                if glance_img['id'] == warlock_image.id
-            ]
-            if not glance_img_match:
+            glance_img = glance_imgs_by_id.get(warlock_image.id)
+            if glance_img is None:
                 logger.warn(
                     "Image list mismatch: %s exists in glance-v2 "
                     "and not in glance-v1.." % warlock_image.id
                 )
                 continue
-            warlock_image.owner = glance_img_match[0].get('owner', '')
+            warlock_image.owner = glance_img.get('owner', '')
 
     def clear_cache(self):
         self.admin_driver.provider.machineCls.invalidate_provider_cache(
@@ -155,11 +151,11 @@ class AccountDriver(BaseAccountDriver):
         provider_creds = provider.get_credentials()
         self.cloud_config = provider.cloud_config
         self.provider_creds = provider_creds
-        if not provider.admin:
-            raise Exception("Cannot create an account driver yet - A provider admin account has not been created")
         admin_identity = provider.admin
+        if not admin_identity:
+            raise Exception("Cannot create an account driver yet - A provider admin account has not been created")
         admin_creds = admin_identity.get_credentials()
-        self.admin_driver = get_esh_driver(admin_identity)
+        self._builders['admin_driver'] = lambda: get_esh_driver(admin_identity)
         admin_creds = self._libcloud_to_openstack(admin_creds)
         all_creds = {'location': provider.get_location()}
         all_creds.update(admin_creds)
@@ -168,6 +164,11 @@ class AccountDriver(BaseAccountDriver):
 
     def __init__(self, provider, *args, **kwargs):
         super(AccountDriver, self).__init__()
+        # Managers are built (and authenticated) on first use
+        self._builders = {}
+        self._managers = {}
+        self._project_lists = {}
+        self._indexed_projects = None
 
         all_creds = self._init_by_provider(provider, *args, **kwargs)
 
@@ -202,11 +203,43 @@ class AccountDriver(BaseAccountDriver):
         # Initialize logging
         self._initialize_loggers()
         # Initialize managers with respective credentials
-        self.user_manager = UserManager(**user_creds)
-        self.user_manager.keystone.username = user_creds.get('username')
-        self.image_manager = ImageManager(**image_creds)
-        self.network_manager = NetworkManager(**net_creds)
-        self.openstack_sdk = _connect_to_openstack_sdk(**sdk_creds)
+        def build_user_manager():
+            user_manager = UserManager(**user_creds)
+            user_manager.keystone.username = user_creds.get('username')
+            return user_manager
+        self._builders.update({
+            'user_manager': build_user_manager,
+            'image_manager': lambda: ImageManager(**image_creds),
+            'network_manager': lambda: NetworkManager(**net_creds),
+            'openstack_sdk': lambda: _connect_to_openstack_sdk(**sdk_creds),
+        })
+
+    def _get_manager(self, name):
+        """
+        Build the manager `name` on first use. Managers older than
+        DRIVER_REGISTRY_MAX_AGE are rebuilt, to refresh their keystone
+        token before it expires.
+        """
+        max_age = getattr(settings, 'DRIVER_REGISTRY_MAX_AGE', 3000)
+        manager, created = self._managers.get(name, (None, 0))
+        if manager is None or time.time() - created > max_age:
+            manager = self._builders[name]()
+            self._managers[name] = (manager, time.time())
+        return manager
+
+    def refresh_managers(self):
+        """
+        Forget the managers built so far (ex: after KeystoneUnauthorized),
+        they are re-authenticated on next use.
+        """
+        self._managers = {}
+
+    user_manager = property(lambda self: self._get_manager('user_manager'))
+    image_manager = property(lambda self: self._get_manager('image_manager'))
+    network_manager = property(
+        lambda self: self._get_manager('network_manager'))
+    openstack_sdk = property(lambda self: self._get_manager('openstack_sdk'))
+    admin_driver = property(lambda self: self._get_manager('admin_driver'))
 
     def _initialize_loggers(self):
         from keystoneauth1 import _utils
@@ -301,6 +334,7 @@ class AccountDriver(BaseAccountDriver):
                     if self.identity_version > 2:
                         project_kwargs = {'domain': domain_name}
                     project = self.user_manager.create_project(project_name, **project_kwargs)
+                    self._projects_changed()
                 # 2. Create User (And add them to the project)
                 user = self.get_user(username)
                 if not user:
@@ -512,7 +546,7 @@ class AccountDriver(BaseAccountDriver):
         return keypair
 
     def get_image_members(self, image_id, status="approved"):
-        all_projects = {p.id: p for p in self.list_projects()}
+        all_projects = self.projects_by_id()
         shared_with = self.image_manager.glance.image_members.list(image_id)
         projects = []
         try:
@@ -787,6 +821,7 @@ class AccountDriver(BaseAccountDriver):
             self.delete_all_roles(adminuser, projectname)
             # 3. Project cleanup
             self.user_manager.delete_project(projectname)
+            self._projects_changed()
         # 4. User cleanup
         user = self.user_manager.get_user(username)
         if user:
@@ -865,21 +900,23 @@ class AccountDriver(BaseAccountDriver):
         * match_all (bool) - If True, instances must match ALL words in the list.
         * include_empty (bool) - If True, include ALL tenants in the map.
         """
-        all_projects = self.list_projects()
+        all_projects = self.projects_by_id()
         all_instances = self.list_all_instances()
         if include_empty:
-            project_map = {proj: [] for proj in all_projects}
+            project_map = {proj: [] for proj in all_projects.values()}
         else:
             project_map = {}
         for instance in all_instances:
             try:
                 # NOTE: will someday be 'projectId'
                 tenant_id = instance.extra['tenantId']
-
-                project = [p for p in all_projects if p.id == tenant_id][0]
             except (ValueError, KeyError):
                 raise Exception(
                     "The implementaion for recovering a tenant id has changed. Update the code base above this line!")
+            project = all_projects.get(tenant_id)
+            if not project:
+                raise Exception("Project %s of instance %s was not found"
+                                % (tenant_id, instance.id))
 
             metadata = instance._node.extra.get('metadata', {})
             instance_status = instance.extra.get('status')
@@ -935,9 +972,8 @@ class AccountDriver(BaseAccountDriver):
         return self.user_manager.get_project(project_name, **kwargs)
 
     def _make_tenant_id_map(self):
-        all_projects = self.list_projects()
-        tenant_id_map = {project.id: project.name for project in all_projects}
-        return tenant_id_map
+        return {project_id: project.name
+                for project_id, project in self.projects_by_id().items()}
 
     def create_trust(
             self,
@@ -993,21 +1029,55 @@ class AccountDriver(BaseAccountDriver):
 
     def clear_local_cache(self):
         logger.info("Clearing the cached project-list")
-        self.project_list = []
+        self._project_lists = {}
+
+    def _projects_changed(self):
+        """
+        Drop the cached project lists (this driver's and the provider's
+        tenant map shared by the monitoring tasks)
+        """
+        from service.cache import invalidate_cached_tenant_map
+        self.clear_local_cache()
+        invalidate_cached_tenant_map(self.core_provider)
 
     def list_projects(self, force=False, **kwargs):
         """
-        Cached to save time on repeat queries.. Otherwise its a pass-through to user_manager
+        Cached (for ACCOUNT_PROJECT_LIST_TTL seconds) to save time on repeat queries..
+        Otherwise its a pass-through to user_manager
         """
         if self.identity_version > 2:
             kwargs = self._parse_domain_kwargs(kwargs, domain_override='domain')
-        if not getattr(self, 'project_list', None) or force:
+        cache_key = repr(sorted(kwargs.items()))
+        project_list, cached_at = self._project_lists.get(cache_key, (None, 0))
+        ttl = getattr(settings, 'ACCOUNT_PROJECT_LIST_TTL', 300)
+        if project_list is None or force or time.time() - cached_at > ttl:
             logger.info("Caching a copy of project list")
-            self.project_list = self.user_manager.list_projects(**kwargs)
-            return self.project_list
+            project_list = self.user_manager.list_projects(**kwargs)
+            self._project_lists[cache_key] = (project_list, time.time())
+            return project_list
 
         logger.info("Returning cached copy of project list")
-        return self.project_list
+        return project_list
+
+    def _project_indexes(self):
+        """
+        The (cached) project list indexed by id and by name, rebuilt only
+        when the list is refreshed
+        """
+        all_projects = self.list_projects()
+        cached = self._indexed_projects
+        if not cached or cached[0] is not all_projects:
+            cached = (all_projects,
+                      {project.id: project for project in all_projects},
+                      {project.name: project for project in all_projects})
+            self._indexed_projects = cached
+        return cached[1:]
+
+    def projects_by_id(self):
+        return self._project_indexes()[0]
+
+    def projects_by_name(self):
+        return self._project_indexes()[1]
 
     def list_roles(self, **kwargs):
         """
@@ -1,16 +1,36 @@
+import csv
 import datetime
+import json
+import zlib
+from StringIO import StringIO
 
 import pytz
 from dateutil.parser import parse
 from django.db.models.query import Q
 from threepio import logger
 
+from allocation.intervals import HistoryIntervalIndex
 from core.models import EventTable
 from core.models.allocation_source import AllocationSource
 from core.models.instance import Instance
+from core.models.instance_history import InstanceStatusHistory
+
+# Number of instance ids sent to the database in a single `__in` lookup
+EVENT_LOOKUP_BATCH_SIZE = 1000
 
 
 def create_report(report_start_date, report_end_date, user_id=None, allocation_source_name=None):
+    return list(iter_report(report_start_date, report_end_date, user_id=user_id,
+                            allocation_source_name=allocation_source_name))
+
+
+def iter_report(report_start_date, report_end_date, user_id=None, allocation_source_name=None):
+    """
+    Iterator version of `create_report`: rows are produced as they are
+    consumed, so memory use does not grow with the size of the report.
+    The dates and the user are checked (and the events and instances
+    filtered) right away.
+    """
     if not report_start_date or not report_end_date:
         raise Exception("Start date and end date missing for allocation calculation function")
     try:
@@ -18,28 +38,28 @@ def create_report(report_start_date, report_end_date, user_id=None, allocation_s
         report_end_date = report_end_date if isinstance(report_end_date, datetime.datetime) else parse(report_end_date)
     except:
         raise Exception("Cannot parse start and end dates for allocation calculation function")
-    data = generate_data(report_start_date, report_end_date, username=user_id)
+    rows = iter_data(report_start_date, report_end_date, username=user_id)
     if allocation_source_name:
-        output = []
-        for row in data:
-            if row['allocation_source'] == allocation_source_name:
-                output.append(row)
-        return output
+        rows = (row for row in rows if row['allocation_source'] == allocation_source_name)
+    return rows
 
-    return data
 
 def generate_data(report_start_date, report_end_date, username=None):
+    return list(iter_data(report_start_date, report_end_date, username=username))
+
+
+def iter_data(report_start_date, report_end_date, username=None):
     # filter events and instancs)
     filtered_items = filter_events_and_instances(report_start_date, report_end_date, username=username)
     # create instance to event mappings
     event_instance_dict = group_events_by_instances(filtered_items['events'])
-    # get all instance status histories for the event
-    filtered_instance_histories = get_all_histories_for_instance(filtered_items['instances'], report_start_date, report_end_date)
-    # map events to instance status histories ids
-    events_histories_dict = map_events_to_histories(filtered_instance_histories, event_instance_dict)
+    # get instance status histories, a batch of instances at a time,
+    # and map events to instance status histories ids
+    history_batches = (
+        (histories, map_events_to_histories(histories, event_instance_dict))
+        for histories in iter_history_batches(filtered_items['instances'], report_start_date, report_end_date))
     # create rows of data
-    data = create_rows(filtered_instance_histories, events_histories_dict, report_start_date, report_end_date)
-    return data
+    return iter_rows(history_batches, report_start_date, report_end_date)
 
 
 def filter_events_and_instances(report_start_date, report_end_date, username=None):
@@ -59,10 +79,11 @@ def filter_events_and_instances(report_start_date, report_end_date, username=Non
         from core.models.user import AtmosphereUser
         try:
             user_id_int = AtmosphereUser.objects.get(username=username)
-        except:
-            raise Exception("User '%s' does not exist"%(username))
+        except AtmosphereUser.DoesNotExist:
+            raise AtmosphereUser.DoesNotExist("User '%s' does not exist"%(username))
         events = events.filter(Q(payload__username__exact=username) | Q(entity_id=username)).order_by('timestamp')
         instances = instances.filter(Q(created_by__exact=user_id_int))
+    instances = instances.select_related('created_by')
     instance_ids = instances.values_list("id", flat=True)
     logger.info("Checking instance IDs %s for User %s" % (instance_ids, username))
     return {'events': events, 'instances': instances}
@@ -77,15 +98,47 @@ def group_events_by_instances(events):
     return out_dic
 
 
+def _histories_in_window(instances, report_start_date, report_end_date):
+    return InstanceStatusHistory.objects.filter(
+        ~Q(start_date__gte=report_end_date) &
+        ~Q(
+            Q(end_date__isnull=False) & Q(end_date__lte=report_start_date)
+        ),
+        instance__in=instances
+    ).select_related(
+        'instance', 'instance__created_by', 'size', 'status',
+        'instance__source__providermachine__application_version__application'
+    ).order_by('instance__id', 'start_date')
+
+
+def iter_history_batches(instances, report_start_date, report_end_date, batch_size=EVENT_LOOKUP_BATCH_SIZE):
+    """
+    Stream histories from the database and yield them as dicts of
+    provider_alias -> [InstanceStatusHistory, ...] holding at most
+    `batch_size` instances each.
+    """
+    batch = {}
+    histories = _histories_in_window(instances, report_start_date, report_end_date)
+    for history in histories.iterator():
+        instance_id = history.instance.provider_alias
+        if instance_id not in batch and len(batch) >= batch_size:
+            yield batch
+            batch = {}
+        batch.setdefault(instance_id, []).append(history)
+    if batch:
+        yield batch
+
+
 def get_all_histories_for_instance(instances, report_start_date, report_end_date):
-    histories = {}
-    for instance in instances:
-        histories[instance.provider_alias] = instance.instancestatushistory_set.filter(
-                ~Q(start_date__gte=report_end_date) & 
-                ~Q(
-                    Q(end_date__isnull=False) & Q(end_date__lte=report_start_date)
-                  )
-            ).order_by('start_date')
+    """
+    Return a dict of provider_alias -> [InstanceStatusHistory, ...]
+    ordered by start_date, fetched in a single query with everything
+    `create_rows` and `fill_data` need already joined in.
+    Instances without histories in the window map to an empty list.
+    """
+    histories = dict((instance.provider_alias, []) for instance in instances)
+    for history in _histories_in_window(instances, report_start_date, report_end_date):
+        histories[history.instance.provider_alias].append(history)
 
     return histories
 
@@ -93,12 +146,11 @@ def get_all_histories_for_instance(instances, report_start_date, report_end_date
 def map_events_to_histories(filtered_instance_histories, event_instance_dict):
     out_dic = {}
     for instance, events in event_instance_dict.iteritems():
-        hist_list = filtered_instance_histories.get(instance,[])
+        history_index = HistoryIntervalIndex(filtered_instance_histories.get(instance,[]))
         for info in events:
-            ts = info.timestamp
-            inst_history = [i.id for i in hist_list if i.start_date <= ts and ((not i.end_date) or (i.end_date and i.end_date >= ts))]
+            inst_history = history_index.find(info.timestamp)
             if inst_history:
-                out_dic.setdefault(inst_history[-1], []).append(info)
+                out_dic.setdefault(inst_history.id, []).append(info)
     return out_dic
 
 def get_allocation_source_name_from_event(username, report_start_date, instance_id, instance_history_start_date):
@@ -119,8 +171,77 @@ def get_allocation_source_name_from_event(username, report_start_date, instance_
         return allocation_source_object.name
 
 
+def get_initial_allocation_source_names(filtered_instance_histories, report_start_date):
+    """
+    Bulk version of `get_allocation_source_name_from_event`:
+    For each instance, find the allocation source set by the last
+    'instance_allocation_source_changed' event (by the instance owner)
+    before max(report_start_date, first history start_date).
+    Returns a dict of provider_alias -> allocation source name (or False)
+    """
+    cutoffs = {}
+    owners = {}
+    for instance_id, histories in filtered_instance_histories.iteritems():
+        if not histories:
+            continue
+        first_history = histories[0]
+        cutoffs[instance_id] = max(report_start_date, first_history.start_date)
+        owners[instance_id] = first_history.instance.created_by.username
+    if not cutoffs:
+        return {}
+
+    last_events = {}
+    instance_ids = cutoffs.keys()
+    latest_cutoff = max(cutoffs.values())
+    for idx in xrange(0, len(instance_ids), EVENT_LOOKUP_BATCH_SIZE):
+        batch = instance_ids[idx:idx + EVENT_LOOKUP_BATCH_SIZE]
+        events = EventTable.objects.filter(
+            name__exact="instance_allocation_source_changed",
+            timestamp__lt=latest_cutoff,
+            payload__instance_id__in=batch).order_by('timestamp')
+        for event in events:
+            instance_id = event.payload['instance_id']
+            username = owners[instance_id]
+            if event.timestamp >= cutoffs[instance_id]:
+                continue
+            if event.payload.get('username') != username \
+                    and event.entity_id != username:
+                continue
+            last_events[instance_id] = event
+
+    source_names = set()
+    source_names_by_uuid = {}
+    for source_name, source_uuid in AllocationSource.objects.values_list('name', 'uuid'):
+        source_names.add(source_name)
+        source_names_by_uuid[str(source_uuid)] = source_name
+
+    allocation_source_names = {}
+    for instance_id in instance_ids:
+        event = last_events.get(instance_id)
+        if not event:
+            allocation_source_names[instance_id] = False
+            continue
+        try:
+            source_name = event.payload['allocation_source_name']
+        except KeyError:
+            source_name = source_names_by_uuid.get(
+                str(event.payload['allocation_source_id']))
+        if source_name not in source_names:
+            raise AllocationSource.DoesNotExist(
+                "Allocation Source %s does not exist" % source_name)
+        allocation_source_names[instance_id] = source_name
+    return allocation_source_names
+
+
 def create_rows(filtered_instance_histories, events_histories_dict, report_start_date, report_end_date):
-    data = []
+    return list(iter_rows([(filtered_instance_histories, events_histories_dict)], report_start_date, report_end_date))
+
+
+def iter_rows(history_batches, report_start_date, report_end_date):
+    """
+    Yield report rows for each (filtered_instance_histories, events_histories_dict)
+    pair in `history_batches`.
+    """
     current_user = ''
     allocation_source_name = ''
     current_instance_id = ''
@@ -128,58 +249,59 @@ def create_rows(filtered_instance_histories, events_histories_dict, report_start
 
     still_running = _get_current_date_utc()
     total_burn_rate = 0
-    for instance, histories in filtered_instance_histories.iteritems():
-        for hist in histories:
-            if current_user != hist.instance.created_by.username:
-                if current_user:
-                    burn_rate_per_user[current_user] = burn_rate_per_user.get(current_user, 0) + total_burn_rate
-                current_user = hist.instance.created_by.username
-
-            if current_instance_id != hist.instance.id:
-                current_as_name = get_allocation_source_name_from_event(current_user,report_start_date,hist.instance.provider_alias,hist.start_date)
-                allocation_source_name = current_as_name if current_as_name else 'N/A' 
-                current_instance_id = hist.instance.id
+    for filtered_instance_histories, events_histories_dict in history_batches:
+        initial_allocation_sources = get_initial_allocation_source_names(
+            filtered_instance_histories, report_start_date)
+        for instance, histories in filtered_instance_histories.iteritems():
+            for hist in histories:
+                if current_user != hist.instance.created_by.username:
+                    if current_user:
+                        burn_rate_per_user[current_user] = burn_rate_per_user.get(current_user, 0) + total_burn_rate
+                    current_user = hist.instance.created_by.username
+
+                if current_instance_id != hist.instance.id:
+                    current_as_name = initial_allocation_sources.get(hist.instance.provider_alias)
+                    allocation_source_name = current_as_name if current_as_name else 'N/A' 
+                    current_instance_id = hist.instance.id
             
-            empty_row = {'username': '', 'instance_id': '', 'allocation_source': '', 'provider_alias': '', 'instance_status_history_id': '', 'cpu': '', 'memory': '',
-                         'disk': '', 'instance_status_start_date': '', 'instance_status_end_date': '', 'report_start_date': report_start_date, 'report_end_date': report_end_date,
-                         'instance_status': '', 'duration': '', 'applicable_duration': '', 'burn_rate': ''}
-            filled_row = fill_data(empty_row, hist, allocation_source_name)
-            # check if instance is active and has no end date. If so, increment total burn rate
-            if hist.status.name == 'active' and not hist.end_date:
-                total_burn_rate += 1
-            filled_row['burn_rate'] = total_burn_rate
-            if hist.id in events_histories_dict:
-                events = events_histories_dict[hist.id]
-                start_date = hist.start_date
-                for event in events:
-                    end_date = event.timestamp
-                    # fill out stuff
+                empty_row = {'username': '', 'instance_id': '', 'allocation_source': '', 'provider_alias': '', 'instance_status_history_id': '', 'cpu': '', 'memory': '',
+                             'disk': '', 'instance_status_start_date': '', 'instance_status_end_date': '', 'report_start_date': report_start_date, 'report_end_date': report_end_date,
+                             'instance_status': '', 'duration': '', 'applicable_duration': '', 'burn_rate': ''}
+                filled_row = fill_data(empty_row, hist, allocation_source_name)
+                # check if instance is active and has no end date. If so, increment total burn rate
+                if hist.status.name == 'active' and not hist.end_date:
+                    total_burn_rate += 1
+                filled_row['burn_rate'] = total_burn_rate
+                if hist.id in events_histories_dict:
+                    events = events_histories_dict[hist.id]
+                    start_date = hist.start_date
+                    for event in events:
+                        end_date = event.timestamp
+                        # fill out stuff
+                        filled_row_temp = filled_row.copy()
+                        filled_row_temp['instance_status_start_date'] = start_date
+                        filled_row_temp['instance_status_end_date'] = end_date
+                        filled_row_temp['allocation_source'] = allocation_source_name 
+                        try:
+                            new_allocation_source = event.payload['allocation_source_name']
+                        except:
+                            new_allocation_source = 'N/A'
+                        allocation_source_name = new_allocation_source
+                        filled_row_temp['applicable_duration'] = calculate_allocation(hist, start_date, end_date, report_start_date, report_end_date)
+                        yield filled_row_temp
+                        filled_row_temp = ''
+                        start_date = event.timestamp
+                    end_date = still_running if not hist.end_date else hist.end_date
                     filled_row_temp = filled_row.copy()
                     filled_row_temp['instance_status_start_date'] = start_date
                     filled_row_temp['instance_status_end_date'] = end_date
-                    filled_row_temp['allocation_source'] = allocation_source_name 
-                    try:
-                        new_allocation_source = event.payload['allocation_source_name']
-                    except:
-                        new_allocation_source = 'N/A'
-                    allocation_source_name = new_allocation_source
+                    filled_row_temp['allocation_source'] = allocation_source_name
                     filled_row_temp['applicable_duration'] = calculate_allocation(hist, start_date, end_date, report_start_date, report_end_date)
-                    data.append(filled_row_temp)
-                    filled_row_temp = ''
-                    start_date = event.timestamp
-                end_date = still_running if not hist.end_date else hist.end_date
-                filled_row_temp = filled_row.copy()
-                filled_row_temp['instance_status_start_date'] = start_date
-                filled_row_temp['instance_status_end_date'] = end_date
-                filled_row_temp['allocation_source'] = allocation_source_name
-                filled_row_temp['applicable_duration'] = calculate_allocation(hist, start_date, end_date, report_start_date, report_end_date)
-                data.append(filled_row_temp)
-            else:
-                end_date = still_running if not hist.end_date else hist.end_date
-                filled_row['applicable_duration'] = calculate_allocation(hist, hist.start_date, end_date, report_start_date, report_end_date)
-                data.append(filled_row)
-
-    return data
+                    yield filled_row_temp
+                else:
+                    end_date = still_running if not hist.end_date else hist.end_date
+                    filled_row['applicable_duration'] = calculate_allocation(hist, hist.start_date, end_date, report_start_date, report_end_date)
+                    yield filled_row
 
 
 def calculate_allocation(hist, start_date, end_date, report_start_date, report_end_date):
@@ -202,7 +324,7 @@ def fill_data(row, history_obj, allocation_source):
     row['username'] = history_obj.instance.created_by.username
     row['allocation_source'] = allocation_source
     row['instance_id'] = history_obj.instance_id
-    row['image_name'] = Instance.objects.get(id=history_obj.instance_id).application_name()
+    row['image_name'] = history_obj.instance.application_name()
     row['provider_alias'] = history_obj.instance.provider_alias
     row['instance_status_history_id'] = history_obj.id
     row['cpu'] = history_obj.size.cpu
@@ -216,23 +338,86 @@ def fill_data(row, history_obj, allocation_source):
     return row
 
 
-def write_csv(data):
-
-    with open('/opt/dev/reports/new_report.csv', 'w+') as csv:
-        csv.write("Username,Instance_ID,Allocation Source,Provider Alias,Instance_Status_History_ID,CPU,Memory,Disk,Instance_Status_Start_Date,Instance_Status_End_Date,Report_Start_Date,Report_End_Date,Instance_Status,Duration (hours),Applicable_Duration (hours)\n")
+REPORT_CSV_COLUMNS = [
+    ('Username', 'username'),
+    ('Instance_ID', 'instance_id'),
+    ('Allocation Source', 'allocation_source'),
+    ('Provider Alias', 'provider_alias'),
+    ('Instance_Status_History_ID', 'instance_status_history_id'),
+    ('CPU', 'cpu'),
+    ('Memory', 'memory'),
+    ('Disk', 'disk'),
+    ('Instance_Status_Start_Date', 'instance_status_start_date'),
+    ('Instance_Status_End_Date', 'instance_status_end_date'),
+    ('Report_Start_Date', 'report_start_date'),
+    ('Report_End_Date', 'report_end_date'),
+    ('Instance_Status', 'instance_status'),
+    ('Duration (hours)', 'duration'),
+    ('Applicable_Duration (hours)', 'applicable_duration'),
+]
+REPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _csv_line(values):
+    encoded = [
+        value.encode('utf-8') if isinstance(value, unicode) else value
+        for value in values]
+    line = StringIO()
+    csv.writer(line, lineterminator='\n').writerow(encoded)
+    return line.getvalue()
+
+
+def iter_report_csv(rows):
+    yield _csv_line([header for header, _ in REPORT_CSV_COLUMNS])
+    for row in rows:
+        yield _csv_line([row[key] for _, key in REPORT_CSV_COLUMNS])
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return unicode(value)
+
+
+def iter_report_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row, default=_json_value) + '\n'
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_report(rows, file_format='csv', compress=False):
+    """
+    Turn an iterable of report rows (see `iter_report`) into an iterator
+    of serialized chunks, one row at a time.
+    """
+    if file_format == 'csv':
+        chunks = iter_report_csv(rows)
+    elif file_format == 'ndjson':
+        chunks = iter_report_ndjson(rows)
+    else:
+        raise ValueError("Unknown report format %s. Expected one of: %s"
+                         % (file_format, REPORT_FORMATS.keys()))
+    if compress:
+        chunks = iter_gzip(chunks)
+    return chunks
 
-        for row in data:
 
-            csv.write("%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n" % (
-                row['username'], row['instance_id'], row['allocation_source'],
-                row['provider_alias'], row['instance_status_history_id'],
-                row['cpu'], row['memory'], row['disk'],
-                row['instance_status_start_date'],
-                row['instance_status_end_date'],
-                row['report_start_date'],
-                row['report_end_date'],
-                row['instance_status'],
-                row['duration'], row['applicable_duration']))
+def write_csv(data, report_path='/opt/dev/reports/new_report.csv'):
+    with open(report_path, 'w+') as report_file:
+        for chunk in iter_report_csv(data):
+            report_file.write(chunk)
 
 
 def get_instance_burn_rate_from_row(row):
@@ -1,4 +1,8 @@
 import cPickle as pickle
+import time
+import uuid
+import zlib
+
 from django.conf import settings
 from django.utils import timezone
 
@@ -6,11 +10,9 @@ import redis
 
 from threepio import logger
 
-from service.driver import get_esh_driver, get_admin_driver
+from service.driver import driver_registry, get_esh_driver, get_admin_driver
 
 
-admin_drivers = {}
-drivers = {}
 connection = None
 
 INSTANCES_KEY_PROVIDER = "instances.{0}"
@@ -19,20 +21,40 @@ VOLUMES_KEY_PROVIDER = "volumes.{0}"
 VOLUMES_KEY_IDENTITY = "volumes.{0}.{1}"
 MACHINES_KEY_PROVIDER = "machines.{0}"
 MACHINES_KEY_IDENTITY = "machines.{0}.{1}"
+TENANTS_KEY_PROVIDER = "tenants.{0}"
+LOCK_KEY = "{0}.lock"
+STATS_KEY = "service.cache.stats"
+# Delete the lock only if it still holds our token (it may have expired
+# and been taken by somebody else)
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _get_cached_driver(provider=None, identity=None, force=False):
+    """
+    Drivers are shared through service.driver.driver_registry, which
+    rebuilds them on credential changes and before their token expires.
+    `force` builds a new one.
+    """
+    if force:
+        invalidate_cached_driver(provider=provider, identity=identity)
+    if provider:
+        return get_admin_driver(provider)
+    return get_esh_driver(identity)
 
 
-def _get_cached_admin_driver(provider, force=True):
-    if not admin_drivers.get(provider) or force:
-        admin_drivers[provider] = get_admin_driver(provider)
-    return admin_drivers[provider]
-
-
-def _get_cached_driver(provider=None, identity=None, force=True):
+def invalidate_cached_driver(provider=None, identity=None):
     if provider:
-        return _get_cached_admin_driver(provider, force)
-    if not drivers.get(identity) or force:
-        drivers[identity] = get_esh_driver(identity)
-    return drivers[identity]
+        account = provider.accountprovider_set.all().first()
+        if not account:
+            return
+        identity = account.identity
+    driver_registry.invalidate(
+        'esh', (identity.id, identity.created_by.username))
 
 
 def redis_connection():
@@ -48,26 +70,166 @@ def _invalidate(key):
         r.delete(key)
 
 
+def _resource_type(key):
+    # "instances.1" -> "instances"
+    return key.split(".", 1)[0]
+
+
+def _cache_ttl(resource_type):
+    """
+    Returns (ttl, stale_ttl) in seconds for the resource type.
+    Values are `ttl` seconds 'fresh', then served for another `stale_ttl`
+    seconds while a single worker refreshes them.
+    """
+    ttls = getattr(settings, 'CLOUD_CACHE_TTL', {})
+    ttl = ttls.get(resource_type, ttls.get('default', 30))
+    stale_ttl = getattr(settings, 'CLOUD_CACHE_STALE_TTL', 60)
+    return ttl, stale_ttl
+
+
+def _count(r, key, outcome):
+    try:
+        r.hincrby(STATS_KEY, "%s.%s" % (_resource_type(key), outcome), 1)
+    except redis.exceptions.RedisError:
+        pass
+
+
+def cache_stats():
+    """
+    Returns the hit/miss counters of the cloud cache, as a dict of
+    '<resource type>.<hit|stale|miss|wait|timeout>' -> count
+    """
+    stats = redis_connection().hgetall(STATS_KEY)
+    return dict((name, int(count)) for name, count in stats.items())
+
+
+def _dumps(data):
+    """
+    The scrubbed resources (no connections, nodes or images) are pickled:
+    callers use them as rtwo objects (their methods and nested size and
+    machine objects), which a dict of selected fields would not keep.
+    """
+    return zlib.compress(
+        pickle.dumps((time.time(), data), pickle.HIGHEST_PROTOCOL))
+
+
+def _loads(value):
+    return pickle.loads(zlib.decompress(value))
+
+
+def _acquire_lock(r, key, timeout):
+    token = uuid.uuid4().hex
+    if r.set(LOCK_KEY.format(key), token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def _release_lock(r, key, token):
+    r.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_KEY.format(key), token)
+
+
+def _store(r, key, data):
+    ttl, stale_ttl = _cache_ttl(_resource_type(key))
+    r.set(key, _dumps(data), ex=ttl + stale_ttl)
+
+
+def _fetch(data_method, scrub_method):
+    data = data_method()
+    scrub_method(data)
+    return data
+
+
+def _refresh(r, key, data_method, scrub_method):
+    data = _fetch(data_method, scrub_method)
+    try:
+        _store(r, key, data)
+    except redis.exceptions.RedisError:
+        logger.exception("Could not store redis({0})".format(key))
+        return data
+    logger.debug("Updated redis({0}) using {1} and {2}".format(
+        key, data_method, scrub_method))
+    return data
+
+
+def _unlock(r, key, token):
+    # The data is fetched already: do not fail (and fetch it again) here
+    try:
+        _release_lock(r, key, token)
+    except redis.exceptions.RedisError:
+        logger.exception("Could not unlock redis({0})".format(key))
+
+
 def _get_cached(key, data_method, scrub_method, force=False):
+    """
+    Return the (scrubbed) result of `data_method`, cached in redis at `key`.
+    * Fresh values are returned as-is.
+    * Stale values are returned to the other callers while ONE caller
+      (holding the lock) refreshes them.
+    * On a miss, ONE caller calls `data_method`; the others wait up to
+      CLOUD_CACHE_LOCK_TIMEOUT seconds for its result.
+    * When redis fails, `data_method` is called directly.
+    """
     try:
         r = redis_connection()
         if force:
             _invalidate(key)
-        data = r.get(key)
+        value = r.get(key)
+        return _get_or_refresh(r, key, value, data_method, scrub_method)
     except redis.exceptions.ConnectionError:
         logger.error("EXTERNAL SERVICE redis-server IS NOT RUNNING! "
                      "Somebody should turn it on!")
-        data = None
-    if not data:
-        data = data_method()
-        scrub_method(data)
-        logger.debug("Updated redis({0}) using {1} and {2}".format(
-            key, data_method, scrub_method))
-        r.set(key, pickle.dumps(data))
-        r.expire(key, 30)
-        return data
-    logger.debug("Actual type {0}".format(type(data)))
-    return pickle.loads(data)
+    except redis.exceptions.RedisError:
+        logger.exception("Could not use redis({0}), fetching it directly"
+                         .format(key))
+    return _fetch(data_method, scrub_method)
+
+
+def _get_or_refresh(r, key, value, data_method, scrub_method):
+    lock_timeout = getattr(settings, 'CLOUD_CACHE_LOCK_TIMEOUT', 30)
+    if value:
+        stored_at, data = _loads(value)
+        ttl, _ = _cache_ttl(_resource_type(key))
+        if time.time() - stored_at < ttl:
+            _count(r, key, "hit")
+            return data
+        _count(r, key, "stale")
+        token = _acquire_lock(r, key, lock_timeout)
+        if not token:
+            # Somebody else is refreshing it
+            return data
+        # Refresh on this thread: `data_method` is bound to a shared
+        # driver, which must not be used from two threads at once
+        try:
+            return _refresh(r, key, data_method, scrub_method)
+        except Exception:
+            logger.exception("Could not refresh redis({0}), serving the "
+                             "stale value".format(key))
+            return data
+        finally:
+            _unlock(r, key, token)
+
+    token = _acquire_lock(r, key, lock_timeout)
+    if token:
+        _count(r, key, "miss")
+        try:
+            return _refresh(r, key, data_method, scrub_method)
+        finally:
+            _unlock(r, key, token)
+
+    # Wait for the lock holder to fill the cache.
+    _count(r, key, "wait")
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(0.1)
+        value = r.get(key)
+        if value:
+            return _loads(value)[1]
+        if not r.exists(LOCK_KEY.format(key)):
+            break
+    _count(r, key, "timeout")
+    logger.warn("Timed out waiting on redis({0}), fetching it directly"
+                .format(key))
+    return _refresh(r, key, data_method, scrub_method)
 
 
 def _scrub(objects):
@@ -86,17 +248,22 @@ def _validate_parameters(provider, identity):
         raise Exception("Use either provider or identity but not both.")
 
 
-def get_cached_driver(provider=None, identity=None, force=True):
+def get_cached_driver(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
     return _get_cached_driver(provider=provider,
                               identity=identity,
                               force=force)
 
 
-def get_cached_instances(provider=None, identity=None, force=False):
+def get_cached_instances(provider=None, identity=None, force=False,
+                         driver=None):
+    """
+    `driver` lists the instances instead of the shared driver of the
+    provider/identity (ex: a private driver, from another thread).
+    """
     _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
+    cached_driver = driver or _get_cached_driver(
+        provider=provider, identity=identity)
     cached_driver.list_sizes()
     #NOTE: THIS IS A HACK -- The 'admin' user should be able to see "All the things" -- HOWEVER
     # In the current implementation of liberty on jetstream, a call to 'list_all_tenants'
@@ -129,8 +296,7 @@ def invalidate_cached_instances(provider=None, identity=None):
 
 def get_cached_volumes(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
+    cached_driver = _get_cached_driver(provider=provider, identity=identity)
     volumes_method = cached_driver.list_all_volumes
     if provider:
         key = VOLUMES_KEY_PROVIDER.format(provider.id)
@@ -154,8 +320,7 @@ def invalidate_cached_volumes(provider=None, identity=None):
 
 def get_cached_machines(provider=None, identity=None, force=False):
     _validate_parameters(provider, identity)
-    cached_driver = _get_cached_driver(provider=provider, identity=identity,
-                                       force=force)
+    cached_driver = _get_cached_driver(provider=provider, identity=identity)
     machines_method = cached_driver.list_machines
     if provider:
         key = MACHINES_KEY_PROVIDER.format(provider.id)
@@ -175,3 +340,32 @@ def invalidate_cached_machines(provider=None, identity=None):
         key = MACHINES_KEY_IDENTITY.format(identity.created_by.username,
                                            identity.id)
     _invalidate(key)
+
+
+def get_cached_tenant_map(provider, account_driver=None, force=False):
+    """
+    Returns a dict of tenant id -> tenant name for the provider, shared
+    (through redis) by every monitoring task of the provider.
+    `force` also refreshes the account driver's project list.
+    """
+    def list_tenants():
+        from service.monitoring import tenant_id_name_map
+        accounts = account_driver
+        if not accounts:
+            from service.driver import get_account_driver
+            accounts = get_account_driver(provider, raise_exception=True)
+        return tenant_id_name_map(accounts.list_projects(force=force))
+    return _get_cached(TENANTS_KEY_PROVIDER.format(provider.id),
+                       list_tenants,
+                       lambda tenant_map: None,
+                       force=force)
+
+
+def invalidate_cached_tenant_map(provider):
+    try:
+        _invalidate(TENANTS_KEY_PROVIDER.format(provider.id))
+    except redis.exceptions.RedisError:
+        # The tenant map expires on its own (CLOUD_CACHE_TTL['tenants'])
+        logger.exception("Could not invalidate the tenant map of %s"
+                         % provider)
+
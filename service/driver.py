@@ -1,9 +1,16 @@
+import hashlib
+import threading
+import time
 import uuid
 
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
 from core.exceptions import ProviderNotActive
 from core.models import AtmosphereUser as User
+from core.models.credential import Credential, ProviderCredential
 from core.models.identity import Identity as CoreIdentity
-from core.models.provider import Provider as CoreProvider
+from core.models.provider import Provider as CoreProvider, AccountProvider
 from core.models.size import convert_esh_size
 
 from threepio import logger
@@ -109,6 +116,122 @@ def get_hypervisor_statistics(admin_driver):
         pass
 
 
+class DriverRegistry(object):
+    """
+    Process-wide registry of authenticated drivers.
+
+    Drivers are keyed by (kind, key) and remember a fingerprint of the
+    credentials used to build them. Each key has its own lock, so a driver
+    is built once even when several threads ask for it. Drivers are shared:
+    callers must not modify them (build a driver for the identity/user
+    needed instead). A driver is rebuilt when:
+    * The credentials fingerprint changes (credential change)
+    * It is older than DRIVER_REGISTRY_MAX_AGE seconds (set below the
+      keystone token lifetime, so tokens are refreshed before they expire)
+    * It was invalidated.
+    Expired drivers are also evicted when other drivers are requested.
+    """
+
+    def __init__(self):
+        self._drivers = {}
+        self._entry_locks = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.time()
+        self.counters = {
+            'created': 0,
+            'reused': 0,
+            'expired': 0,
+            'credentials_changed': 0,
+            'invalidated': 0,
+        }
+
+    @staticmethod
+    def fingerprint(*credential_dicts):
+        digest = hashlib.sha1()
+        for credentials in credential_dicts:
+            digest.update(repr(sorted(credentials.items())))
+        return digest.hexdigest()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _evict_expired(self, max_age):
+        """
+        Forget the drivers older than `max_age` (at most once a minute).
+        Must be called with `_lock` held.
+        """
+        now = time.time()
+        if now - self._last_eviction < min(max_age, 60):
+            return
+        self._last_eviction = now
+        for registry_key, (_, _, created) in list(self._drivers.items()):
+            if now - created <= max_age:
+                continue
+            del self._drivers[registry_key]
+            self.counters['expired'] += 1
+            entry_lock = self._entry_locks.get(registry_key)
+            if entry_lock and not entry_lock.locked():
+                del self._entry_locks[registry_key]
+
+    def get(self, kind, key, fingerprint, create_method):
+        """
+        Return the registered driver for (kind, key), or register the
+        result of `create_method()`.
+        """
+        max_age = getattr(settings, 'DRIVER_REGISTRY_MAX_AGE', 3000)
+        registry_key = (kind, key)
+        with self._lock:
+            self._evict_expired(max_age)
+            entry_lock = self._entry_locks.setdefault(
+                registry_key, threading.Lock())
+        with entry_lock:
+            with self._lock:
+                entry = self._drivers.get(registry_key)
+            if entry:
+                driver, driver_fingerprint, created = entry
+                if driver_fingerprint != fingerprint:
+                    self._count('credentials_changed')
+                elif time.time() - created > max_age:
+                    self._count('expired')
+                else:
+                    self._count('reused')
+                    return driver
+            driver = create_method()
+            if driver is not None:
+                with self._lock:
+                    self._drivers[registry_key] = (
+                        driver, fingerprint, time.time())
+                self._count('created')
+            return driver
+
+    def invalidate(self, kind=None, key=None):
+        """
+        Forget every driver (matching `kind` and `key`, when given)
+        """
+        with self._lock:
+            for registry_key in list(self._drivers):
+                if kind and registry_key[0] != kind:
+                    continue
+                if key is not None and registry_key[1] != key:
+                    continue
+                del self._drivers[registry_key]
+                self.counters['invalidated'] += 1
+
+    def stats(self):
+        """
+        Returns the counters. 'reused' is the number of driver creations
+        (and keystone authentications) saved.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats['registered'] = len(self._drivers)
+        return stats
+
+
+driver_registry = DriverRegistry()
+
+
 def get_driver(driverCls, provider, identity, **provider_credentials):
     """
     Create a driver object from a class, provider and identity.
@@ -120,22 +243,25 @@ def get_driver(driverCls, provider, identity, **provider_credentials):
         return driver
 
 
-def get_admin_driver(provider):
+def get_admin_driver(provider, shared=True):
     """
     Create an admin driver for a given provider.
+    (See get_esh_driver for `shared`)
     """
     try:
         return get_esh_driver(
-            provider.accountprovider_set.all().first().identity)
+            provider.accountprovider_set.all().first().identity,
+            shared=shared)
     except:
         logger.info("Admin driver for provider %s not found." %
                     (provider.location))
         return None
 
 
-def get_account_driver(provider, raise_exception=False):
+def get_account_driver(provider, raise_exception=False, shared=True):
     """
     Create an account driver for a given provider.
+    (See get_esh_driver for `shared`)
     """
     try:
         if type(provider) == uuid.UUID:
@@ -143,12 +269,21 @@ def get_account_driver(provider, raise_exception=False):
         type_name = provider.get_type_name().lower()
         if 'openstack' in type_name:
             from service.accounts.openstack_manager import AccountDriver as\
-                OSAccountDriver
-            return OSAccountDriver(provider)
+                AccountDriverCls
         elif 'eucalyptus' in type_name:
             from service.accounts.eucalyptus import AccountDriver as\
-                EucaAccountDriver
-            return EucaAccountDriver(provider)
+                AccountDriverCls
+        else:
+            return None
+        if not shared:
+            return AccountDriverCls(provider)
+        fingerprint = driver_registry.fingerprint(
+            provider.get_credentials(),
+            *[account.identity.get_credentials()
+              for account in provider.accountprovider_set.all()])
+        return driver_registry.get(
+            'account', provider.id, fingerprint,
+            lambda: AccountDriverCls(provider))
     except:
         if type(provider) == uuid.UUID:
             provider_str = "Provider with UUID %s" % provider
@@ -217,7 +352,14 @@ def get_esh_provider(core_provider, username=None):
         raise
 
 
-def get_esh_driver(core_identity, username=None, identity_kwargs={}, **kwargs):
+def get_esh_driver(core_identity, username=None, identity_kwargs={},
+                   shared=True, **kwargs):
+    """
+    Return the driver of `core_identity` from the driver registry.
+    When `shared` is False, a private driver is built instead (for a
+    caller that uses it in a thread of its own: drivers are not
+    thread-safe).
+    """
     try:
         core_provider = core_identity.provider
         if not core_provider.is_current():
@@ -232,9 +374,17 @@ def get_esh_driver(core_identity, username=None, identity_kwargs={}, **kwargs):
         provider_creds.update(kwargs)
         identity_creds = core_identity.get_credentials()
         identity_creds.update(identity_kwargs)
-        identity = esh_map['identity'](provider, user=user, **identity_creds)
-        driver = esh_map['driver'](provider, identity, **provider_creds)
-        return driver
+
+        def create_driver():
+            identity = esh_map['identity'](
+                provider, user=user, **identity_creds)
+            return esh_map['driver'](provider, identity, **provider_creds)
+        if not shared:
+            return create_driver()
+        return driver_registry.get(
+            'esh', (core_identity.id, user.username),
+            driver_registry.fingerprint(provider_creds, identity_creds),
+            create_driver)
     except Exception as e:
         logger.exception(e)
         raise
@@ -294,3 +444,27 @@ def get_occupancy(core_provider):
     core_size_list = [convert_esh_size(size, core_provider.uuid)
                       for size in esh_size_list]
     return core_size_list
+
+
+def invalidate_account_driver(sender, instance, **kwargs):
+    """
+    Drop the registered account drivers of the provider when its
+    credentials, cloud_config or admin accounts change.
+    (Other processes notice through the credentials fingerprint)
+    """
+    if isinstance(instance, CoreProvider):
+        provider_ids = [instance.id]
+    elif isinstance(instance, Credential):
+        provider_ids = AccountProvider.objects.filter(
+            identity_id=instance.identity_id
+        ).values_list('provider_id', flat=True)
+    else:
+        provider_ids = [instance.provider_id]
+    for provider_id in provider_ids:
+        driver_registry.invalidate('account', provider_id)
+
+
+# Instantiate the hooks:
+for model in (CoreProvider, ProviderCredential, Credential, AccountProvider):
+    post_save.connect(invalidate_account_driver, sender=model)
+    post_delete.connect(invalidate_account_driver, sender=model)
@@ -58,7 +58,6 @@ from service.exceptions import (
     socket_error, ConnectionFailure, InstanceDoesNotExist, InstanceLaunchConflict, LibcloudInvalidCredsError,
     Unauthorized)
 
-from service.accounts.openstack_manager import AccountDriver as OSAccountDriver
 
 from neutronclient.common.exceptions import Conflict
 
@@ -1509,7 +1508,7 @@ def get_or_create_security_group(security_group_name, user_neutron):
     return security_group
 
 def admin_security_group_init(core_identity, max_attempts=3):
-    os_driver = OSAccountDriver(core_identity.provider)
+    os_driver = get_account_driver(core_identity.provider, raise_exception=True)
     # TODO: Remove kludge when openstack connections can be
     # Deemed reliable. Otherwise generalize this pattern so it
     # can be arbitrarilly applied to any call that is deemed 'unstable'.
@@ -1550,7 +1549,7 @@ def user_keypair_init(core_identity):
 
 
 def admin_keypair_init(core_identity):
-    os_driver = OSAccountDriver(core_identity.provider)
+    os_driver = get_account_driver(core_identity.provider, raise_exception=True)
     creds = core_identity.get_credentials()
     with open(settings.ATMOSPHERE_KEYPAIR_FILE, 'r') as pub_key_file:
         public_key = pub_key_file.read()
@@ -1694,7 +1693,7 @@ def admin_network_init(core_identity):
     provider_type = core_identity.provider.type.name
     if provider_type == 'mock':
         return _to_network_driver(core_identity)
-    os_driver = OSAccountDriver(core_identity.provider)
+    os_driver = get_account_driver(core_identity.provider, raise_exception=True)
     network_resources = os_driver.create_user_network(core_identity)
     logger.info("Created user network - %s" % network_resources)
     network, subnet = network_resources['network'], network_resources['subnet']
@@ -1824,7 +1823,7 @@ def _update_instance_metadata(esh_driver, esh_instance, data={}, replace=False):
 
 
 def _create_and_attach_port(provider, driver, instance, core_identity):
-    accounts = OSAccountDriver(core_identity.provider)
+    accounts = get_account_driver(core_identity.provider, raise_exception=True)
     tenant_id = instance.extra['tenantId']
     network_resources = accounts.network_manager.find_tenant_resources(
         tenant_id)
@@ -0,0 +1,237 @@
+"""
+Batched readiness polling for `service.tasks.driver.wait_for_instance`.
+
+Instead of one task per launching instance, each calling
+`driver.get_instance` (and retrying) every 15 seconds, `wait_for_instance`
+registers the instance here and returns. The `poll_waiting_instances`
+task then checks every waiting instance of a provider with ONE server
+listing per tick, and resumes the task's callbacks (the rest of the
+deploy chain) once `_is_instance_ready` is satisfied.
+
+Waiting instances are kept in redis, one hash per (core) provider:
+    instance_poller.<provider_id> -> {task_id: <pickled waiter>}
+Instances that are not ready are checked again with exponential backoff
+(INSTANCE_POLLER_MIN_DELAY .. INSTANCE_POLLER_MAX_DELAY seconds), and
+given up on (errbacks are called) after INSTANCE_POLLER_TIMEOUT seconds.
+"""
+import cPickle as pickle
+import time
+import traceback
+
+from celery import current_app, signature
+from celery.app.task import Context
+from django.conf import settings
+from threepio import celery_logger
+
+from core.models import Provider
+from service.cache import redis_connection, _acquire_lock, _release_lock
+from service.driver import get_driver
+from service.exceptions import TimeoutError
+
+WAITING_KEY = "instance_poller.{0}"
+PROVIDERS_KEY = "instance_poller.providers"
+STATS_KEY = "instance_poller.stats"
+TICK_KEY = "instance_poller.tick.{0}"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _next_delay(attempts):
+    """
+    Seconds to wait before the next check, doubling with each attempt
+    """
+    min_delay = _setting('INSTANCE_POLLER_MIN_DELAY', 5)
+    max_delay = _setting('INSTANCE_POLLER_MAX_DELAY', 60)
+    return min(min_delay * (2 ** min(attempts, 16)), max_delay)
+
+
+def register_waiter(provider_id, task_id, instance_alias, driverCls,
+                    provider, identity, status_query, tasks_allowed=False,
+                    test_tmp_status=False, return_id=False,
+                    callbacks=None, errbacks=None, root_id=None):
+    """
+    Wait for `instance_alias` (on the core Provider `provider_id`) to be
+    ready, then apply `callbacks` with the result of `_is_instance_ready`.
+    """
+    now_time = time.time()
+    waiter = {
+        'task_id': task_id,
+        'instance_alias': instance_alias,
+        # Used to look up instances missing from the provider listing
+        'driver': (driverCls, provider, identity),
+        'status_query': status_query,
+        'tasks_allowed': tasks_allowed,
+        'test_tmp_status': test_tmp_status,
+        'return_id': return_id,
+        'callbacks': callbacks or [],
+        'errbacks': errbacks or [],
+        'root_id': root_id,
+        'started': now_time,
+        'attempts': 0,
+        'next_check': now_time,
+    }
+    r = redis_connection()
+    r.hset(WAITING_KEY.format(provider_id), task_id,
+           pickle.dumps(waiter, pickle.HIGHEST_PROTOCOL))
+    r.sadd(PROVIDERS_KEY, provider_id)
+    celery_logger.debug("Waiting for instance %s (task %s) on provider %s"
+                        % (instance_alias, task_id, provider_id))
+
+
+def _resume(waiter, result):
+    for callback in waiter['callbacks']:
+        signature(callback).apply_async((result,))
+
+
+def _task_request(waiter):
+    """
+    The request of the `wait_for_instance` task that registered the waiter
+    """
+    driverCls, provider, identity = waiter['driver']
+    return Context(
+        id=waiter['task_id'], task="wait_for_instance",
+        root_id=waiter.get('root_id'),
+        args=[waiter['instance_alias'], driverCls, provider, identity,
+              waiter['status_query']],
+        kwargs={'tasks_allowed': waiter['tasks_allowed'],
+                'test_tmp_status': waiter['test_tmp_status'],
+                'return_id': waiter['return_id']},
+        errbacks=waiter['errbacks'])
+
+
+def _give_up(waiter):
+    """
+    Fail the `wait_for_instance` task: store a TimeoutError as its result
+    and call its errbacks the way celery does (new-style errbacks get
+    the request, exception and traceback, old-style ones the task id).
+    """
+    message = ("Gave up waiting for instance %s (task %s) after %s checks"
+               % (waiter['instance_alias'], waiter['task_id'],
+                  waiter['attempts']))
+    celery_logger.warn(message)
+    try:
+        raise TimeoutError(message)
+    except TimeoutError as exc:
+        current_app.backend.mark_as_failure(
+            waiter['task_id'], exc, traceback.format_exc(),
+            request=_task_request(waiter))
+
+
+def _lookup_instance(waiter):
+    """
+    Fallback for instances missing from the provider listing (ex: the
+    listing only includes the admin's tenant)
+    """
+    driverCls, provider, identity = waiter['driver']
+    return get_driver(driverCls, provider, identity).get_instance(
+        waiter['instance_alias'])
+
+
+def _check_waiter(waiter, instances, now_time):
+    """
+    Returns (done, result) for the waiter
+    """
+    from service.tasks.driver import _is_instance_ready
+    instance = instances.get(waiter['instance_alias'])
+    if not instance:
+        instance = _lookup_instance(waiter)
+    if not instance:
+        celery_logger.debug("Instance has been terminated: %s."
+                            % waiter['instance_alias'])
+        return (True, False)
+    try:
+        return (True, _is_instance_ready(
+            instance, waiter['status_query'], waiter['tasks_allowed'],
+            waiter['test_tmp_status'], waiter['return_id']))
+    except Exception as exc:
+        if "Not Ready" not in str(exc):
+            celery_logger.debug(exc)
+        return (False, None)
+
+
+def poll_provider(provider_id, now_time=None):
+    """
+    Check the waiting instances of the provider that are due, with one
+    listing of the provider's instances.
+    Returns the number of instances still waiting.
+    """
+    from service.monitoring import _list_provider_instances
+    if not now_time:
+        now_time = time.time()
+    r = redis_connection()
+    key = WAITING_KEY.format(provider_id)
+    waiters = [pickle.loads(value) for value in r.hvals(key)]
+    due = [waiter for waiter in waiters if waiter['next_check'] <= now_time]
+    if not due:
+        return len(waiters)
+    try:
+        provider = Provider.objects.get(id=provider_id)
+        instances = dict((instance.id, instance)
+                         for instance in _list_provider_instances(provider))
+    except Exception:
+        celery_logger.exception(
+            "Could not list the instances of provider %s" % provider_id)
+        instances = {}
+    timeout = _setting('INSTANCE_POLLER_TIMEOUT', 250 * 15)
+    done = 0
+    for waiter in due:
+        try:
+            finished, result = _check_waiter(waiter, instances, now_time)
+        except Exception:
+            celery_logger.exception(
+                "Could not check instance %s" % waiter['instance_alias'])
+            finished = False
+        waiter['attempts'] += 1
+        if finished:
+            _resume(waiter, result)
+        elif now_time - waiter['started'] > timeout:
+            _give_up(waiter)
+        else:
+            waiter['next_check'] = now_time + _next_delay(waiter['attempts'])
+            r.hset(key, waiter['task_id'],
+                   pickle.dumps(waiter, pickle.HIGHEST_PROTOCOL))
+            continue
+        r.hdel(key, waiter['task_id'])
+        done += 1
+    return len(waiters) - done
+
+
+def poll_waiting_instances():
+    """
+    One tick of the poller: poll every provider with waiting instances.
+    Providers still being polled by a previous tick are skipped.
+    Returns the queue depth (instances waiting) of each provider.
+    """
+    r = redis_connection()
+    depths = {}
+    for provider_id in r.smembers(PROVIDERS_KEY):
+        tick_key = TICK_KEY.format(provider_id)
+        token = _acquire_lock(
+            r, tick_key, _setting('INSTANCE_POLLER_MAX_DELAY', 60))
+        if not token:
+            continue
+        try:
+            depths[provider_id] = poll_provider(provider_id)
+            if not depths[provider_id]:
+                r.srem(PROVIDERS_KEY, provider_id)
+                # An instance may have been registered meanwhile
+                if r.hlen(WAITING_KEY.format(provider_id)):
+                    r.sadd(PROVIDERS_KEY, provider_id)
+        finally:
+            _release_lock(r, tick_key, token)
+    if depths:
+        r.hmset(STATS_KEY, depths)
+        celery_logger.info("Instance poller queue depth: %s" % depths)
+    return depths
+
+
+def instance_poller_stats():
+    """
+    Returns the number of instances waiting on each provider, as a dict of
+    provider_id -> count (as of the last tick)
+    """
+    stats = redis_connection().hgetall(STATS_KEY)
+    return dict((provider_id, int(count))
+                for provider_id, count in stats.items())
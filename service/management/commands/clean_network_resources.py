@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Provider
+from service.network_cleanup import RESOURCES, clean_network_resources
+
+
+class Command(BaseCommand):
+    help = 'Remove the idle floating IPs, IPs of inactive instances and ' \
+           'unused project networks of OpenStack providers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--provider-ids", default=None,
+                            help="Comma-separated list of provider IDs "
+                                 "(Default: all active OpenStack providers)")
+        parser.add_argument("--resources", default=",".join(RESOURCES),
+                            help="Comma-separated list of resources to "
+                                 "clean (Default: %s)" % ",".join(RESOURCES))
+        parser.add_argument("--dry-run", action="store_true", default=False,
+                            help="Only report the idle resources")
+
+    def handle(self, *args, **options):
+        providers = Provider.get_active(type_name='openstack')
+        if options['provider_ids']:
+            providers = providers.filter(
+                id__in=options['provider_ids'].split(','))
+        resources = [resource for resource in
+                     options['resources'].split(',') if resource]
+        for resource in resources:
+            if resource not in RESOURCES:
+                raise CommandError("Unknown resource %s (Expected: %s)"
+                                   % (resource, ", ".join(RESOURCES)))
+        for provider in providers:
+            report = clean_network_resources(
+                provider, resources=resources, dry_run=options['dry_run'])
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,61 @@
+import sys
+
+import pytz
+from dateutil.parser import parse
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from service.allocation_logic import REPORT_FORMATS, export_report, iter_report
+
+
+def _parse_date(value):
+    """
+    Parse an ISO 8601 date; dates without a timezone are UTC
+    """
+    try:
+        date = parse(value)
+    except (ValueError, OverflowError):
+        raise CommandError("Cannot parse date %s" % value)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date, pytz.utc)
+    return date
+
+
+class Command(BaseCommand):
+    help = 'Stream the allocation report as CSV or NDJSON, one row at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument("start_date", help="Report start date (ISO 8601)")
+        parser.add_argument("--end-date", default=None,
+                            help="Report end date (ISO 8601) (Default: now)")
+        parser.add_argument("--username", default=None,
+                            help="Only include instances created by this user")
+        parser.add_argument("--allocation-source", default=None,
+                            help="Only include rows for this allocation source name")
+        parser.add_argument("--format", dest="file_format", default="csv",
+                            choices=sorted(REPORT_FORMATS.keys()),
+                            help="Output format (Default: csv)")
+        parser.add_argument("--gzip", action="store_true", default=False,
+                            help="gzip the output")
+        parser.add_argument("--output", default=None,
+                            help="Write to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        start_date = _parse_date(options['start_date'])
+        end_date = _parse_date(options['end_date']) \
+            if options['end_date'] else timezone.now()
+        rows = iter_report(
+            start_date, end_date,
+            user_id=options['username'],
+            allocation_source_name=options['allocation_source'])
+        chunks = export_report(
+            rows, file_format=options['file_format'],
+            compress=options['gzip'])
+        if options['output']:
+            with open(options['output'], 'wb') as report_file:
+                for chunk in chunks:
+                    report_file.write(chunk)
+        else:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            sys.stdout.flush()
@@ -1,9 +1,12 @@
 import random
 import time
+from collections import defaultdict
 from datetime import timedelta
 from django.core.exceptions import ObjectDoesNotExist
 import pytz
-from django.db.models import Q
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from threepio import logger
 from core.models import AtmosphereUser as User
@@ -11,14 +14,18 @@ from core.models import AccountProvider
 from core.models.allocation_strategy import Allocation as CoreAllocation
 from core.models.allocation_strategy import AllocationStrategy as CoreAllocationStrategy
 from core.models.credential import Credential
-from core.models import IdentityMembership, Identity, InstanceStatusHistory
+from core.models import (
+    IdentityMembership, Identity, InstanceStatusHistory, ApplicationMetrics)
 from core.models.instance import Instance as CoreInstance
 from core.models.instance import (
-    convert_esh_instance, _esh_instance_size_to_core
+    convert_esh_instance, _esh_instance_size_to_core,
+    _find_esh_ip, _get_status_name_for_provider
 )
-from core.models.size import convert_esh_size
+from core.models.instance_history import InstanceStatus
+from core.models.size import Size, convert_esh_size
 from allocation.models import Allocation, AllocationResult
-from service.cache import get_cached_instances, get_cached_driver
+from service.cache import get_cached_instances, get_cached_driver,\
+    get_cached_tenant_map
 from service.instance import suspend_instance, stop_instance, destroy_instance, shelve_instance, offload_instance
 from allocation.engine import calculate_allocation
 from django.conf import settings
@@ -27,25 +34,22 @@ from rtwo.exceptions import LibcloudInvalidCredsError
 # Private
 def _include_all_idents(identities, owner_map):
     # Include all identities with 0 instances to the monitoring
-    identity_owners = [ident.get_credential('ex_tenant_name')
-                       for ident in identities]
-    owners_w_instances = owner_map.keys()
-    for user in identity_owners:
-        if user not in owners_w_instances:
-            owner_map[user] = []
+    tenant_names = dict(Credential.objects.filter(
+        identity__in=identities, key='ex_tenant_name'
+    ).values_list('identity_id', 'value'))
+    for ident in identities:
+        owner_map.setdefault(tenant_names.get(ident.id), [])
     return owner_map
 
 
 def _make_instance_owner_map(instances, users=None):
     owner_map = {}
+    users = set(users) if users else None
 
     for i in instances:
         if users and i.owner not in users:
             continue
-        key = i.owner
-        instance_list = owner_map.get(key, [])
-        instance_list.append(i)
-        owner_map[key] = instance_list
+        owner_map.setdefault(i.owner, []).append(i)
     return owner_map
 
 
@@ -69,15 +73,31 @@ def _select_identities(provider, users=None):
     return provider.identity_set.all()
 
 
+def tenant_id_name_map(tenants):
+    """
+    Index a list of tenants/projects (objects or dicts) by id.
+    Returns a dict of tenant id -> tenant name
+    """
+    tenant_map = {}
+    for tenant in tenants:
+        if type(tenant) == dict:
+            tenant_map[tenant['id']] = tenant['name']
+        else:
+            tenant_map[tenant.id] = tenant.name
+    return tenant_map
+
+
 def _convert_tenant_id_to_names(instances, tenants):
+    """
+    `tenants` is a list of tenants (objects or dicts) or a
+    tenant id -> tenant name dict (see `get_cached_tenant_map`)
+    """
+    if not isinstance(tenants, dict):
+        tenants = tenant_id_name_map(tenants)
     for i in instances:
-        for tenant in tenants:
-            if type(tenant) == dict:
-                if tenant['id'] == i.owner:
-                    i.owner = tenant['name']
-            else:
-                if tenant.id == i.owner:
-                    i.owner = tenant.name
+        tenant_name = tenants.get(i.owner)
+        if tenant_name is not None:
+            i.owner = tenant_name
     return instances
 
 
@@ -319,37 +339,444 @@ def _resolve_history_conflict(
     return new_history
 
 
-def _get_instance_owner_map(provider, users=None):
+def _get_identity_map_for_tenants(provider, tenant_names):
+    """
+    Bulk version of `_get_identity_from_tenant_name`
+    Returns a dict of tenant_name -> Identity, using a single query.
+    When >1 credential matches a tenant, the first one wins (as before).
+    """
+    credentials = Credential.objects.filter(
+        key='ex_project_name', value__in=tenant_names,
+        identity__provider=provider
+    ).select_related(
+        'identity', 'identity__created_by', 'identity__provider'
+    ).order_by('id')
+    identity_map = {}
+    for credential in credentials:
+        if credential.value in identity_map:
+            logger.warn("%s has >1 Credentials on Provider %s"
+                        % (credential.value, provider))
+            continue
+        identity_map[credential.value] = credential.identity
+    return identity_map
+
+
+def _bulk_history_for(core_instance, esh_instance, provider, size,
+                      status_map, now_time):
+    """
+    Build the (unsaved) InstanceStatusHistory that `update_history` would
+    have created for this esh_instance. Returns None if the current history
+    is still accurate.
+    """
+    metadata = esh_instance.extra.get('metadata', {})
+    status_name = _get_status_name_for_provider(
+        provider,
+        esh_instance.extra['status'],
+        esh_instance.extra.get('task'),
+        metadata.get('tmp_status', "MISSING"))
+    open_history = core_instance.open_history
+    if len(open_history) == 1 \
+            and open_history[0].status.name == status_name \
+            and open_history[0].size_id == size.id:
+        return None
+    status = status_map.get(status_name)
+    if not status:
+        status, _ = InstanceStatus.objects.get_or_create(name=status_name)
+        status_map[status_name] = status
+    extra = InstanceStatusHistory._build_extra(
+        status_name=status_name,
+        fault=esh_instance.extra.get('fault', None),
+        deploy_fault_message=metadata.get('fault_message', None),
+        deploy_fault_trace=metadata.get('fault_trace', None))
+    core_instance.esh = esh_instance
+    return InstanceStatusHistory(
+        instance=core_instance, size=size, status=status,
+        activity=core_instance.esh_activity(), extra=extra,
+        start_date=now_time)
+
+
+class _QueryCounter(object):
+    """
+    Counts the queries issued in the block (as `count`). Queries are only
+    recorded under settings.DEBUG (`count` is None otherwise): recording
+    keeps every query in memory.
+    """
+
+    def __enter__(self):
+        self._capture = CaptureQueriesContext(connection) \
+            if settings.DEBUG else None
+        self.count = None
+        if self._capture:
+            self._capture.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._capture:
+            self._capture.__exit__(*exc_info)
+            self.count = len(self._capture)
+        return False
+
+
+def _bulk_reconcile_instances(provider, instance_map):
+    """
+    Set-based replacement for the per-tenant loop of
+    `convert_esh_instance` + `_cleanup_missing_instances`.
+
+    Identities, instances, open histories, sizes and statuses for the
+    provider are prefetched in a handful of queries and diffed against
+    the cloud listing (`instance_map`, as built by `_get_instance_owner_map`)
+    using dicts keyed by tenant name and provider_alias.
+    * Known instances whose status/size is unchanged are left alone.
+    * Known instances whose status/size changed (or that have conflicting
+      un-end-dated histories) are end-dated and given a new history
+      using bulk writes.
+    * Instances that are new (or otherwise unknown) fall back to
+      `convert_esh_instance`.
+    * Instances no longer seen on the cloud are end-dated in bulk.
+
+    Returns a report of the work done, queries issued (under DEBUG) and
+    wall time.
+    """
+    report = {
+        'provider': provider.location,
+        'tenants': len(instance_map),
+        'identities': 0,
+        'running': 0,
+        'unchanged': 0,
+        'updated': 0,
+        'converted': 0,
+        'conflicts': 0,
+        'end_dated': 0,
+        'errors': 0,
+    }
+    start_time = time.time()
+    with _QueryCounter() as query_context:
+        now_time = timezone.now()
+        identity_map = _get_identity_map_for_tenants(
+            provider, instance_map.keys())
+        report['identities'] = len(identity_map)
+        identities = identity_map.values()
+
+        core_instances = CoreInstance.objects.filter(
+            Q(end_date=None) | Q(instancestatushistory__end_date=None),
+            created_by_identity__in=identities,
+            created_by=F('created_by_identity__created_by'),
+        ).select_related('created_by', 'created_by_identity').distinct()
+        instances_by_alias = {}
+        instances_by_identity = {}
+        for core_instance in core_instances:
+            core_instance.open_history = []
+            instances_by_alias[core_instance.provider_alias] = core_instance
+            instances_by_identity.setdefault(
+                core_instance.created_by_identity_id, []
+            ).append(core_instance)
+
+        open_history = InstanceStatusHistory.objects.filter(
+            end_date=None, instance__in=core_instances
+        ).select_related('status')
+        instances_by_id = {
+            inst.id: inst for inst in instances_by_alias.values()}
+        for history in open_history:
+            instances_by_id[history.instance_id].open_history.append(history)
+
+        sizes_by_alias = {}
+        for size in Size.objects.filter(provider=provider).order_by('id'):
+            sizes_by_alias.setdefault(size.alias, size)
+        status_map = {
+            status.name: status for status in InstanceStatus.objects.all()}
+
+        stale_history_ids = []
+        new_history = []
+        missing_instance_ids = []
+        for tenant_name in sorted(instance_map.keys()):
+            identity = identity_map.get(tenant_name)
+            if not identity:
+                continue
+            running_instances = instance_map[tenant_name]
+            report['running'] += len(running_instances)
+            seen_aliases = set()
+            driver = None
+            try:
+                for esh_instance in running_instances:
+                    core_instance = instances_by_alias.get(esh_instance.id)
+                    size = sizes_by_alias.get(esh_instance.size.id)
+                    if not core_instance or core_instance.end_date \
+                            or not core_instance.open_history or not size:
+                        # Slow path: let convert_esh_instance handle it.
+                        if not driver:
+                            driver = get_cached_driver(identity=identity)
+                        core_instance = convert_esh_instance(
+                            driver, esh_instance,
+                            identity.provider.uuid, identity.uuid,
+                            identity.created_by)
+                        seen_aliases.add(core_instance.provider_alias)
+                        report['converted'] += 1
+                        continue
+                    seen_aliases.add(core_instance.provider_alias)
+                    ip_address = _find_esh_ip(esh_instance)
+                    if core_instance.ip_address != ip_address:
+                        core_instance.ip_address = ip_address
+                        core_instance.save(update_fields=['ip_address'])
+                    history = _bulk_history_for(
+                        core_instance, esh_instance, provider, size,
+                        status_map, now_time)
+                    if not history:
+                        report['unchanged'] += 1
+                        continue
+                    if len(core_instance.open_history) > 1:
+                        logger.warn(
+                            "Instance %s contained %s NON END DATED history:"
+                            "%s. New History: %s" % (
+                                core_instance.provider_alias,
+                                len(core_instance.open_history),
+                                [h.status.name
+                                 for h in core_instance.open_history],
+                                history))
+                        report['conflicts'] += 1
+                    stale_history_ids.extend(
+                        h.id for h in core_instance.open_history)
+                    new_history.append(history)
+                    report['updated'] += 1
+            except Exception:
+                logger.exception(
+                    "Could not convert running instances for %s" %
+                    tenant_name)
+                report['errors'] += 1
+                continue
+            # Using the 'known' set of running instances, cleanup the DB
+            for core_instance in instances_by_identity.get(identity.id, []):
+                if core_instance.provider_alias not in seen_aliases:
+                    missing_instance_ids.append(core_instance.id)
+
+        with transaction.atomic():
+            InstanceStatusHistory.objects.filter(
+                id__in=stale_history_ids, end_date=None
+            ).update(end_date=now_time)
+            new_history = InstanceStatusHistory.objects.bulk_create(
+                new_history)
+            InstanceStatusHistory.update_instance_pointers(new_history)
+            ApplicationMetrics.histories_created(new_history)
+            InstanceStatusHistory.objects.filter(
+                instance__id__in=missing_instance_ids, end_date=None
+            ).update(end_date=now_time)
+            report['end_dated'] = CoreInstance.objects.filter(
+                id__in=missing_instance_ids, end_date=None
+            ).update(end_date=now_time)
+    report['queries'] = query_context.count
+    report['seconds'] = round(time.time() - start_time, 3)
+    logger.info("Bulk instance reconciliation for %s: %s"
+                % (provider, report))
+    return report
+
+
+def _make_tenant_owner_map(instances_by_tenant, tenant_map, users=None):
+    """
+    Like `_make_instance_owner_map`, for instances already grouped by
+    tenant id (see `ProviderSnapshot.instances_by_tenant`): each tenant
+    name is looked up once, and tenants of other `users` are skipped
+    without visiting their instances.
+    """
+    owner_map = {}
+    users = set(users) if users else None
+    for tenant_id, instances in instances_by_tenant.items():
+        owner = tenant_map.get(tenant_id, tenant_id)
+        if users and owner not in users:
+            continue
+        for instance in instances:
+            instance.owner = owner
+        owner_map.setdefault(owner, []).extend(instances)
+    return owner_map
+
+
+def _get_instance_owner_map(provider, users=None, all_instances=None,
+                            tenant_map=None, instances_by_tenant=None):
     """
     All keys == All identities
     Values = List of identities / username
     NOTE: This is KEYSTONE && NOVA specific. the 'instance owner' here is the
           username // ex_tenant_name
+    `all_instances` (or `instances_by_tenant`) and `tenant_map` can be
+    passed in when they have already been listed
+    (see `fetch_provider_snapshot`).
     """
     from service.driver import get_account_driver
 
-    admin_driver = get_cached_driver(provider=provider)
-    accounts = get_account_driver(provider=provider, raise_exception=True)
     all_identities = _select_identities(provider, users)
-    acct_providers = AccountProvider.objects.filter(provider=provider)
-    if acct_providers:
-        account_identity = acct_providers[0].identity
-        provider = None
+    if instances_by_tenant is not None and tenant_map is not None:
+        instance_map = _make_tenant_owner_map(
+            instances_by_tenant, tenant_map, users=users)
     else:
-        account_identity = None
-
-
-    all_instances = get_cached_instances(provider=provider, identity=account_identity, force=True)
-    #all_tenants = admin_driver._connection._keystone_list_tenants()
-    all_tenants = accounts.list_projects()
-    # Convert instance.owner from tenant-id to tenant-name all at once
-    all_instances = _convert_tenant_id_to_names(all_instances, all_tenants)
-    # Make a mapping of owner-to-instance
-    instance_map = _make_instance_owner_map(all_instances, users=users)
+        if all_instances is None:
+            all_instances = _list_provider_instances(provider)
+        if tenant_map is None:
+            accounts = get_account_driver(
+                provider=provider, raise_exception=True)
+            tenant_map = get_cached_tenant_map(
+                provider, account_driver=accounts)
+            if any(instance.owner not in tenant_map
+                   for instance in all_instances):
+                # The instances are listed fresh: their project may be
+                # newer than the cached tenant map
+                tenant_map = get_cached_tenant_map(
+                    provider, account_driver=accounts, force=True)
+        # Convert instance.owner from tenant-id to tenant-name all at once
+        all_instances = _convert_tenant_id_to_names(all_instances, tenant_map)
+        # Make a mapping of owner-to-instance
+        instance_map = _make_instance_owner_map(all_instances, users=users)
     logger.info("Instance owner map created")
     identity_map = _include_all_idents(all_identities, instance_map)
     logger.info("Identity map created")
     return identity_map
+
+
+def _list_provider_instances(provider, driver=None):
+    """
+    All instances of the provider, listed by the account identity
+    (when the provider has one)
+    """
+    acct_provider = AccountProvider.objects.filter(provider=provider).first()
+    if acct_provider:
+        return get_cached_instances(
+            identity=acct_provider.identity, force=True, driver=driver)
+    return get_cached_instances(provider=provider, force=True, driver=driver)
+
+
+def list_cloud_machines(account_driver):
+    """
+    All images of the provider (with the owner information of v1 glance
+    on providers that require it)
+    """
+    if account_driver.user_manager.version == 2:
+        #Old providers need to use v1 glance to get owner information.
+        cloud_machines_dict = account_driver.image_manager.list_v1_images()
+        cloud_machines = account_driver.list_all_images()
+        account_driver.add_owner_to_machine(cloud_machines, cloud_machines_dict)
+    else:
+        cloud_machines = account_driver.list_all_images()
+    return cloud_machines
+
+
+class ProviderSnapshot(object):
+    """
+    The cloud listings of one provider, fetched once per monitoring
+    cycle and shared by the reconciliation steps.
+    Listings that failed (or missed the deadline) are None, with the
+    reason in `errors`. `timings` holds the seconds each listing took.
+    The `*_by_*` indexes are built (once) on first use.
+    """
+    LISTINGS = ('instances', 'volumes', 'machines', 'sizes', 'tenant_map')
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.errors = {}
+        self.timings = {}
+        self._indexes = {}
+        for listing in self.LISTINGS:
+            setattr(self, listing, None)
+
+    def _index(self, name, build_index):
+        if name not in self._indexes:
+            self._indexes[name] = build_index()
+        return self._indexes[name]
+
+    @property
+    def images_by_id(self):
+        return self._index('images_by_id', lambda: dict(
+            (machine.id, machine) for machine in self.machines or []))
+
+    @property
+    def instances_by_tenant(self):
+        """
+        dict of tenant id -> instances (of the admin listing)
+        """
+        def build_index():
+            instances_by_tenant = defaultdict(list)
+            for instance in self.instances or []:
+                tenant_id = instance.extra.get('tenantId')
+                instances_by_tenant[tenant_id].append(instance)
+            return dict(instances_by_tenant)
+        return self._index('instances_by_tenant', build_index)
+
+    def __repr__(self):
+        return "<ProviderSnapshot %s: %s>" % (
+            self.provider.location,
+            ", ".join("%s=%s" % (listing, self.errors.get(
+                listing, len(getattr(self, listing) or [])))
+                for listing in self.LISTINGS))
+
+
+def _timed_listing(list_method):
+    """
+    Returns (seconds, listing) of `list_method()`, closing the database
+    connection of the (worker) thread when done.
+    """
+    try:
+        start = time.time()
+        listing = list_method()
+        return (time.time() - start, listing)
+    finally:
+        connection.close()
+
+
+def fetch_provider_snapshot(provider, deadline):
+    """
+    List the servers, projects, sizes, volumes and images of the provider
+    concurrently (one thread per listing) and return a ProviderSnapshot.
+    Drivers are not thread-safe: each listing builds its own driver,
+    outside of the driver registry.
+    Listings still running at `deadline` (a time.time() value) are
+    abandoned.
+    """
+    from multiprocessing import TimeoutError as PoolTimeoutError
+    from multiprocessing.pool import ThreadPool
+    from service.driver import get_admin_driver, get_account_driver
+
+    def list_instances():
+        return _list_provider_instances(
+            provider, driver=get_admin_driver(provider, shared=False))
+
+    def list_tenants():
+        return get_cached_tenant_map(
+            provider, force=True, account_driver=get_account_driver(
+                provider, raise_exception=True, shared=False))
+
+    def list_volumes():
+        return get_admin_driver(provider, shared=False).list_all_volumes(
+            timeout=max(min(deadline - time.time(), 30), 1))
+
+    list_methods = {
+        'instances': list_instances,
+        'tenant_map': list_tenants,
+        'sizes': lambda: get_admin_driver(provider, shared=False).list_sizes(),
+        'volumes': list_volumes,
+        'machines': lambda: list_cloud_machines(get_account_driver(
+            provider, raise_exception=True, shared=False)),
+    }
+    snapshot = ProviderSnapshot(provider)
+    pool = ThreadPool(len(list_methods))
+    try:
+        results = dict(
+            (listing, pool.apply_async(_timed_listing, (list_method,)))
+            for listing, list_method in list_methods.items())
+        for listing, result in results.items():
+            try:
+                seconds, data = result.get(
+                    timeout=max(deadline - time.time(), 0))
+                setattr(snapshot, listing, data)
+                snapshot.timings[listing] = seconds
+            except PoolTimeoutError:
+                snapshot.errors[listing] = "Deadline exceeded"
+            except Exception as exc:
+                logger.exception("Could not list %s of %s"
+                                 % (listing, provider))
+                snapshot.errors[listing] = str(exc)
+    finally:
+        # Abandoned listings finish (on their own drivers) in the
+        # background, do not wait for them
+        pool.close()
+    return snapshot
+
+
 # Used in OLD allocation
 
 
@@ -0,0 +1,229 @@
+"""
+Provider-level cleanup of idle floating IPs and project networks.
+
+Instead of one `clear_empty_ips_for` task per identity (each building its
+own driver and listing floating IPs, instances and networks), the servers,
+floating IPs, ports, networks and routers of the provider are listed ONCE
+with the admin account. The projects with idle resources are computed
+from those listings, and only those projects are cleaned up: their IPs
+through a bounded thread pool (settings.NETWORK_CLEANUP_POOL_SIZE), their
+networks with the account driver.
+"""
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+from threepio import celery_logger
+
+from core.models import Identity
+from core.models.credential import Credential
+
+# floating_ips: Floating IPs not attached to any port
+# instance_ips: IPs of inactive (suspended, stopped, ...) instances
+# networks: Project networks that no instance is using
+RESOURCES = ('floating_ips', 'instance_ips', 'networks')
+
+
+class NetworkListing(object):
+    """
+    The servers, floating IPs, ports, networks and routers of a provider,
+    listed once with the admin account.
+    """
+
+    def __init__(self, account_driver):
+        neutron = account_driver.network_manager.neutron
+        self.instances = account_driver.list_all_instances()
+        self.floating_ips = neutron.list_floatingips()['floatingips']
+        self.ports = neutron.list_ports()['ports']
+        self.networks = neutron.list_networks()['networks']
+        self.routers = neutron.list_routers()['routers']
+        self.project_names = account_driver._make_tenant_id_map()
+
+
+def _networks_in_use(listing):
+    """
+    Ids and names of the networks an instance is attached to
+    """
+    network_ids = set(
+        port['network_id'] for port in listing.ports
+        if (port.get('device_owner') or '').startswith('compute:'))
+    network_names = set()
+    for instance in listing.instances:
+        network_names.update(instance.extra.get('addresses', {}).keys())
+    return network_ids, network_names
+
+
+def plan_cleanup(listing, is_inactive_instance, resources=RESOURCES):
+    """
+    Returns the idle resources of each project, as a dict of
+    project name -> {resource: [floating IP addresses/instance ids/
+    network names]} ('routers' lists the routers of the projects whose
+    networks are removed).
+    """
+    project_names = listing.project_names
+    plan = defaultdict(lambda: defaultdict(list))
+    if 'floating_ips' in resources:
+        for floating_ip in listing.floating_ips:
+            project = project_names.get(floating_ip.get('tenant_id'))
+            if project and not floating_ip.get('port_id'):
+                plan[project]['floating_ips'].append(
+                    floating_ip['floating_ip_address'])
+    if 'instance_ips' in resources:
+        for instance in listing.instances:
+            project = project_names.get(instance.extra.get('tenantId'))
+            if project and instance.ip and is_inactive_instance(instance):
+                plan[project]['instance_ips'].append(instance.id)
+    if 'networks' in resources:
+        network_ids, network_names = _networks_in_use(listing)
+        for network in listing.networks:
+            if network.get('shared') or network.get('router:external'):
+                continue
+            if network['id'] in network_ids \
+                    or network['name'] in network_names:
+                continue
+            project = project_names.get(network.get('tenant_id'))
+            if project:
+                plan[project]['networks'].append(network['name'])
+        for router in listing.routers:
+            project = project_names.get(router.get('tenant_id'))
+            if project in plan and plan[project].get('networks'):
+                plan[project]['routers'].append(router['name'])
+    return dict((project, dict(project_plan))
+                for project, project_plan in plan.items())
+
+
+def _project_identities(provider, project_names):
+    """
+    Returns a dict of project name -> (Identity, is_owner) of the
+    provider, preferring the identity of the user named after the project
+    """
+    identities = {}
+    for project, identity_id, username in Credential.objects.filter(
+            identity__provider=provider, key='ex_project_name',
+            value__in=project_names,
+    ).values_list('value', 'identity_id', 'identity__created_by__username'):
+        if project not in identities or username == project:
+            identities[project] = (identity_id, username == project)
+    identity_map = Identity.objects.in_bulk(
+        [identity_id for identity_id, _ in identities.values()])
+    return dict((project, (identity_map[identity_id], is_owner))
+                for project, (identity_id, is_owner) in identities.items())
+
+
+def _clean_project_ips(identity, project_name, project_plan, instances):
+    """
+    Remove the idle floating IPs and instance IPs of one project, with the
+    project's own driver (as `clear_empty_ips_for` did).
+    Returns the number of resources removed, by resource.
+    """
+    from service.driver import get_esh_driver
+    from service.tasks.driver import (
+        _remove_extra_floating_ips, _remove_ips_from_inactive_instances)
+    try:
+        removed = {}
+        driver = get_esh_driver(identity)
+        if project_plan.get('floating_ips'):
+            removed['floating_ips'] = _remove_extra_floating_ips(
+                driver, project_name)
+        if project_plan.get('instance_ips'):
+            inactive_instances = [instances[instance_id] for instance_id
+                                  in project_plan['instance_ips']]
+            _remove_ips_from_inactive_instances(
+                driver, inactive_instances, identity)
+            removed['instance_ips'] = len(inactive_instances)
+        return removed
+    finally:
+        # Worker threads each have their own database connection
+        connection.close()
+
+
+def _remove_project_network(account_driver, identity, project_name,
+                            project_plan):
+    """
+    Remove the network of one project with the provider's account driver.
+    """
+    celery_logger.info("Removing project network for %s" % project_name)
+    account_driver.delete_user_network(identity)
+    return {'networks': len(project_plan['networks'])}
+
+
+def clean_network_resources(provider, resources=RESOURCES, dry_run=False):
+    """
+    Remove the idle `resources` of every project of the provider.
+    Returns a report of the resources found idle ('projects'), removed
+    ('removed') or skipped (projects without a matching identity), and
+    the errors of each project. Nothing is removed when `dry_run`.
+
+    IPs are removed through a pool of per-identity drivers; networks are
+    removed afterwards, one project at a time, on the calling thread
+    (the account driver is shared and is not thread-safe).
+    """
+    from service.driver import get_account_driver
+    account_driver = get_account_driver(provider, raise_exception=True)
+    listing = NetworkListing(account_driver)
+    plan = plan_cleanup(
+        listing, account_driver.admin_driver._is_inactive_instance,
+        resources)
+    identities = _project_identities(provider, list(plan))
+    report = {
+        'provider': provider.id,
+        'dry_run': dry_run,
+        'projects': plan,
+        'removed': {},
+        'skipped': {},
+        'errors': {},
+    }
+    actions = {}
+    for project_name, project_plan in plan.items():
+        identity, is_owner = identities.get(project_name, (None, False))
+        if not identity:
+            report['skipped'][project_name] = "No identity found"
+            continue
+        project_actions = dict(project_plan)
+        if project_plan.get('networks') and not is_owner:
+            # Only remove the networks of users' own projects
+            report['skipped'][project_name] = \
+                "No identity of user %s found" % project_name
+            project_actions.pop('networks')
+            project_actions.pop('routers', None)
+        if project_actions:
+            actions[project_name] = (identity, project_actions)
+    if dry_run:
+        return report
+    instances = dict(
+        (instance.id, instance) for instance in listing.instances)
+    pool = ThreadPool(getattr(settings, 'NETWORK_CLEANUP_POOL_SIZE', 5))
+    try:
+        results = dict(
+            (project_name, pool.apply_async(_clean_project_ips, (
+                identity, project_name, project_actions, instances)))
+            for project_name, (identity, project_actions)
+            in actions.items()
+            if project_actions.get('floating_ips')
+            or project_actions.get('instance_ips'))
+        for project_name, result in results.items():
+            try:
+                report['removed'][project_name] = result.get()
+            except Exception as exc:
+                celery_logger.exception(
+                    "Could not clean the network resources of %s"
+                    % project_name)
+                report['errors'][project_name] = str(exc)
+    finally:
+        pool.close()
+        pool.join()
+    for project_name, (identity, project_actions) in sorted(actions.items()):
+        if not project_actions.get('networks') \
+                or project_name in report['errors']:
+            continue
+        try:
+            report['removed'].setdefault(project_name, {}).update(
+                _remove_project_network(
+                    account_driver, identity, project_name,
+                    project_actions))
+        except Exception as exc:
+            celery_logger.exception(
+                "Could not remove the network of %s" % project_name)
+            report['errors'][project_name] = str(exc)
+    return report
@@ -3,19 +3,164 @@ from threepio import logger
 from django.core.exceptions import ValidationError
 
 from core.models import IdentityMembership, Identity
-from core.models.quota import (
-    has_floating_ip_count_quota,
-    has_port_count_quota,
-    has_instance_count_quota,
-    has_cpu_quota,
-    has_mem_quota,
-    has_storage_quota,
-    has_storage_count_quota,
-    has_snapshot_count_quota
-    )
+from core.models.quota import _pre_cache_sizes, _quota_error_message
 from service.cache import get_cached_driver
 from service.driver import get_account_driver
 
+INSTANCE_USAGE = 'instance'
+STORAGE_USAGE = 'storage'
+
+
+def _enforced(limit):
+    """
+    A Quota limit that is null or negative is unlimited
+    """
+    return bool(limit) and limit > 0
+
+
+def _count_ports(identity):
+    # Consider the ports unknown (and the check passing)
+    # if we fail to connect here
+    try:
+        from service.instance import _to_network_driver
+        network_driver = _to_network_driver(identity)
+        port_list = network_driver.list_ports()
+        project_id = network_driver.get_tenant_id()
+        return len([
+            port for port in port_list if
+            'compute:' in port['device_owner'] and
+            port.get('project_id', project_id) == project_id])
+    except Exception as exc:
+        logger.warn("Could not verify quota due to failed call to network_driver.list_ports() - %s" % exc)
+        return None
+
+
+def _count_floating_ips(driver):
+    # Consider the floating IPs unknown (and the check passing)
+    # if we fail to connect here
+    try:
+        return len(driver._connection.ex_list_floating_ips())
+    except Exception as exc:
+        logger.warn("Could not verify quota due to failed call to ex_list_floating_ips() - %s" % exc)
+        return None
+
+
+def _instance_usage(identity, driver):
+    _pre_cache_sizes(driver)
+    instances = driver.list_instances()
+    cpu = 0
+    memory = 0.0
+    for inst in instances:
+        try:
+            cpu += inst.size._size.extra['cpu']
+        except (AttributeError, KeyError):
+            # Instance running on an unknown size..
+            cpu += 1
+        try:
+            memory += inst.size._size.ram / 1024.0
+        except (AttributeError, KeyError):
+            memory += 1
+    # Only list the ports and floating IPs when their limit is enforced
+    quota = identity.quota
+    return {
+        'cpu': cpu,
+        'memory': memory,
+        'instance_count': len(instances),
+        'floating_ip_count': _count_floating_ips(driver)
+        if quota and _enforced(quota.floating_ip_count) else None,
+        'port_count': _count_ports(identity)
+        if quota and _enforced(quota.port_count) else None,
+    }
+
+
+def _storage_usage(identity, driver):
+    volumes = driver.list_volumes()
+    return {
+        'storage': sum(vol.size for vol in volumes),
+        'storage_count': len(volumes),
+        'snapshot_count': len(driver._connection.ex_list_snapshots()),
+    }
+
+
+def get_quota_usage(identity, resources, driver=None):
+    """
+    A single snapshot of the identity's current usage (listed from the
+    cloud every time: a cached snapshot would miss launches in progress
+    and deleted resources):
+    - INSTANCE_USAGE: cpu, memory (GB), instance_count,
+                      floating_ip_count, port_count (None when the limit
+                      is not enforced, or could not be listed)
+    - STORAGE_USAGE: storage (GB), storage_count, snapshot_count
+    """
+    usage_method = _instance_usage if resources == INSTANCE_USAGE \
+        else _storage_usage
+    return usage_method(
+        identity, driver or get_cached_driver(identity=identity))
+
+
+def evaluate_instance_quota(quota, usage, new_cpu=0, new_ram=0,
+                            new_instance=0, new_floating_ip=0, new_port=0):
+    """
+    Evaluate every instance-related Quota limit against one usage snapshot
+    (see `get_quota_usage`). A limit that is null or negative is unlimited.
+    Returns the list of failed limits (as error messages).
+    """
+    if not quota:
+        return []
+    failures = []
+    if _enforced(quota.cpu) \
+            and usage['cpu'] + new_cpu > quota.cpu:
+        failures.append(_quota_error_message(
+            'CPU', usage['cpu'], new_cpu, quota.cpu))
+    if _enforced(quota.memory) \
+            and int(usage['memory'] + new_ram / 1024.0) > quota.memory:
+        failures.append(_quota_error_message(
+            'Memory', usage['memory'], new_ram / 1024.0, quota.memory))
+    if _enforced(quota.instance_count) \
+            and usage['instance_count'] + new_instance > quota.instance_count:
+        failures.append(_quota_error_message(
+            'Instance', usage['instance_count'], new_instance,
+            quota.instance_count))
+    if _enforced(quota.floating_ip_count) \
+            and usage['floating_ip_count'] is not None \
+            and usage['floating_ip_count'] + new_floating_ip \
+            > quota.floating_ip_count:
+        failures.append(_quota_error_message(
+            'Floating IP', usage['floating_ip_count'], new_floating_ip,
+            quota.floating_ip_count))
+    if _enforced(quota.port_count) \
+            and usage['port_count'] is not None \
+            and usage['port_count'] + new_port > quota.port_count:
+        failures.append(_quota_error_message(
+            'Fixed IP', usage['port_count'], new_port, quota.port_count))
+    return failures
+
+
+def evaluate_storage_quota(quota, usage, new_disk=0, new_volume=0,
+                           new_snapshot=0):
+    """
+    Evaluate every storage-related Quota limit against one usage snapshot
+    (see `get_quota_usage`). A limit that is null or negative is unlimited.
+    Returns the list of failed limits (as error messages).
+    """
+    if not quota:
+        return []
+    failures = []
+    if _enforced(quota.storage) and usage['storage'] + new_disk > quota.storage:
+        failures.append(_quota_error_message(
+            'Storage Size', usage['storage'], new_disk, quota.storage))
+    if _enforced(quota.storage_count) \
+            and usage['storage_count'] + new_volume > quota.storage_count:
+        failures.append(_quota_error_message(
+            'Volume', usage['storage_count'], new_volume,
+            quota.storage_count))
+    if _enforced(quota.snapshot_count) \
+            and usage['snapshot_count'] + new_snapshot > quota.snapshot_count:
+        failures.append(_quota_error_message(
+            'Snapshot', usage['snapshot_count'], new_snapshot,
+            quota.snapshot_count))
+    return failures
+
 
 def check_over_instance_quota(
         username, identity_uuid, esh_size=None,
@@ -39,7 +184,6 @@ def check_over_instance_quota(
         membership = memberships_available.first()
     identity = membership.identity
     quota = identity.quota
-    driver = get_cached_driver(identity=identity)
     new_port = new_floating_ip = new_instance = new_cpu = new_ram = 0
     if esh_size:
         new_cpu += esh_size.cpu
@@ -48,18 +192,18 @@ def check_over_instance_quota(
         new_port += 1
     if include_networking:
         new_floating_ip += 1
-    # Will throw ValidationError if false.
-    try:
-        has_cpu_quota(driver, quota, new_cpu)
-        has_mem_quota(driver, quota, new_ram)
-        has_instance_count_quota(driver, quota, new_instance)
-        has_floating_ip_count_quota(driver, quota, new_floating_ip)
-        has_port_count_quota(identity, driver, quota, new_port)
+    if not quota:
         return True
-    except ValidationError:
+    usage = get_quota_usage(identity, INSTANCE_USAGE)
+    failures = evaluate_instance_quota(
+        quota, usage, new_cpu=new_cpu, new_ram=new_ram,
+        new_instance=new_instance, new_floating_ip=new_floating_ip,
+        new_port=new_port)
+    if failures:
         if raise_exc:
-            raise
+            raise ValidationError("; ".join(failures))
         return False
+    return True
 
 
 def check_over_storage_quota(
@@ -82,7 +226,6 @@ def check_over_storage_quota(
         membership = memberships_available.first()
     identity = membership.identity
     quota = identity.quota
-    driver = get_cached_driver(identity=identity)
 
     # FIXME: I don't believe that 'snapshot' size and 'volume' size share
     # the same quota, so for now we ignore 'snapshot-size',
@@ -91,16 +234,17 @@ def check_over_storage_quota(
 
     new_disk = new_volume_size
     new_volume = 1 if new_volume_size > 0 else 0
-    # Will throw ValidationError if false.
-    try:
-        has_storage_quota(driver, quota, new_disk)
-        has_storage_count_quota(driver, quota, new_volume)
-        has_snapshot_count_quota(driver, quota, new_snapshot)
+    if not quota:
         return True
-    except ValidationError:
+    usage = get_quota_usage(identity, STORAGE_USAGE)
+    failures = evaluate_storage_quota(
+        quota, usage, new_disk=new_disk, new_volume=new_volume,
+        new_snapshot=new_snapshot)
+    if failures:
         if raise_exc:
-            raise
+            raise ValidationError("; ".join(failures))
         return False
+    return True
 
 
 def set_provider_quota(identity_uuid, quota=None, limit_dict=None):
@@ -13,6 +13,7 @@ from django.utils.timezone import datetime, timedelta
 from celery.decorators import task
 from celery.task import current
 from celery.result import allow_join_result
+from celery.exceptions import Ignore
 
 from rtwo.exceptions import LibcloudInvalidCredsError, LibcloudBadResponseError
 
@@ -29,6 +30,7 @@ from core.models.boot_script import get_scripts_for_instance
 from core.models.instance import Instance
 from core.models.identity import Identity
 from core.models.profile import UserProfile
+from core.models.provider import Provider
 
 from service.deploy import (
     instance_deploy, user_deploy,
@@ -36,10 +38,12 @@ from service.deploy import (
     ready_to_deploy as ansible_ready_to_deploy,
     run_utility_playbooks, execution_has_failures, execution_has_unreachable
     )
+from service import instance_poller
 from service.driver import get_driver, get_account_driver
 from service.exceptions import AnsibleDeployException
 from service.instance import _update_instance_metadata
 from service.networking import _generate_ssh_kwargs
+from service.tasks.accounts import clean_network_resources_for
 
 from service.mock import MockInstance
 
@@ -105,7 +109,22 @@ def wait_for_instance(
 
     status_query = "active" Match only one value, active
     status_query = ["active","suspended"] or match multiple values.
+
+    When settings.INSTANCE_POLLER_ENABLED, the instance is handed to the
+    batched poller (see service.instance_poller) instead: this task returns
+    right away and the poller applies its callbacks once the instance is
+    ready.
     """
+    if _use_instance_poller(instance_alias):
+        request = wait_for_instance.request
+        instance_poller.register_waiter(
+            _core_provider_id(instance_alias), request.id, instance_alias,
+            driverCls, provider, identity, status_query,
+            tasks_allowed=tasks_allowed, test_tmp_status=test_tmp_status,
+            return_id=return_id, callbacks=request.callbacks,
+            errbacks=request.errbacks, root_id=request.root_id)
+        # Do not apply the callbacks now, the poller will.
+        raise Ignore()
     try:
         celery_logger.debug("wait_for task started at %s." % datetime.now())
         driver = get_driver(driverCls, provider, identity)
@@ -124,6 +143,31 @@ def wait_for_instance(
         wait_for_instance.retry(exc=exc)
 
 
+def _core_provider_id(instance_alias):
+    return Instance.objects.filter(provider_alias=instance_alias).values_list(
+        'created_by_identity__provider_id', flat=True).first()
+
+
+def _use_instance_poller(instance_alias):
+    """
+    The poller can resume 'linked' callbacks of instances it can find the
+    provider of. Eager tasks and chains keep the retry loop.
+    """
+    request = wait_for_instance.request
+    if not getattr(settings, 'INSTANCE_POLLER_ENABLED', True) \
+            or request.is_eager or request.chain:
+        return False
+    return bool(_core_provider_id(instance_alias))
+
+
+@task(name="poll_waiting_instances", ignore_result=True)
+def poll_waiting_instances():
+    """
+    One tick of the batched readiness poller (see service.instance_poller)
+    """
+    instance_poller.poll_waiting_instances()
+
+
 def _eager_override(task_class, run_method, args, kwargs):
     attempts = 0
     delay = task_class.default_retry_delay or 30  # Seconds
@@ -319,11 +363,12 @@ def clear_empty_ips():
     if settings.DEBUG:
         celery_logger.debug("clear_empty_ips task SKIPPED at %s." % datetime.now())
         return
-    identities = current_openstack_identities()
-    for core_identity in identities:
+    # One listing per provider, instead of one clear_empty_ips_for per identity
+    for provider in Provider.get_active(type_name='openstack'):
         try:
-            # TODO: Add some
-            clear_empty_ips_for.apply_async(args=[core_identity.created_by.username,core_identity.provider.id, str(core_identity.uuid)])
+            clean_network_resources_for.apply_async(
+                args=[provider.id],
+                kwargs={'resources': ['floating_ips', 'instance_ips']})
         except Exception as exc:
             celery_logger.exception(exc)
     celery_logger.debug("clear_empty_ips task finished at %s." % datetime.now())
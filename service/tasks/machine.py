@@ -362,9 +362,10 @@ def validate_new_image(image_id, machine_request_id):
         celery_logger.warn(
             "Need to know the AccountProvider to auto-validate instance")
         return False
-    # Attempt to launch using the admin_driver
+    # Attempt to launch using the admin_driver (of the admin identity's
+    # user -- registered drivers are shared and must not be modified)
     user = admin_ident.created_by
-    admin_driver.identity.user = user
+    admin_driver = get_esh_driver(admin_ident)
     machine = admin_driver.get_machine(image_id)
     sorted_sizes = admin_driver.list_sizes()
     size_index = 0
@@ -1,4 +1,6 @@
+import time
 from datetime import timedelta
+from hashlib import md5
 
 from django.conf import settings
 from django.db.models import Q, Count
@@ -6,6 +8,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 
 from celery.decorators import task
+from celery.exceptions import SoftTimeLimitExceeded
 
 from core.plugins import MachineValidationPluginManager
 from core.query import (
@@ -29,12 +32,16 @@ from service.machine import (
     remove_membership
 )
 from service.monitoring import (
+    _bulk_reconcile_instances,
     _cleanup_missing_instances,
     _get_instance_owner_map,
     _get_identity_from_tenant_name,
-    allocation_source_overage_enforcement_for)
+    allocation_source_overage_enforcement_for,
+    fetch_provider_snapshot, list_cloud_machines, ProviderSnapshot)
 from service.driver import get_account_driver
-from service.cache import get_cached_driver
+from service.cache import (
+    get_cached_driver, get_cached_tenant_map, redis_connection,
+    _acquire_lock, _release_lock)
 from service.exceptions import TimeoutError
 from rtwo.models.size import OSSize
 from rtwo.exceptions import GlanceConflict, GlanceForbidden
@@ -73,16 +80,6 @@ def strfdate(datetime_o, fmt=None):
     return datetime_o.strftime(fmt)
 
 
-def tenant_id_to_name_map(account_driver):
-    """
-    INPUT: account driver
-    Get a list of projects
-    OUTPUT: A dictionary with keys of ID and values of name
-    """
-    all_projects = account_driver.list_projects()
-    return {tenant.id: tenant.name for tenant in all_projects}
-
-
 @task(name="prune_machines")
 def prune_machines():
     """
@@ -134,8 +131,10 @@ def prune_machines_for(
 
     # Loop 1 - End-date All machines in the DB that
     # can NOT be found in the cloud.
+    snapshot = ProviderSnapshot(provider)
+    snapshot.machines = cloud_machines
     mach_count = _end_date_missing_database_machines(
-        db_machines, cloud_machines, now=now, dry_run=dry_run)
+        db_machines, snapshot.images_by_id, now=now, dry_run=dry_run)
 
     # Loop 2 and 3 - Capture all (still-active) versions without machines,
     # and all applications without versions.
@@ -170,13 +169,68 @@ def monitor_machines():
         monitor_machines_for.apply_async(args=[p.id])
 
 
+MACHINES_SWEEP_KEY = "monitor_machines.full_sweep.{0}"
+
+
+def _image_members(account_driver, cloud_machine):
+    """
+    Project names the (non-public) image is shared with, None for public
+    images
+    """
+    image_visibility = cloud_machine.get('visibility', 'private')
+    if image_visibility.lower() == 'public':
+        return None
+    return sorted(
+        project.name
+        for project in account_driver.get_image_members(cloud_machine.id, None))
+
+
+def _image_fingerprint(cloud_machine, members):
+    """
+    Hash of everything about the cloud image that `monitor_machines_for`
+    syncs into the DB: updated_at (name/metadata), checksum, visibility,
+    owner and the list of members.
+    """
+    parts = [cloud_machine.get(key) or ''
+             for key in ('updated_at', 'checksum', 'visibility', 'owner',
+                         'application_owner')]
+    parts.append(",".join(members or []))
+    return md5("|".join(unicode(part) for part in parts)
+               .encode('utf-8')).hexdigest()
+
+
+def _machines_full_sweep_due(provider_id):
+    """
+    True once every MONITOR_MACHINES_FULL_SWEEP seconds: every image is
+    re-synced, fingerprint or not (DB-side changes like access lists do
+    not change the fingerprint).
+    """
+    sweep_every = getattr(settings, 'MONITOR_MACHINES_FULL_SWEEP', 24*60*60)
+    if not sweep_every:
+        return True
+    # The marker is set when the sweep starts, a failed sweep is retried
+    # with the next full sweep.
+    return bool(redis_connection().set(
+        MACHINES_SWEEP_KEY.format(provider_id), timezone.now().isoformat(),
+        nx=True, ex=sweep_every))
+
+
 @task(name="monitor_machines_for")
-def monitor_machines_for(provider_id, limit_machines=[], print_logs=False, dry_run=False, validate=True):
+def monitor_machines_for(provider_id, limit_machines=[], print_logs=False, dry_run=False, validate=True,
+                         cloud_machines=None, account_driver=None, full_sweep=None):
     """
     Run the set of tasks related to monitoring machines for a provider.
     Optionally, provide a list of usernames to monitor
     While debugging, print_logs=True can be very helpful.
     start_date and end_date allow you to search a 'non-standard' window of time.
+    `cloud_machines` (and `account_driver`) can be passed in when the images
+    have already been listed (see `monitor_resources_for`).
+
+    Images whose fingerprint (see `_image_fingerprint`) matches the one
+    stored on their (current) ProviderMachine are skipped, unless
+    `full_sweep` is True (Default: once every MONITOR_MACHINES_FULL_SWEEP
+    seconds, or when `limit_machines` is given).
+    Returns the machines that were synced.
 
     NEW LOGIC:
     """
@@ -185,23 +239,29 @@ def monitor_machines_for(provider_id, limit_machines=[], print_logs=False, dry_r
     if print_logs:
         console_handler = _init_stdout_logging()
 
-    account_driver = get_account_driver(provider)
+    if not account_driver:
+        account_driver = get_account_driver(provider)
     #Bail out if account driver is invalid
     if not account_driver:
         if print_logs:
             _exit_stdout_logging(console_handler)
         return []
 
-    if account_driver.user_manager.version == 2:
-        #Old providers need to use v1 glance to get owner information.
-        cloud_machines_dict = account_driver.image_manager.list_v1_images()
-        cloud_machines = account_driver.list_all_images()
-        account_driver.add_owner_to_machine(cloud_machines, cloud_machines_dict)
-    else:
-        cloud_machines = account_driver.list_all_images()
+    if cloud_machines is None:
+        cloud_machines = list_cloud_machines(account_driver)
 
     if limit_machines:
+        limit_machines = set(limit_machines)
         cloud_machines = [cm for cm in cloud_machines if cm.id in limit_machines]
+    if full_sweep is None:
+        full_sweep = bool(limit_machines) or _machines_full_sweep_due(provider_id)
+    known_fingerprints = {}
+    if not full_sweep:
+        known_fingerprints = dict(ProviderMachine.objects.filter(
+            only_current_source(), instance_source__provider=provider,
+        ).exclude(cloud_fingerprint='').values_list(
+            'instance_source__identifier', 'cloud_fingerprint'))
+    unchanged = 0
     db_machines = []
     # ASSERT: All non-end-dated machines in the DB can be found in the cloud
     # if you do not believe this is the case, you should call 'prune_machines_for'
@@ -209,12 +269,17 @@ def monitor_machines_for(provider_id, limit_machines=[], print_logs=False, dry_r
     for cloud_machine in cloud_machines:
         if validate and not machine_validator.machine_is_valid(cloud_machine):
             continue
+        members = _image_members(account_driver, cloud_machine)
+        fingerprint = _image_fingerprint(cloud_machine, members)
+        if known_fingerprints.get(cloud_machine.id) == fingerprint:
+            unchanged += 1
+            continue
         owner = cloud_machine.get('owner')
         if owner:
-            owner_project = account_driver.get_project_by_id(owner)
+            owner_project = account_driver.projects_by_id().get(owner)
         else:
             owner = cloud_machine.get('application_owner')
-            owner_project = account_driver.get_project(owner)
+            owner_project = account_driver.projects_by_name().get(owner)
         #STEP 1: Get the application, version, and provider_machine registered in Atmosphere
         (db_machine, created) = convert_glance_image(account_driver, cloud_machine, provider.uuid, owner_project)
         if not db_machine:
@@ -222,7 +287,8 @@ def monitor_machines_for(provider_id, limit_machines=[], print_logs=False, dry_r
         db_machines.append(db_machine)
         #STEP 2: For any private cloud_machine, convert the 'shared users' as known by cloud
         #        into DB relationships: ApplicationVersionMembership, ProviderMachineMembership
-        update_image_membership(account_driver, cloud_machine, db_machine)
+        update_image_membership(account_driver, cloud_machine, db_machine,
+                                existing_members=members)
 
         #STEP 3: if ENFORCING -- occasionally 're-distribute' any ACLs that are *listed on DB but not on cloud* -- removals should be done explicitly, outside of this function
         if settings.ENFORCING:
@@ -233,6 +299,13 @@ def monitor_machines_for(provider_id, limit_machines=[], print_logs=False, dry_r
         # 2) We will never 'remove' a public or private flag as listed in application.
         # 2b) Future: Individual versions/machines as described by relationships above dictate whats shown in the application.
 
+        ProviderMachine.objects.filter(id=db_machine.id).update(
+            cloud_fingerprint=fingerprint)
+
+    celery_logger.info(
+        "monitor_machines_for(%s): %s images synced, %s unchanged%s"
+        % (provider, len(db_machines), unchanged,
+           " (full sweep)" if full_sweep else ""))
     if print_logs:
         _exit_stdout_logging(console_handler)
     return db_machines
@@ -256,9 +329,11 @@ def distribute_image_membership(account_driver, cloud_machine, provider):
     return groups
 
 
-def _get_all_access_list(account_driver, db_machine, cloud_machine):
+def _get_all_access_list(account_driver, db_machine, cloud_machine,
+                         existing_members=None):
     """
     Input: AccountDriver, ProviderMachine, glance_image
+    (and the names of the projects the image is shared with, when known)
     Output: A list of _all project names_ that should be included on `cloud_machine`
 
     This list will include:
@@ -284,9 +359,11 @@ def _get_all_access_list(account_driver, db_machine, cloud_machine):
     else:
        raise ValueError("Unexpected cloud_machine: %s" % cloud_machine)
 
-    existing_members = account_driver.get_image_members(image_id, None)
+    if existing_members is None:
+        existing_members = [
+            p.name for p in account_driver.get_image_members(image_id, None)]
     # Extend to include based on projects already granted access to the image
-    cloud_shared_set = { p.name for p in existing_members }
+    cloud_shared_set = set(existing_members)
 
     # Deprecation warning: Now that we use a script to do replication,
     # we should not need to account for shares on another provider.
@@ -318,7 +395,8 @@ def _get_all_access_list(account_driver, db_machine, cloud_machine):
     return shared_project_names
 
 
-def update_image_membership(account_driver, cloud_machine, db_machine):
+def update_image_membership(account_driver, cloud_machine, db_machine,
+                            existing_members=None):
     """
     Given a cloud_machine and db_machine, create any relationships possible for ProviderMachineMembership and ApplicationVersionMembership
     Return a list of all group names who have been given share access.
@@ -326,7 +404,8 @@ def update_image_membership(account_driver, cloud_machine, db_machine):
     image_visibility = cloud_machine.get('visibility','private')
     if image_visibility.lower() == 'public':
         return
-    shared_project_names = _get_all_access_list(account_driver, db_machine, cloud_machine)
+    shared_project_names = _get_all_access_list(
+        account_driver, db_machine, cloud_machine, existing_members)
 
     #Future-FIXME: This logic expects project_name == Group.name
     #       When this changes, logic should update to include checks for:
@@ -395,12 +474,14 @@ def remove_machine(db_machine, now_time=None, dry_run=False):
     return True
 
 
-def make_machines_private(application, identities, account_drivers={}, provider_tenant_mapping={}, image_maps={}, dry_run=False):
+def make_machines_private(application, identities, account_drivers={}, provider_tenant_mapping=None, image_maps={}, dry_run=False):
     """
     This method is called when the DB has marked the Machine/Application as PUBLIC
     But the CLOUD states that the machine is really private.
     GOAL: All versions and machines will be listed as PRIVATE on the cloud and include AS MANY identities as exist.
     """
+    if provider_tenant_mapping is None:
+        provider_tenant_mapping = {}
     for version in application.active_versions():
         for machine in version.active_machines():
             # For each *active* machine in app/version..
@@ -444,10 +525,15 @@ def memoized_driver(machine, account_drivers={}):
         account_drivers[provider] = account_driver
     return account_driver
 
-def memoized_tenant_name_map(account_driver, tenant_list_maps={}):
+def memoized_tenant_name_map(account_driver, tenant_list_maps=None):
+    # Remember the map for one call of `make_machines_private` only: it is
+    # cached (with a TTL) by `get_cached_tenant_map`
+    if tenant_list_maps is None:
+        tenant_list_maps = {}
     tenant_id_name_map = tenant_list_maps.get(account_driver.core_provider)
     if not tenant_id_name_map:
-        tenant_id_name_map = tenant_id_to_name_map(account_driver)
+        tenant_id_name_map = get_cached_tenant_map(
+            account_driver.core_provider, account_driver=account_driver)
         tenant_list_maps[account_driver.core_provider] = tenant_id_name_map
 
     return tenant_id_name_map
@@ -544,32 +630,119 @@ def make_machines_public(application, account_drivers={}, dry_run=False):
         application.save()
 
 
+MONITOR_LOCK_KEY = "monitor_resources.{0}"
+
+
+def _monitor_deadline():
+    return getattr(settings, 'MONITOR_PROVIDER_DEADLINE', 600)
+
+
 @task(name="monitor_resources")
 def monitor_resources():
     """
-    Update instances for each active provider.
+    Update instances, machines, sizes and volumes for each active provider.
+    Runs that are still queued after the provider deadline are dropped, and
+    runs still going at the deadline are interrupted (while the step in
+    progress still holds the provider's lock).
     """
+    deadline = _monitor_deadline()
     for p in Provider.get_active():
-        monitor_resources_for.apply_async(args=[p.id])
+        monitor_resources_for.apply_async(
+            args=[p.id], expires=deadline, soft_time_limit=deadline)
 
 
 @task(name="monitor_resources_for")
-def monitor_resources_for(provider_id, users=None, print_logs=False):
+def monitor_resources_for(provider_id, users=None, print_logs=False,
+                          deadline=None):
     """
     Run the set of tasks related to monitoring all cloud resources for a provider.
+
+    The servers, volumes, images, sizes and projects of the provider are
+    listed once (see `fetch_provider_snapshot`), and shared by
+    the instances -> sizes -> volumes -> machines steps.
+    * A run is skipped while another run for the provider holds its lock
+      (held for `deadline` seconds: `monitor_resources` sets a matching
+      soft time limit).
+    * Steps that would start after `deadline` seconds
+      (Default: settings.MONITOR_PROVIDER_DEADLINE), or whose listing
+      failed, are skipped.
+    Returns a report of the results and timings (in seconds) of each step.
     """
-    resources = {}
-    sizes = monitor_sizes_for(provider_id, print_logs=print_logs)
-    volumes = monitor_volumes_for(provider_id, print_logs=print_logs)
-    machines = monitor_machines_for(provider_id, print_logs=print_logs)
-    instances = monitor_instances_for(provider_id, users=users, print_logs=print_logs)
-    resources.update({
-        'instances': instances,
-        'machines': machines,
-        'sizes': sizes,
-        'volumes': volumes,
-    })
-    return resources
+    if deadline is None:
+        deadline = _monitor_deadline()
+    started = time.time()
+    ends_at = started + deadline
+    report = {
+        'provider': provider_id,
+        'skipped': False,
+        'timings': {},
+        'results': {},
+        'errors': {},
+    }
+    r = redis_connection()
+    lock_key = MONITOR_LOCK_KEY.format(provider_id)
+    token = _acquire_lock(r, lock_key, deadline)
+    if not token:
+        celery_logger.info(
+            "Skipping monitor_resources_for(%s) - A previous run "
+            "is still in progress" % provider_id)
+        report['skipped'] = True
+        return report
+    try:
+        provider = Provider.objects.get(id=provider_id)
+        account_driver = get_account_driver(provider)
+        if not account_driver:
+            report['errors']['snapshot'] = "Invalid account driver"
+            return report
+        snapshot = fetch_provider_snapshot(provider, ends_at)
+        report['errors'].update(snapshot.errors)
+        report['timings'].update(
+            ("list_%s" % listing, seconds)
+            for listing, seconds in snapshot.timings.items())
+        steps = [
+            ('instances', ('instances', 'tenant_map'),
+             lambda: monitor_instances_for(
+                provider_id, users=users, print_logs=print_logs,
+                instances_by_tenant=snapshot.instances_by_tenant,
+                tenant_map=snapshot.tenant_map)),
+            ('sizes', ('sizes',), lambda: len(monitor_sizes_for(
+                provider_id, print_logs=print_logs,
+                cloud_sizes=snapshot.sizes))),
+            ('volumes', ('volumes',), lambda: len(monitor_volumes_for(
+                provider_id, print_logs=print_logs,
+                cloud_volumes=snapshot.volumes,
+                account_driver=account_driver))),
+            ('machines', ('machines',), lambda: len(monitor_machines_for(
+                provider_id, print_logs=print_logs,
+                cloud_machines=snapshot.machines,
+                account_driver=account_driver))),
+        ]
+        for step, listings, run_step in steps:
+            missing = [listing for listing in listings
+                       if getattr(snapshot, listing) is None]
+            if missing:
+                report['errors'].setdefault(
+                    step, "Missing listing: %s" % ", ".join(missing))
+                continue
+            if time.time() >= ends_at:
+                report['errors'][step] = "Deadline exceeded"
+                continue
+            step_start = time.time()
+            try:
+                report['results'][step] = run_step()
+            except SoftTimeLimitExceeded:
+                report['errors'][step] = "Deadline exceeded"
+            except Exception as exc:
+                celery_logger.exception(
+                    "monitor_resources_for(%s) - %s failed"
+                    % (provider_id, step))
+                report['errors'][step] = str(exc)
+            report['timings'][step] = time.time() - step_start
+    finally:
+        _release_lock(r, lock_key, token)
+    report['timings']['total'] = time.time() - started
+    celery_logger.info("monitor_resources_for(%s): %s" % (provider_id, report))
+    return report
 
 
 @task(name="monitor_instances")
@@ -581,6 +754,17 @@ def monitor_instances():
         monitor_instances_for.apply_async(args=[p.id])
 
 
+@task(name="update_usage_rollups")
+def update_usage_rollups():
+    """
+    Fold the latest instance usage into the hourly/daily usage rollups.
+    """
+    from core.metrics import rollup
+    start_date, end_date, updated = rollup.update_usage_rollups()
+    celery_logger.info("Usage rollups from %s to %s: %s rows updated"
+                       % (start_date, end_date, updated))
+
+
 @task(name="monitor_allocation_sources")
 def monitor_allocation_sources(usernames=()):
     """
@@ -622,22 +806,39 @@ def allocation_source_overage_enforcement_for_user(allocation_source, user):
 
 @task(name="monitor_instances_for")
 def monitor_instances_for(provider_id, users=None,
-                          print_logs=False, start_date=None, end_date=None):
+                          print_logs=False, start_date=None, end_date=None,
+                          bulk=None, cloud_instances=None, tenant_map=None,
+                          instances_by_tenant=None):
     """
     Run the set of tasks related to monitoring instances for a provider.
     Optionally, provide a list of usernames to monitor
     While debugging, print_logs=True can be very helpful.
     start_date and end_date allow you to search a 'non-standard' window of time.
+    bulk=True reconciles the whole provider with a handful of set-based
+    queries (see `_bulk_reconcile_instances`) and returns its report.
+    Defaults to settings.MONITOR_INSTANCES_IN_BULK.
+    `cloud_instances` (or `instances_by_tenant`) and `tenant_map` can be
+    passed in when they have already been listed
+    (see `monitor_resources_for`).
     """
     provider = Provider.objects.get(id=provider_id)
 
     # For now, lets just ignore everything that isn't openstack.
     if 'openstack' not in provider.type.name.lower():
         return
-    instance_map = _get_instance_owner_map(provider, users=users)
+    instance_map = _get_instance_owner_map(
+        provider, users=users, all_instances=cloud_instances,
+        tenant_map=tenant_map, instances_by_tenant=instances_by_tenant)
 
     if print_logs:
         console_handler = _init_stdout_logging()
+    if bulk is None:
+        bulk = getattr(settings, 'MONITOR_INSTANCES_IN_BULK', False)
+    if bulk:
+        report = _bulk_reconcile_instances(provider, instance_map)
+        if print_logs:
+            _exit_stdout_logging(console_handler)
+        return report
     seen_instances = []
     # DEVNOTE: Potential slowdown running multiple functions
     # Break this out when instance-caching is enabled
@@ -685,12 +886,15 @@ def monitor_volumes():
         monitor_volumes_for.apply_async(args=[p.id])
 
 @task(name="monitor_volumes_for")
-def monitor_volumes_for(provider_id, print_logs=False):
+def monitor_volumes_for(provider_id, print_logs=False,
+                        cloud_volumes=None, account_driver=None):
     """
     Run the set of tasks related to monitoring sizes for a provider.
     Optionally, provide a list of usernames to monitor
     While debugging, print_logs=True can be very helpful.
     start_date and end_date allow you to search a 'non-standard' window of time.
+    `cloud_volumes` (and `account_driver`) can be passed in when the volumes
+    have already been listed (see `monitor_resources_for`).
     """
     from service.driver import get_account_driver
     from core.models import Identity
@@ -698,10 +902,13 @@ def monitor_volumes_for(provider_id, print_logs=False):
         console_handler = _init_stdout_logging()
 
     provider = Provider.objects.get(id=provider_id)
-    account_driver = get_account_driver(provider)
+    if not account_driver:
+        account_driver = get_account_driver(provider)
     # Non-End dated volumes on this provider
     db_volumes = Volume.objects.filter(only_current_source(), instance_source__provider=provider)
-    all_volumes = account_driver.admin_driver.list_all_volumes(timeout=30)
+    if cloud_volumes is None:
+        cloud_volumes = account_driver.admin_driver.list_all_volumes(timeout=30)
+    all_volumes = cloud_volumes
     seen_volumes = []
     for cloud_volume in all_volumes:
         try:
@@ -751,12 +958,14 @@ def monitor_sizes():
 
 
 @task(name="monitor_sizes_for")
-def monitor_sizes_for(provider_id, print_logs=False):
+def monitor_sizes_for(provider_id, print_logs=False, cloud_sizes=None):
     """
     Run the set of tasks related to monitoring sizes for a provider.
     Optionally, provide a list of usernames to monitor
     While debugging, print_logs=True can be very helpful.
     start_date and end_date allow you to search a 'non-standard' window of time.
+    `cloud_sizes` can be passed in when the sizes have already been listed
+    (see `monitor_resources_for`).
     """
     from service.driver import get_admin_driver
 
@@ -767,7 +976,9 @@ def monitor_sizes_for(provider_id, print_logs=False):
     admin_driver = get_admin_driver(provider)
     # Non-End dated sizes on this provider
     db_sizes = Size.objects.filter(only_current(), provider=provider)
-    all_sizes = admin_driver.list_sizes()
+    all_sizes = cloud_sizes
+    if all_sizes is None:
+        all_sizes = admin_driver.list_sizes()
     seen_sizes = []
     for cloud_size in all_sizes:
         core_size = convert_esh_size(cloud_size, provider.uuid)
@@ -866,14 +1077,16 @@ def _clean_memberships(db_machines, acct_driver=None):
             remove_membership(image_version, member.group, acct_driver)
 
 
-def _end_date_missing_database_machines(db_machines, cloud_machines, now=None, dry_run=False):
+def _end_date_missing_database_machines(db_machines, images_by_id, now=None, dry_run=False):
+    """
+    End-date the `db_machines` whose image is not in `images_by_id`
+    (see `ProviderSnapshot.images_by_id`)
+    """
     if not now:
         now = timezone.now()
     mach_count = 0
-    cloud_machine_ids = [mach.id for mach in cloud_machines]
     for machine in db_machines:
-        cloud_match = [mach for mach in cloud_machine_ids if mach == machine.identifier]
-        if not cloud_match:
+        if machine.identifier not in images_by_id:
             remove_machine(machine, now, dry_run=dry_run)
             mach_count += 1
     return mach_count
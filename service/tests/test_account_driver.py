@@ -0,0 +1,51 @@
+import mock
+from django.test import TestCase
+
+from service.accounts.openstack_manager import AccountDriver
+
+
+@mock.patch.multiple(
+    AccountDriver,
+    _init_by_provider=mock.Mock(return_value={'location': 'test-provider'}),
+    _build_user_creds=mock.Mock(return_value={}),
+    _build_image_creds=mock.Mock(return_value={}),
+    _build_network_creds=mock.Mock(return_value={}),
+    _build_sdk_creds=mock.Mock(return_value={}),
+    _initialize_loggers=mock.Mock())
+@mock.patch('service.accounts.openstack_manager.UserManager')
+class AccountDriverTest(TestCase):
+
+    def test_managers_built_on_first_use(self, user_manager_cls):
+        accounts = AccountDriver(None)
+        self.assertFalse(user_manager_cls.called)
+        accounts.user_manager
+        accounts.user_manager
+        self.assertEqual(user_manager_cls.call_count, 1)
+        accounts.refresh_managers()
+        accounts.user_manager
+        self.assertEqual(user_manager_cls.call_count, 2)
+
+    def test_project_list_cache(self, user_manager_cls):
+        list_projects = user_manager_cls.return_value.list_projects
+        list_projects.return_value = ['project']
+        accounts = AccountDriver(None)
+        self.assertEqual(accounts.list_projects(), ['project'])
+        self.assertEqual(accounts.list_projects(), ['project'])
+        self.assertEqual(list_projects.call_count, 1)
+        accounts.list_projects(force=True)
+        accounts.clear_local_cache()
+        accounts.list_projects()
+        self.assertEqual(list_projects.call_count, 3)
+
+    def test_project_indexes(self, user_manager_cls):
+        list_projects = user_manager_cls.return_value.list_projects
+        project = mock.Mock(id='id-1')
+        project.name = 'user1'
+        list_projects.return_value = [project]
+        accounts = AccountDriver(None)
+        self.assertEqual(accounts.projects_by_id(), {'id-1': project})
+        self.assertEqual(accounts.projects_by_name(), {'user1': project})
+        self.assertIs(accounts.projects_by_id(), accounts.projects_by_id())
+        list_projects.return_value = []
+        accounts.list_projects(force=True)
+        self.assertEqual(accounts.projects_by_name(), {})
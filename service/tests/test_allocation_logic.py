@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+import pytz
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import TestCase
+from django.utils import timezone
+
+from api.tests.factories import (
+    UserFactory, ProviderFactory, IdentityFactory, ProviderMachineFactory,
+    InstanceFactory, InstanceHistoryFactory, InstanceStatusFactory,
+    AllocationSourceFactory)
+from core.models import EventTable, Instance
+from service.allocation_logic import (
+    get_all_histories_for_instance, get_allocation_source_name_from_event,
+    get_initial_allocation_source_names)
+
+
+def baseline_histories(instances, report_start_date, report_end_date):
+    """
+    The per-instance queries `get_all_histories_for_instance` replaced
+    """
+    return dict(
+        (instance.provider_alias, list(
+            instance.instancestatushistory_set.filter(
+                ~Q(start_date__gte=report_end_date) &
+                ~Q(Q(end_date__isnull=False) &
+                   Q(end_date__lte=report_start_date))
+            ).order_by('start_date')))
+        for instance in instances)
+
+
+class InitialAllocationSourceTest(TestCase):
+
+    def setUp(self):
+        now = timezone.now().replace(microsecond=0)
+        self.start = now - timedelta(days=10)
+        self.end = now - timedelta(days=1)
+        self.user = UserFactory.create(username='test-username')
+        self.other_user = UserFactory.create(username='other-username')
+        self.identity = IdentityFactory.create_identity(
+            created_by=self.user, provider=ProviderFactory.create())
+        self.machine = ProviderMachineFactory.create_provider_machine(
+            self.user, self.identity)
+        self.active = InstanceStatusFactory.create(name='active')
+        self.suspended = InstanceStatusFactory.create(name='suspended')
+        self.source_a = AllocationSourceFactory.create(
+            name='TG-A', compute_allowed=1000)
+        self.source_b = AllocationSourceFactory.create(
+            name='TG-B', compute_allowed=1000)
+
+        # Assigned (twice) before the report starts
+        pre_report = self._create_instance(
+            'pre-report', [(-2, 1 / 24.0), (1 / 24.0, None)])
+        self._assign(pre_report, self.source_a, days=-3)
+        self._assign(pre_report, self.source_b, days=-1)
+        self._assign(pre_report, self.source_a, days=-0.5,
+                     user=self.other_user)
+        # Assigned after the report starts, before the instance does
+        in_report = self._create_instance('in-report', [(1, None)])
+        self._assign(in_report, self.source_a, days=0.5)
+        self._assign(in_report, self.source_b, days=2)
+        # Assigned by allocation source id
+        by_id = self._create_instance('by-id', [(-1, None)])
+        EventTable.objects.bulk_create([EventTable(
+            name='instance_allocation_source_changed',
+            entity_id=self.user.username,
+            payload={'instance_id': by_id.provider_alias,
+                     'allocation_source_id': str(self.source_a.uuid)},
+            timestamp=self.start - timedelta(days=2))])
+        # Never assigned
+        self._create_instance('no-events', [(-1, None)])
+        # No history in the report window
+        old = self._create_instance('old', [(-5, -4)])
+        self._assign(old, self.source_a, days=-6)
+
+        self.instances = Instance.objects.filter(
+            created_by=self.user).order_by('id')
+
+    def _create_instance(self, name, history_days):
+        instance = InstanceFactory.create(
+            name=name, provider_alias=str(uuid.uuid4()),
+            source=self.machine.instance_source, created_by=self.user,
+            created_by_identity=self.identity,
+            start_date=self.start + timedelta(days=history_days[0][0]))
+        for idx, (start_day, end_day) in enumerate(history_days):
+            InstanceHistoryFactory.create(
+                status=self.active if idx % 2 == 0 else self.suspended,
+                instance=instance,
+                start_date=self.start + timedelta(days=start_day),
+                end_date=self.start + timedelta(days=end_day)
+                if end_day is not None else None)
+        return instance
+
+    def _assign(self, instance, allocation_source, days, user=None):
+        EventTable.objects.create(
+            name='instance_allocation_source_changed',
+            entity_id=(user or self.user).username,
+            payload={'instance_id': instance.provider_alias,
+                     'allocation_source_name': allocation_source.name},
+            timestamp=self.start + timedelta(days=days))
+
+    def _aliases(self, names):
+        return dict((instance.name, instance.provider_alias)
+                    for instance in self.instances
+                    if instance.name in names)
+
+    def test_histories_match_baseline(self):
+        histories = get_all_histories_for_instance(
+            self.instances, self.start, self.end)
+        self.assertEqual(
+            histories,
+            baseline_histories(self.instances, self.start, self.end))
+        self.assertEqual(histories[self._aliases(['old'])['old']], [])
+
+    def test_initial_sources_match_baseline(self):
+        histories = get_all_histories_for_instance(
+            self.instances, self.start, self.end)
+        source_names = get_initial_allocation_source_names(
+            histories, self.start)
+        expected = dict(
+            (instance_id, get_allocation_source_name_from_event(
+                instance_histories[0].instance.created_by.username,
+                self.start, instance_id, instance_histories[0].start_date))
+            for instance_id, instance_histories in histories.items()
+            if instance_histories)
+        self.assertEqual(source_names, expected)
+        aliases = self._aliases(
+            ['pre-report', 'in-report', 'by-id', 'no-events'])
+        self.assertEqual(
+            source_names,
+            {aliases['pre-report']: 'TG-B', aliases['in-report']: 'TG-A',
+             aliases['by-id']: 'TG-A', aliases['no-events']: False})
+
+
+class ExportAllocationReportTest(TestCase):
+
+    def setUp(self):
+        user = UserFactory.create(username='test-username')
+        identity = IdentityFactory.create_identity(
+            created_by=user, provider=ProviderFactory.create())
+        machine = ProviderMachineFactory.create_provider_machine(
+            user, identity)
+        start_date = datetime(2017, 1, 2, tzinfo=pytz.utc)
+        instance = InstanceFactory.create(
+            name="Instance", provider_alias=str(uuid.uuid4()),
+            source=machine.instance_source, created_by=user,
+            created_by_identity=identity, start_date=start_date)
+        InstanceHistoryFactory.create(
+            status=InstanceStatusFactory.create(name='active'),
+            instance=instance, start_date=start_date,
+            end_date=start_date + timedelta(days=1))
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'report.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export_naive_dates(self):
+        call_command('export_allocation_report', '2017-01-01',
+                     end_date='2017-01-10', file_format='ndjson',
+                     output=self.output)
+        with open(self.output) as report_file:
+            rows = [json.loads(line) for line in report_file]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['username'], 'test-username')
+        self.assertEqual(rows[0]['applicable_duration'], 86400.0)
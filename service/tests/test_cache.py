@@ -0,0 +1,117 @@
+import time
+
+import mock
+import redis
+from django.test import TestCase, override_settings
+
+from service import cache
+
+
+class FakeRedis(object):
+    """
+    The redis commands used by service.cache (RELEASE_LOCK_SCRIPT is
+    the only script run with `eval`)
+    """
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+    def exists(self, key):
+        return key in self.values
+
+    def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+
+    def eval(self, script, numkeys, key, token):
+        assert script == cache.RELEASE_LOCK_SCRIPT
+        if self.values.get(key) == token:
+            return self.delete(key)
+        return 0
+
+
+@override_settings(CLOUD_CACHE_TTL={'default': 30})
+class CachedValueTest(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('service.cache.redis_connection',
+                             return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data_method = mock.Mock(return_value=['fresh'])
+
+    def _get_cached(self):
+        return cache._get_cached('instances.1', self.data_method,
+                                 lambda data: None)
+
+    def _store_stale(self):
+        with mock.patch('service.cache.time.time',
+                        return_value=time.time() - 60):
+            self.redis.values['instances.1'] = cache._dumps(['stale'])
+
+    def test_release_lock(self):
+        token = cache._acquire_lock(self.redis, 'instances.1', 30)
+        self.assertIsNone(cache._acquire_lock(self.redis, 'instances.1', 30))
+        # Only the holder of the lock releases it
+        cache._release_lock(self.redis, 'instances.1', 'other-token')
+        self.assertTrue(self.redis.exists('instances.1.lock'))
+        cache._release_lock(self.redis, 'instances.1', token)
+        self.assertFalse(self.redis.exists('instances.1.lock'))
+
+    def test_miss_and_hit(self):
+        self.assertEqual(self._get_cached(), ['fresh'])
+        self.assertEqual(self._get_cached(), ['fresh'])
+        self.assertEqual(self.data_method.call_count, 1)
+        self.assertFalse(self.redis.exists('instances.1.lock'))
+
+    def test_stale_value_refreshed(self):
+        self._store_stale()
+        self.assertEqual(self._get_cached(), ['fresh'])
+        self.assertEqual(self.data_method.call_count, 1)
+        self.assertFalse(self.redis.exists('instances.1.lock'))
+        self.assertEqual(self._get_cached(), ['fresh'])
+        self.assertEqual(self.data_method.call_count, 1)
+
+    def test_stale_value_while_refreshing(self):
+        self._store_stale()
+        cache._acquire_lock(self.redis, 'instances.1', 30)
+        self.assertEqual(self._get_cached(), ['stale'])
+        self.assertFalse(self.data_method.called)
+
+    def test_failed_refresh_serves_stale_value(self):
+        self._store_stale()
+        self.data_method.side_effect = Exception("Nova is down")
+        self.assertEqual(self._get_cached(), ['stale'])
+        self.assertFalse(self.redis.exists('instances.1.lock'))
+
+    def test_redis_error_after_get(self):
+        with mock.patch.object(self.redis, 'set',
+                               side_effect=redis.exceptions.ResponseError):
+            self.assertEqual(self._get_cached(), ['fresh'])
+        self.assertEqual(self.data_method.call_count, 1)
+
+
+class CachedDriverTest(TestCase):
+    @mock.patch('service.cache.get_esh_driver')
+    @mock.patch('service.cache.driver_registry')
+    def test_drivers_come_from_registry(self, registry, get_esh_driver):
+        identity = mock.Mock(id=1)
+        identity.created_by.username = 'user1'
+        self.assertIs(cache.get_cached_driver(identity=identity),
+                      get_esh_driver.return_value)
+        self.assertFalse(registry.invalidate.called)
+        cache.get_cached_driver(identity=identity, force=True)
+        registry.invalidate.assert_called_once_with('esh', (1, 'user1'))
+        self.assertEqual(get_esh_driver.call_count, 2)
@@ -0,0 +1,44 @@
+import threading
+
+import mock
+from django.test import TestCase, override_settings
+
+from service.driver import DriverRegistry
+
+
+class DriverRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = DriverRegistry()
+        self.create_driver = mock.Mock(side_effect=lambda: object())
+
+    def _get(self, key='identity-1', fingerprint='creds-1'):
+        return self.registry.get(
+            'esh', key, fingerprint, self.create_driver)
+
+    def test_reuse(self):
+        driver = self._get()
+        self.assertIs(self._get(), driver)
+        # Other threads share the driver
+        drivers = []
+        thread = threading.Thread(target=lambda: drivers.append(self._get()))
+        thread.start()
+        thread.join()
+        self.assertEqual(drivers, [driver])
+        self.assertEqual(self.create_driver.call_count, 1)
+        self.assertEqual(self.registry.stats()['reused'], 2)
+
+    def test_credential_change(self):
+        driver = self._get()
+        new_driver = self._get(fingerprint='creds-2')
+        self.assertIsNot(new_driver, driver)
+        self.assertIs(self._get(fingerprint='creds-2'), new_driver)
+        self.assertEqual(self.registry.stats()['credentials_changed'], 1)
+
+    def test_expiry(self):
+        driver = self._get()
+        with override_settings(DRIVER_REGISTRY_MAX_AGE=0):
+            # Requesting another driver evicts the expired one
+            self._get(key='identity-2')
+            self.assertEqual(self.registry.stats()['registered'], 1)
+            self.assertIsNot(self._get(), driver)
+        self.assertEqual(self.create_driver.call_count, 3)
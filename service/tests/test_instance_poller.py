@@ -0,0 +1,112 @@
+import mock
+from celery.decorators import task
+from django.test import TestCase
+
+from service import instance_poller
+from service.exceptions import TimeoutError
+
+timeouts = []
+
+
+@task(name="test_instance_poller_errback")
+def record_timeout(task_request, *args):
+    """
+    New-style errback, with the signature of
+    service.tasks.machine.machine_request_error
+    """
+    timeouts.append((task_request.id, args[0], args[2]))
+
+
+class FakeRedis(object):
+    def __init__(self):
+        self.hashes = {}
+        self.sets = {}
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hvals(self, key):
+        return list(self.hashes.get(key, {}).values())
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member)
+
+
+class FakeInstance(object):
+    def __init__(self, alias, status):
+        self.id = alias
+        self.status = status
+
+
+def _is_ready(instance, status_query, *args):
+    if instance.status != status_query:
+        raise Exception("Instance Not Ready")
+    return True
+
+
+@mock.patch('service.tasks.driver._is_instance_ready', side_effect=_is_ready)
+@mock.patch('service.instance_poller.Provider')
+@mock.patch('service.instance_poller.signature')
+class InstancePollerTest(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('service.instance_poller.redis_connection',
+                             return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for alias in ('ready', 'building'):
+            instance_poller.register_waiter(
+                1, 'task-%s' % alias, alias, None, None, None, 'active',
+                callbacks=['callback-%s' % alias],
+                errbacks=[record_timeout.s('request-%s' % alias)])
+
+    def _poll(self, now_time):
+        instances = [FakeInstance('ready', 'active'),
+                     FakeInstance('building', 'build')]
+        with mock.patch('service.monitoring._list_provider_instances',
+                        return_value=instances) as listing:
+            remaining = instance_poller.poll_provider(1, now_time=now_time)
+        return remaining, listing
+
+    def test_one_listing_per_tick(self, signature, *args):
+        now_time = self._started()
+        remaining, listing = self._poll(now_time)
+        self.assertEqual(remaining, 1)
+        self.assertEqual(listing.call_count, 1)
+        signature.assert_called_once_with('callback-ready')
+        signature.return_value.apply_async.assert_called_once_with((True,))
+        # Not due yet: backing off
+        remaining, listing = self._poll(now_time + 1)
+        self.assertEqual(remaining, 1)
+        self.assertFalse(listing.called)
+
+    def test_give_up(self, signature, *args):
+        del timeouts[:]
+        now_time = self._started() + instance_poller._setting(
+            'INSTANCE_POLLER_TIMEOUT', 250 * 15) + 1
+        backend = instance_poller.current_app.backend
+        with mock.patch.object(backend, 'store_result') as store_result:
+            remaining, _ = self._poll(now_time)
+        self.assertEqual(remaining, 0)
+        self.assertEqual(len(timeouts), 1)
+        task_id, exc, request_arg = timeouts[0]
+        self.assertEqual(task_id, 'task-building')
+        self.assertIsInstance(exc, TimeoutError)
+        self.assertEqual(request_arg, 'request-building')
+        # The task's result is a failure (for AsyncResult-based errbacks)
+        self.assertEqual(store_result.call_args[0][0], 'task-building')
+
+    def test_next_delay(self, *args):
+        delays = [instance_poller._next_delay(attempts)
+                  for attempts in range(20)]
+        self.assertEqual(delays, sorted(delays))
+        self.assertEqual(delays[-1], instance_poller._setting(
+            'INSTANCE_POLLER_MAX_DELAY', 60))
+
+    def _started(self):
+        return min(waiter['started'] for waiter in map(
+            instance_poller.pickle.loads,
+            self.redis.hvals(instance_poller.WAITING_KEY.format(1))))
@@ -0,0 +1,357 @@
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+import mock
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from api.tests.factories import (
+    UserFactory, ProviderFactory, ProviderTypeFactory, IdentityFactory,
+    ProviderMachineFactory, InstanceFactory, InstanceHistoryFactory,
+    InstanceStatusFactory, SizeFactory)
+from core.models import (
+    Credential, Instance, InstanceStatusHistory, ProviderMachine)
+from service.tasks.monitoring import (
+    MACHINES_SWEEP_KEY, monitor_instances_for, monitor_machines_for,
+    monitor_resources_for)
+from service.monitoring import (
+    _convert_tenant_id_to_names, _get_instance_owner_map,
+    _make_instance_owner_map, _make_tenant_owner_map, fetch_provider_snapshot,
+    ProviderSnapshot)
+
+Tenant = namedtuple('Tenant', ['id', 'name'])
+
+
+class FakeInstance(object):
+    def __init__(self, alias, owner):
+        self.alias = alias
+        self.owner = owner
+
+
+class TenantOwnerMapTest(TestCase):
+    def setUp(self):
+        self.tenants = [Tenant('id-%s' % idx, 'user%s' % idx) for idx in range(5)]
+        self.instances = [FakeInstance('instance-%s' % idx, 'id-%s' % (idx % 6)) for idx in range(12)]
+
+    def test_convert_tenant_id_to_names(self):
+        instances = _convert_tenant_id_to_names(self.instances, self.tenants)
+        self.assertEqual(
+            [instance.owner for instance in instances[:6]],
+            ['user0', 'user1', 'user2', 'user3', 'user4', 'id-5'])
+
+    def test_convert_tenant_id_to_names_with_dicts(self):
+        tenants = [{'id': tenant.id, 'name': tenant.name} for tenant in self.tenants]
+        instances = _convert_tenant_id_to_names(self.instances, tenants)
+        self.assertEqual(instances[7].owner, 'user1')
+
+    def test_convert_tenant_id_to_names_with_tenant_map(self):
+        instances = _convert_tenant_id_to_names(self.instances, {'id-2': 'user2'})
+        self.assertEqual(instances[2].owner, 'user2')
+        self.assertEqual(instances[3].owner, 'id-3')
+
+    def test_make_instance_owner_map(self):
+        instances = _convert_tenant_id_to_names(self.instances, self.tenants)
+        owner_map = _make_instance_owner_map(instances, users=['user1', 'id-5'])
+        self.assertEqual(sorted(owner_map.keys()), ['id-5', 'user1'])
+        self.assertEqual([instance.alias for instance in owner_map['user1']],
+                         ['instance-1', 'instance-7'])
+
+    def test_make_tenant_owner_map(self):
+        snapshot = ProviderSnapshot(mock.Mock())
+        for instance in self.instances:
+            instance.extra = {'tenantId': instance.owner}
+        snapshot.instances = self.instances
+        tenant_map = dict((tenant.id, tenant.name) for tenant in self.tenants)
+        owner_map = _make_tenant_owner_map(
+            snapshot.instances_by_tenant, tenant_map, users=['user1', 'id-5'])
+        self.assertEqual(sorted(owner_map.keys()), ['id-5', 'user1'])
+        self.assertEqual([instance.alias for instance in owner_map['user1']],
+                         ['instance-1', 'instance-7'])
+        self.assertEqual(self.instances[7].owner, 'user1')
+        # Instances of other users are left alone
+        self.assertEqual(self.instances[2].owner, 'id-2')
+
+    @mock.patch('service.monitoring._select_identities', return_value=[])
+    @mock.patch('service.driver.get_account_driver')
+    @mock.patch('service.monitoring.get_cached_tenant_map')
+    def test_owner_map_refreshes_tenant_map(self, get_cached_tenant_map,
+                                            *args):
+        get_cached_tenant_map.side_effect = \
+            lambda provider, account_driver, force=False: \
+            {'id-1': 'user1', 'id-5': 'user5'} if force else {'id-1': 'user1'}
+        instances = [FakeInstance('instance-1', 'id-1'),
+                     FakeInstance('instance-5', 'id-5')]
+        _get_instance_owner_map(mock.Mock(), all_instances=instances)
+        self.assertEqual([instance.owner for instance in instances],
+                         ['user1', 'user5'])
+        self.assertEqual(get_cached_tenant_map.call_count, 2)
+
+
+class ProviderSnapshotTest(TestCase):
+    def setUp(self):
+        self.provider = mock.Mock(location='test-provider')
+        self.drivers = []
+
+    def _private_driver(self, provider, **kwargs):
+        self.assertEqual(kwargs.get('shared'), False)
+        driver = mock.Mock()
+        driver.user_manager.version = 3
+        driver.list_all_images.return_value = ['image']
+        driver.list_sizes.return_value = ['size']
+
+        def slow_volumes(timeout=None):
+            time.sleep(1.5)
+            return ['volume']
+        driver.list_all_volumes.side_effect = slow_volumes
+        self.drivers.append(driver)
+        return driver
+
+    @mock.patch('service.monitoring.get_cached_tenant_map',
+                return_value={'id-1': 'user1'})
+    @mock.patch('service.monitoring._list_provider_instances',
+                return_value=['instance'])
+    @mock.patch('service.driver.get_account_driver')
+    @mock.patch('service.driver.get_admin_driver')
+    def test_fetch_provider_snapshot(self, get_admin_driver,
+                                     get_account_driver,
+                                     list_provider_instances,
+                                     get_cached_tenant_map):
+        get_admin_driver.side_effect = self._private_driver
+        get_account_driver.side_effect = self._private_driver
+        snapshot = fetch_provider_snapshot(self.provider, time.time() + 1)
+        self.assertEqual(snapshot.instances, ['instance'])
+        self.assertEqual(snapshot.tenant_map, {'id-1': 'user1'})
+        self.assertEqual(snapshot.sizes, ['size'])
+        self.assertEqual(snapshot.machines, ['image'])
+        # Listings that miss the deadline are abandoned
+        self.assertIsNone(snapshot.volumes)
+        self.assertEqual(snapshot.errors, {'volumes': "Deadline exceeded"})
+        # Each listing used a driver of its own
+        self.assertEqual(len(self.drivers), 5)
+        self.assertIn(list_provider_instances.call_args[1]['driver'],
+                      self.drivers)
+        self.assertIn(get_cached_tenant_map.call_args[1]['account_driver'],
+                      self.drivers)
+
+    def test_snapshot_indexes(self):
+        snapshot = ProviderSnapshot(self.provider)
+        instances = [mock.Mock(extra={'tenantId': 'id-%s' % (idx % 2)})
+                     for idx in range(3)]
+        snapshot.instances = instances
+        snapshot.machines = [mock.Mock(id='image-1')]
+        self.assertEqual(snapshot.instances_by_tenant,
+                         {'id-0': [instances[0], instances[2]],
+                          'id-1': [instances[1]]})
+        self.assertEqual(snapshot.images_by_id,
+                         {'image-1': snapshot.machines[0]})
+        self.assertIs(snapshot.images_by_id, snapshot.images_by_id)
+
+
+
+@mock.patch('service.tasks.monitoring._release_lock')
+@mock.patch('service.tasks.monitoring.redis_connection')
+class MonitorResourcesTest(TestCase):
+    def setUp(self):
+        self.provider = ProviderFactory.create()
+
+    @mock.patch('service.tasks.monitoring.fetch_provider_snapshot')
+    @mock.patch('service.tasks.monitoring._acquire_lock', return_value=None)
+    def test_skipped_while_locked(self, acquire_lock,
+                                  fetch_provider_snapshot, *args):
+        report = monitor_resources_for(self.provider.id)
+        self.assertTrue(report['skipped'])
+        self.assertFalse(fetch_provider_snapshot.called)
+
+    @mock.patch('service.tasks.monitoring.monitor_machines_for')
+    @mock.patch('service.tasks.monitoring.monitor_volumes_for')
+    @mock.patch('service.tasks.monitoring.monitor_sizes_for')
+    @mock.patch('service.tasks.monitoring.monitor_instances_for')
+    @mock.patch('service.tasks.monitoring.fetch_provider_snapshot')
+    @mock.patch('service.tasks.monitoring.get_account_driver')
+    @mock.patch('service.tasks.monitoring._acquire_lock',
+                return_value='token')
+    def test_steps_skipped_after_deadline(
+            self, acquire_lock, get_account_driver, fetch_provider_snapshot,
+            monitor_instances_for, monitor_sizes_for, monitor_volumes_for,
+            monitor_machines_for, redis_connection, release_lock):
+        snapshot = mock.Mock(
+            instances=[], tenant_map={}, sizes=[], volumes=[], machines=[],
+            errors={}, timings={})
+        fetch_provider_snapshot.return_value = snapshot
+
+        def slow_instances(*args, **kwargs):
+            time.sleep(1.1)
+        monitor_instances_for.side_effect = slow_instances
+        report = monitor_resources_for(self.provider.id, deadline=1)
+        self.assertFalse(report['skipped'])
+        self.assertEqual(report['errors'],
+                         {'sizes': "Deadline exceeded",
+                          'volumes': "Deadline exceeded",
+                          'machines': "Deadline exceeded"})
+        self.assertIn('instances', report['results'])
+        self.assertFalse(monitor_sizes_for.called)
+        self.assertFalse(monitor_machines_for.called)
+        release_lock.assert_called_once_with(
+            redis_connection.return_value, mock.ANY, 'token')
+
+
+class ImageFingerprintTest(TestCase):
+    def test_image_fingerprint(self):
+        from service.tasks.monitoring import _image_fingerprint
+        image = {'id': 'image-1', 'updated_at': '2017-01-01T00:00:00Z',
+                 'checksum': 'abc', 'visibility': 'shared'}
+        fingerprint = _image_fingerprint(image, ['user1', 'user2'])
+        self.assertEqual(
+            fingerprint, _image_fingerprint(dict(image), ['user1', 'user2']))
+        self.assertNotEqual(
+            fingerprint, _image_fingerprint(image, ['user1']))
+        image['updated_at'] = '2017-01-02T00:00:00Z'
+        self.assertNotEqual(
+            fingerprint, _image_fingerprint(image, ['user1', 'user2']))
+
+
+class FakeImage(dict):
+    def __init__(self, image_id, updated_at):
+        super(FakeImage, self).__init__(
+            id=image_id, updated_at=updated_at, checksum='abc',
+            visibility='public', owner='id-1')
+        self.id = image_id
+
+
+@override_settings(ENFORCING=False, MONITOR_MACHINES_FULL_SWEEP=3600)
+@mock.patch('service.tasks.monitoring.update_image_membership')
+@mock.patch('service.tasks.monitoring.MachineValidationPluginManager')
+@mock.patch('service.tasks.monitoring.redis_connection')
+class MonitorMachinesTest(TestCase):
+    def setUp(self):
+        user = UserFactory.create(username='test-username')
+        self.provider = ProviderFactory.create()
+        identity = IdentityFactory.create_identity(
+            created_by=user, provider=self.provider)
+        self.machines = dict(
+            (str(machine.instance_source.identifier), machine)
+            for machine in [
+                ProviderMachineFactory.create_provider_machine(
+                    user, identity)
+                for _ in range(2)])
+        self.images = [FakeImage(image_id, '2017-01-01T00:00:00Z')
+                       for image_id in sorted(self.machines)]
+        self.account_driver = mock.Mock()
+        self.account_driver.projects_by_id.return_value = {}
+
+    def _monitor_machines(self):
+        with mock.patch('service.tasks.monitoring.convert_glance_image',
+                        side_effect=lambda account_driver, image,
+                        provider_uuid, owner: (self.machines[image.id],
+                                               False)):
+            return monitor_machines_for(
+                self.provider.id, cloud_machines=self.images,
+                account_driver=self.account_driver)
+
+    def _fingerprints(self):
+        return dict(ProviderMachine.objects.filter(
+            id__in=[machine.id for machine in self.machines.values()]
+        ).values_list('instance_source__identifier', 'cloud_fingerprint'))
+
+    def test_unchanged_images_are_skipped(self, redis_connection, *args):
+        # The first run starts a full sweep (sets the marker), the second
+        # finds the marker
+        redis_connection.return_value.set.side_effect = [True, False]
+        synced = self._monitor_machines()
+        self.assertEqual(len(synced), 2)
+        fingerprints = self._fingerprints()
+        self.assertNotIn('', fingerprints.values())
+
+        self.images[1]['updated_at'] = '2017-01-02T00:00:00Z'
+        synced = self._monitor_machines()
+        self.assertEqual(synced, [self.machines[self.images[1].id]])
+        new_fingerprints = self._fingerprints()
+        self.assertEqual(new_fingerprints[self.images[0].id],
+                         fingerprints[self.images[0].id])
+        self.assertNotEqual(new_fingerprints[self.images[1].id],
+                            fingerprints[self.images[1].id])
+        redis_connection.return_value.set.assert_called_with(
+            MACHINES_SWEEP_KEY.format(self.provider.id), mock.ANY,
+            nx=True, ex=3600)
+
+
+class FakeEshInstance(object):
+    def __init__(self, alias, size, status):
+        self.id = alias
+        self.name = alias
+        self.ip = '10.0.0.1'
+        self.source = None
+        self.size = mock.Mock(id=size.alias)
+        self.extra = {'status': status, 'metadata': {}}
+
+    def get_status(self):
+        return self.extra['status']
+
+
+@mock.patch('service.monitoring.get_cached_driver')
+@mock.patch('service.tasks.monitoring.get_cached_driver')
+class InstanceReconciliationTest(TestCase):
+    """
+    The bulk reconciliation creates the same histories as the
+    per-instance one.
+    """
+
+    def setUp(self):
+        now = timezone.now()
+        user = UserFactory.create(username='user1')
+        self.provider = ProviderFactory.create(
+            type=ProviderTypeFactory.create(name='openstack'))
+        identity = IdentityFactory.create_identity(
+            created_by=user, provider=self.provider)
+        Credential.objects.create(
+            identity=identity, key='ex_project_name', value='user1')
+        machine = ProviderMachineFactory.create_provider_machine(
+            user, identity)
+        self.size = SizeFactory.create(provider=self.provider)
+        active = InstanceStatusFactory.create(name='active')
+        InstanceStatusFactory.create(name='suspended')
+        for alias in ('instance-1', 'instance-2', 'instance-3'):
+            instance = InstanceFactory.create(
+                name=alias, provider_alias=alias,
+                source=machine.instance_source, created_by=user,
+                created_by_identity=identity,
+                start_date=now - timedelta(hours=2))
+            InstanceHistoryFactory.create(
+                status=active, size=self.size, instance=instance,
+                start_date=now - timedelta(hours=2))
+        # instance-2 was suspended, instance-3 is gone
+        self.instance_map = {'user1': [
+            FakeEshInstance('instance-1', self.size, 'active'),
+            FakeEshInstance('instance-2', self.size, 'suspended'),
+        ]}
+
+    def _reconcile(self, bulk):
+        with transaction.atomic(), \
+                mock.patch('service.tasks.monitoring._get_instance_owner_map',
+                           return_value=self.instance_map), \
+                mock.patch('core.models.instance._esh_instance_size_to_core',
+                           return_value=self.size):
+            monitor_instances_for(self.provider.id, bulk=bulk)
+            histories = sorted(
+                (history.instance.provider_alias, history.status.name,
+                 history.end_date is None)
+                for history in InstanceStatusHistory.objects.filter(
+                    instance__provider_alias__startswith='instance-'))
+            end_dated = sorted(Instance.objects.filter(
+                end_date__isnull=False).values_list(
+                    'provider_alias', flat=True))
+            transaction.set_rollback(True)
+        return histories, end_dated
+
+    def test_bulk_matches_per_instance(self, *args):
+        histories, end_dated = self._reconcile(bulk=False)
+        self.assertEqual(histories, [
+            ('instance-1', 'active', True),
+            ('instance-2', 'active', False),
+            ('instance-2', 'suspended', True),
+            ('instance-3', 'active', False),
+        ])
+        self.assertEqual(end_dated, ['instance-3'])
+        self.assertEqual(self._reconcile(bulk=True), (histories, end_dated))
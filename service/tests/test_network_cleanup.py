@@ -0,0 +1,108 @@
+import threading
+
+import mock
+from django.test import TestCase
+
+from service.network_cleanup import clean_network_resources, plan_cleanup
+
+
+class FakeInstance(object):
+    def __init__(self, alias, tenant_id, ip, networks, active):
+        self.id = alias
+        self.ip = ip
+        self.active = active
+        self.extra = {'tenantId': tenant_id,
+                      'addresses': dict((name, []) for name in networks)}
+
+
+class PlanCleanupTest(TestCase):
+    def setUp(self):
+        self.listing = mock.Mock(
+            project_names={'id-1': 'user1', 'id-2': 'user2'},
+            instances=[
+                FakeInstance('instance-1', 'id-1', '10.0.0.1',
+                             ['user1-net'], active=True),
+                FakeInstance('instance-2', 'id-2', '10.0.0.2',
+                             ['user2-net'], active=False),
+            ],
+            floating_ips=[
+                {'tenant_id': 'id-1', 'floating_ip_address': '1.1.1.1',
+                 'port_id': 'port-1'},
+                {'tenant_id': 'id-1', 'floating_ip_address': '1.1.1.2',
+                 'port_id': None},
+            ],
+            ports=[{'network_id': 'net-2', 'device_owner': 'compute:nova'}],
+            networks=[
+                {'id': 'net-1', 'name': 'user1-net', 'tenant_id': 'id-1'},
+                {'id': 'net-2', 'name': 'user2-other', 'tenant_id': 'id-2'},
+                {'id': 'net-3', 'name': 'user2-unused', 'tenant_id': 'id-2'},
+                {'id': 'net-4', 'name': 'public', 'tenant_id': 'id-2',
+                 'router:external': True},
+            ],
+            routers=[{'name': 'user2-router', 'tenant_id': 'id-2'}])
+
+    def test_plan_cleanup(self):
+        plan = plan_cleanup(
+            self.listing, lambda instance: not instance.active)
+        self.assertEqual(plan, {
+            'user1': {'floating_ips': ['1.1.1.2']},
+            'user2': {'instance_ips': ['instance-2'],
+                      'networks': ['user2-unused'],
+                      'routers': ['user2-router']},
+        })
+
+    def test_plan_cleanup_resources(self):
+        plan = plan_cleanup(
+            self.listing, lambda instance: not instance.active,
+            resources=['floating_ips'])
+        self.assertEqual(plan, {'user1': {'floating_ips': ['1.1.1.2']}})
+
+
+class CleanNetworkResourcesTest(TestCase):
+    def setUp(self):
+        self.listing = mock.Mock(
+            project_names={'id-1': 'user1', 'id-2': 'user2'},
+            instances=[
+                FakeInstance('instance-1', 'id-1', '10.0.0.1', [],
+                             active=False),
+                FakeInstance('instance-2', 'id-2', '10.0.0.2', [],
+                             active=False),
+            ],
+            floating_ips=[],
+            ports=[],
+            networks=[
+                {'id': 'net-1', 'name': 'user1-net', 'tenant_id': 'id-1'},
+                {'id': 'net-2', 'name': 'user2-net', 'tenant_id': 'id-2'},
+            ],
+            routers=[])
+        self.account_driver = mock.Mock()
+        self.account_driver.admin_driver._is_inactive_instance = \
+            lambda instance: not instance.active
+        self.identities = {'user1': (mock.Mock(name='identity1'), True),
+                           'user2': (mock.Mock(name='identity2'), True)}
+
+    def test_networks_removed_on_calling_thread(self):
+        network_threads = []
+        self.account_driver.delete_user_network.side_effect = \
+            lambda identity: network_threads.append(
+                threading.current_thread())
+        with mock.patch('service.driver.get_account_driver',
+                        return_value=self.account_driver), \
+                mock.patch('service.network_cleanup.NetworkListing',
+                           return_value=self.listing), \
+                mock.patch('service.network_cleanup._project_identities',
+                           return_value=self.identities), \
+                mock.patch('service.driver.get_esh_driver'), \
+                mock.patch('service.tasks.driver.'
+                           '_remove_ips_from_inactive_instances'):
+            report = clean_network_resources(mock.Mock(id=1))
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(report['removed'], {
+            'user1': {'instance_ips': 1, 'networks': 1},
+            'user2': {'instance_ips': 1, 'networks': 1},
+        })
+        self.assertEqual(
+            [call[0][0] for call in
+             self.account_driver.delete_user_network.call_args_list],
+            [self.identities['user1'][0], self.identities['user2'][0]])
+        self.assertEqual(network_threads, [threading.current_thread()] * 2)
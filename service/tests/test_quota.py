@@ -0,0 +1,75 @@
+import mock
+from django.test import TestCase
+
+from core.models import Quota
+from service.quota import _instance_usage, evaluate_instance_quota, evaluate_storage_quota
+
+
+class QuotaEvaluationTest(TestCase):
+    def setUp(self):
+        self.quota = Quota(cpu=4, memory=8, instance_count=2, floating_ip_count=1, port_count=2,
+                           storage=100, storage_count=2, snapshot_count=-1)
+        self.instance_usage = {
+            'cpu': 2, 'memory': 4.0, 'instance_count': 1, 'floating_ip_count': 0, 'port_count': 1}
+        self.storage_usage = {'storage': 50, 'storage_count': 1, 'snapshot_count': 20}
+
+    def test_instance_within_quota(self):
+        failures = evaluate_instance_quota(
+            self.quota, self.instance_usage,
+            new_cpu=2, new_ram=4096, new_instance=1, new_floating_ip=1, new_port=1)
+        self.assertEqual(failures, [])
+
+    def test_instance_reports_every_failed_limit(self):
+        failures = evaluate_instance_quota(
+            self.quota, self.instance_usage,
+            new_cpu=4, new_ram=2048, new_instance=1, new_floating_ip=2, new_port=1)
+        self.assertEqual(len(failures), 2)
+        self.assertTrue(failures[0].startswith('CPU Quota Exceeded'))
+        self.assertTrue(failures[1].startswith('Floating IP Quota Exceeded'))
+
+    def test_unknown_port_usage_passes(self):
+        self.instance_usage['port_count'] = None
+        failures = evaluate_instance_quota(self.quota, self.instance_usage, new_port=10)
+        self.assertEqual(failures, [])
+
+    def test_unknown_floating_ip_usage_passes(self):
+        self.instance_usage['floating_ip_count'] = None
+        failures = evaluate_instance_quota(self.quota, self.instance_usage, new_floating_ip=10)
+        self.assertEqual(failures, [])
+
+    def test_storage_quota(self):
+        self.assertEqual(evaluate_storage_quota(
+            self.quota, self.storage_usage, new_disk=50, new_volume=1, new_snapshot=1), [])
+        failures = evaluate_storage_quota(self.quota, self.storage_usage, new_disk=51, new_volume=2)
+        self.assertEqual(len(failures), 2)
+
+    def test_negative_storage_limits_are_unlimited(self):
+        self.quota.storage = -1
+        self.quota.storage_count = -1
+        self.assertEqual(evaluate_storage_quota(
+            self.quota, self.storage_usage, new_disk=500, new_volume=5), [])
+
+
+@mock.patch('service.quota._pre_cache_sizes')
+class InstanceUsageTest(TestCase):
+    def setUp(self):
+        self.driver = mock.Mock()
+        self.driver.list_instances.return_value = []
+        self.identity = mock.Mock()
+
+    @mock.patch('service.quota._count_ports')
+    def test_unenforced_limits_are_not_listed(self, count_ports, pre_cache_sizes):
+        self.identity.quota = Quota(floating_ip_count=-1, port_count=None)
+        usage = _instance_usage(self.identity, self.driver)
+        self.assertIsNone(usage['floating_ip_count'])
+        self.assertIsNone(usage['port_count'])
+        self.assertFalse(self.driver._connection.ex_list_floating_ips.called)
+        self.assertFalse(count_ports.called)
+
+    @mock.patch('service.quota._count_ports', return_value=3)
+    def test_failed_floating_ip_listing(self, count_ports, pre_cache_sizes):
+        self.identity.quota = Quota(floating_ip_count=1, port_count=5)
+        self.driver._connection.ex_list_floating_ips.side_effect = Exception("Unavailable")
+        usage = _instance_usage(self.identity, self.driver)
+        self.assertIsNone(usage['floating_ip_count'])
+        self.assertEqual(usage['port_count'], 3)